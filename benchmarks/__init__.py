@@ -0,0 +1,7 @@
+"""
+Benchmarks for the build tools.
+
+Run individual benchmarks as modules from the repository root, e.g.::
+
+    uv run python -m benchmarks.aggregation
+"""
@@ -0,0 +1,111 @@
+"""
+Benchmark the vectorised agglomeration against the old per-type loop.
+
+Usage::
+
+    uv run python -m benchmarks.aggregation --neurons 150000 --columns 100
+"""
+
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from build_tools.aggregation import agglomerate
+
+parser = argparse.ArgumentParser(
+    description="Benchmark agglomeration of neuron meta data into types."
+)
+parser.add_argument(
+    "--neurons", type=int, default=150_000, help="Number of neurons (rows)."
+)
+parser.add_argument(
+    "--columns", type=int, default=100, help="Number of meta data columns."
+)
+parser.add_argument("--types", type=int, default=8_000, help="Number of types.")
+parser.add_argument("--seed", type=int, default=0, help="Seed for the data.")
+
+
+def make_meta_data(n_neurons, n_columns, n_types, seed=0):
+    """Generate MCNS-like meta data with a mix of column types."""
+    rng = np.random.default_rng(seed)
+
+    types = np.array([f"type_{i}" for i in range(n_types)], dtype=object)
+    data = {
+        "bodyId": rng.choice(10**11, size=n_neurons, replace=False),
+        "mapping": pd.array(types[rng.integers(0, n_types, n_neurons)], "string"),
+    }
+    for i in range(n_columns - len(data)):
+        if i % 3 == 0:
+            # Low-cardinality strings with some missing values
+            col = pd.array(
+                np.array(["L", "R", "M", None], dtype=object)[
+                    rng.integers(0, 4, n_neurons)
+                ],
+                dtype="string",
+            )
+        elif i % 3 == 1:
+            # Values that are mostly constant within a type
+            col = pd.array(
+                types[rng.integers(0, n_types, n_types)][
+                    rng.integers(0, n_types, n_neurons) // 100 * 100 % n_types
+                ],
+                dtype="string",
+            )
+        else:
+            # Numerical values
+            col = rng.integers(0, 5, n_neurons).astype(float)
+            col[rng.random(n_neurons) < 0.2] = np.nan
+        data[f"col_{i}"] = col
+
+    return pd.DataFrame(data)
+
+
+def agglomerate_loop(table, by):
+    """The original implementation: loop over types and columns."""
+    records = {}
+    for t, this in table.groupby(by):
+        record = {}
+        for col in this.columns:
+            vals = this[col].unique()
+            vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
+            if len(vals) == 1:
+                record[col] = vals[0]
+            elif len(vals) == 0:
+                record[col] = "N/A"
+            else:
+                record[col] = "; ".join(sorted(vals.astype(str)))
+        records[t] = record
+    return records
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    meta = make_meta_data(args.neurons, args.columns, args.types, seed=args.seed)
+    print(
+        f"Agglomerating {len(meta):,} neurons x {len(meta.columns)} columns "
+        f"into {meta.mapping.nunique():,} types",
+        flush=True,
+    )
+
+    start = time.perf_counter()
+    expected = agglomerate_loop(meta, "mapping")
+    t_loop = time.perf_counter() - start
+    print(f"  per-type loop: {t_loop:.2f}s", flush=True)
+
+    start = time.perf_counter()
+    result = agglomerate(meta, "mapping").to_dict("index")
+    t_vect = time.perf_counter() - start
+    print(f"  vectorised:    {t_vect:.2f}s", flush=True)
+
+    # Make sure we get the same records
+    assert list(expected) == list(result), "Types differ"
+    for t in expected:
+        for col, val in expected[t].items():
+            assert str(val) == str(
+                result[t][col]
+            ), f"{t}/{col}: {val} != {result[t][col]}"
+
+    print(f"  speed-up:      {t_loop / t_vect:.1f}x (identical records)", flush=True)
@@ -0,0 +1,532 @@
+"""
+Track benchmark results over time and flag regressions.
+
+Results of the pipeline benchmark (`benchmarks.pipeline --output`) and build
+profiles (`build_pages.py --profile`) are stored in a local SQLite database,
+keyed by commit and data version. A run can then be compared stage by stage
+against a baseline (all runs of a given commit on the same data): stages
+that are significantly slower (one-sided permutation test on the median
+times) are flagged.
+
+Note that only runs with several samples per stage can be tested: use
+`--repeat` for the pipeline benchmark (at least 4 per side for p < 0.05, as
+different splits of the samples can have the same difference of medians).
+Stages that are slower by more than the threshold but not significantly so
+are flagged as "slower?". For build profiles, the samples are the individual
+calls of each stage (e.g. one per page or thumbnail).
+
+Usage::
+
+    uv run python -m benchmarks.history record results.json
+    uv run python -m benchmarks.history compare results.json --baseline main
+    uv run python -m benchmarks.history list
+"""
+
+import sys
+import json
+import sqlite3
+import argparse
+import itertools
+import subprocess
+
+import numpy as np
+
+from math import comb
+from pathlib import Path
+
+# Default location of the history database
+HISTORY_DB = Path(__file__).parent.parent / ".cache" / "benchmark_history.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    benchmark TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    commit_id TEXT,
+    data_version TEXT,
+    params TEXT,
+    environment TEXT
+);
+CREATE TABLE IF NOT EXISTS samples (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    stage TEXT NOT NULL,
+    wall REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_data ON runs (benchmark, data_version);
+CREATE INDEX IF NOT EXISTS samples_by_run ON samples (run_id);
+"""
+
+
+class BenchmarkHistory:
+    """Benchmark runs stored in a SQLite database.
+
+    Parameters
+    ----------
+    filepath :  Path
+                Path to the database (created if it doesn't exist).
+
+    """
+
+    def __init__(self, filepath=HISTORY_DB):
+        self.filepath = Path(filepath)
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.filepath)
+        self._db.executescript(SCHEMA)
+
+    def __repr__(self):
+        return f"<BenchmarkHistory(filepath={self.filepath})>"
+
+    def add(self, run):
+        """Add a run (see `load_run`) and return its ID."""
+        with self._db:
+            cur = self._db.execute(
+                "INSERT INTO runs (benchmark, timestamp, commit_id, data_version, "
+                "params, environment) VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    run["benchmark"],
+                    run["timestamp"],
+                    run["commit"],
+                    run["data_version"],
+                    json.dumps(run["params"]),
+                    json.dumps(run["environment"]),
+                ),
+            )
+            self._db.executemany(
+                "INSERT INTO samples (run_id, stage, wall) VALUES (?, ?, ?)",
+                [
+                    (cur.lastrowid, stage, wall)
+                    for stage, samples in run["stages"].items()
+                    for wall in samples
+                ],
+            )
+        return cur.lastrowid
+
+    def runs(self, benchmark=None, data_version=None):
+        """List runs (most recent first).
+
+        Returns
+        -------
+        list of dicts
+                    With the `id`, `benchmark`, `timestamp`, `commit` and
+                    `data_version` of each run.
+
+        """
+        query = "SELECT id, benchmark, timestamp, commit_id, data_version FROM runs"
+        conditions, args = [], []
+        if benchmark is not None:
+            conditions.append("benchmark = ?")
+            args.append(benchmark)
+        if data_version is not None:
+            conditions.append("data_version = ?")
+            args.append(data_version)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY timestamp DESC, id DESC"
+
+        keys = ("id", "benchmark", "timestamp", "commit", "data_version")
+        return [dict(zip(keys, row)) for row in self._db.execute(query, args)]
+
+    def samples(self, run_ids):
+        """Collect the samples of the given runs by stage."""
+        run_ids = list(run_ids)
+        stages = {}
+        rows = self._db.execute(
+            f"SELECT stage, wall FROM samples WHERE run_id IN "
+            f"({', '.join('?' * len(run_ids))}) ORDER BY rowid",
+            run_ids,
+        )
+        for stage, wall in rows:
+            stages.setdefault(stage, []).append(wall)
+        return stages
+
+    def baseline(self, run, ref=None, exclude=None):
+        """Find the baseline runs for a run.
+
+        Parameters
+        ----------
+        run :       dict
+                    The run to compare (see `load_run`).
+        ref :       str, optional
+                    A commit (or anything `git rev-parse` understands, e.g. a
+                    branch) or a run ID. If None, the most recent run of
+                    another commit is used.
+        exclude :   int, optional
+                    ID of a run to ignore (e.g. the run itself).
+
+        Returns
+        -------
+        commit :    str
+                    The baseline commit.
+        run_ids :   list of int
+                    All runs of that commit on the same benchmark and data.
+
+        """
+        runs = [
+            r
+            for r in self.runs(run["benchmark"], run["data_version"])
+            if r["id"] != exclude
+        ]
+        if ref is None:
+            runs_before = [r for r in runs if r["commit"] != run["commit"]]
+            if not runs_before:
+                return None, []
+            commit = runs_before[0]["commit"]
+        elif ref.isdigit() and any(r["id"] == int(ref) for r in runs):
+            return next(r["commit"] for r in runs if r["id"] == int(ref)), [int(ref)]
+        else:
+            commit = git_commit(ref) or ref
+            matches = {
+                r["commit"] for r in runs if (r["commit"] or "").startswith(commit)
+            }
+            if len(matches) != 1:
+                return None, []
+            commit = matches.pop()
+
+        return commit, [r["id"] for r in runs if r["commit"] == commit]
+
+
+def load_run(filepath, commit=None, data_version=None):
+    """Load the results of a benchmark or a build profile as a run.
+
+    Parameters
+    ----------
+    filepath :      Path
+                    Output of `benchmarks.pipeline --output` or a report of
+                    `build_pages.py --profile`.
+    commit :        str, optional
+                    Overrides the commit of the run.
+    data_version :  str, optional
+                    Overrides the data version of the run.
+
+    Returns
+    -------
+    dict
+                    See `make_run`.
+
+    """
+    filepath = Path(filepath)
+    results = json.loads(filepath.read_text())
+    results.setdefault("timestamp", filepath.stat().st_mtime)
+    return make_run(results, commit=commit, data_version=data_version)
+
+
+def make_run(results, commit=None, data_version=None):
+    """Turn the results of a benchmark or a build profile into a run.
+
+    Parameters
+    ----------
+    results :       dict
+                    Results of `benchmarks.pipeline` or a report of
+                    `build_pages.py --profile`.
+    commit :        str, optional
+                    Overrides the commit of the run. Build profiles don't
+                    record one, so the current HEAD is used by default.
+    data_version :  str, optional
+                    Overrides the data version of the run.
+
+    Returns
+    -------
+    dict
+                    With the `benchmark`, `timestamp`, `commit`,
+                    `data_version`, `params`, `environment` and the wall
+                    time samples by `stages`.
+
+    """
+    if results.get("benchmark") == "pipeline":
+        params = results["params"]
+        run = {
+            # (timings with memory tracking are not comparable to those without)
+            "benchmark": "pipeline" + ("+memory" if results.get("memory") else ""),
+            "timestamp": results["timestamp"],
+            "commit": results["environment"].get("commit"),
+            "data_version": "synthetic-{neurons}-{edges}-{types}-{seed}".format(
+                **params
+            ),
+            "params": params,
+            "environment": results["environment"],
+            "stages": {s["name"]: s["times"] for s in results["stages"]},
+        }
+    elif "records" in results:
+        stages = {}
+        for r in results["records"]:
+            stages.setdefault(r["stage"], []).append(r["wall"])
+        memory = any("rss_peak" in r for r in results["records"])
+        run = {
+            "benchmark": "build" + ("+memory" if memory else ""),
+            "timestamp": results["timestamp"],
+            "commit": results.get("commit") or git_commit("HEAD"),
+            "data_version": results.get("data_version"),
+            "params": {},
+            "environment": {},
+            "stages": stages,
+        }
+    else:
+        raise ValueError("Results are neither from a benchmark nor a build profile")
+
+    if commit is not None:
+        run["commit"] = git_commit(commit) or commit
+    if data_version is not None:
+        run["data_version"] = data_version
+    return run
+
+
+def compare(baseline, current, alpha=0.05, threshold=0.1):
+    """Compare the samples of each stage against a baseline.
+
+    Parameters
+    ----------
+    baseline :  dict
+                Maps stages to the wall time samples of the baseline.
+    current :   dict
+                Maps stages to the wall time samples of the run to compare.
+    alpha :     float
+                Significance level.
+    threshold : float
+                Minimum relative change of the median to flag a stage (e.g.
+                0.1 = 10% slower).
+
+    Returns
+    -------
+    list of dicts
+                One per stage present in both with the `baseline` and
+                `current` median, the relative `change`, the p-value of the
+                stage being slower (`p`, None if even the most extreme split
+                of the samples can't reach `alpha`) and a `verdict`:
+                "slower" (significant regression), "slower?" (above the
+                threshold but not significant or too few samples to test),
+                "faster" or "".
+
+    """
+    comparison = []
+    for stage, current_samples in current.items():
+        if stage not in baseline:
+            continue
+        b, c = np.asarray(baseline[stage]), np.asarray(current_samples)
+        before, after = np.median(b), np.median(c)
+        change = after / before - 1 if before > 0 else 0.0
+
+        p_slower = p_faster = None
+        if len(b) and len(c):
+            p_slower, p_faster, p_min = _permutation_test(b, c)
+            if p_min > alpha:
+                p_slower = None
+
+        verdict = ""
+        if change >= threshold:
+            significant = p_slower is not None and p_slower <= alpha
+            verdict = "slower" if significant else "slower?"
+        elif change <= -threshold and p_faster is not None and p_faster <= alpha:
+            verdict = "faster"
+
+        comparison.append(
+            {
+                "stage": stage,
+                "baseline": before,
+                "current": after,
+                "change": change,
+                "p": p_slower,
+                "verdict": verdict,
+            }
+        )
+    return comparison
+
+
+def report(comparison, baseline_commit, n_runs):
+    """Print a comparison (see `compare`)."""
+    print(
+        f"Compared against {(baseline_commit or 'unknown commit')[:10]} "
+        f"({n_runs} run{'s' if n_runs != 1 else ''}):",
+        flush=True,
+    )
+    print(
+        f"  {'stage':<40} {'baseline [s]':>12} {'current [s]':>12} "
+        f"{'change':>8} {'p':>7}",
+        flush=True,
+    )
+    for c in comparison:
+        p = f"{c['p']:>7.3f}" if c["p"] is not None else f"{'n/a':>7}"
+        print(
+            f"  {c['stage']:<40} {c['baseline']:>12.3f} {c['current']:>12.3f} "
+            f"{c['change']:>+8.1%} {p}  {c['verdict'].upper()}",
+            flush=True,
+        )
+
+
+def check(run, history, ref=None, exclude=None, alpha=0.05, threshold=0.1):
+    """Compare a run against its baseline and report regressions.
+
+    Parameters
+    ----------
+    run :       dict
+                The run to compare (see `load_run`).
+    history :   BenchmarkHistory
+                The history to take the baseline from.
+    ref :       str, optional
+                The baseline (see `BenchmarkHistory.baseline`).
+    exclude :   int, optional
+                ID of a run to ignore (e.g. the run itself if recorded).
+    alpha :     float
+                Significance level.
+    threshold : float
+                Minimum relative change to flag a stage.
+
+    Returns
+    -------
+    list of str
+                The stages that are significantly slower.
+
+    """
+    commit, run_ids = history.baseline(run, ref, exclude=exclude)
+    if not run_ids:
+        print(
+            f"No baseline found for {run['benchmark']} on data version "
+            f"{run['data_version']} ({ref or 'previous commit'}).",
+            flush=True,
+        )
+        return []
+
+    comparison = compare(
+        history.samples(run_ids), run["stages"], alpha=alpha, threshold=threshold
+    )
+    report(comparison, commit, len(run_ids))
+    return [c["stage"] for c in comparison if c["verdict"] == "slower"]
+
+
+def git_commit(ref="HEAD"):
+    """Resolve a git reference to a commit (None if that fails)."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _permutation_test(b, c, n_resamples=10_000, seed=0):
+    """One-sided permutation tests on the difference of medians.
+
+    Returns
+    -------
+    p_slower :  float
+                p-value for `c` being slower than `b`.
+    p_faster :  float
+                p-value for `c` being faster than `b`.
+    p_min :     float
+                The smallest `p_slower` these samples can give (i.e. for the
+                most extreme split). This can be larger than 1 / (number of
+                splits) because different splits can have the same
+                difference of medians.
+
+    """
+    pooled = np.concatenate([b, c])
+    observed = np.median(c) - np.median(b)
+
+    # Enumerate all splits if there are few, otherwise sample them
+    if comb(len(pooled), len(b)) <= n_resamples:
+        splits = itertools.combinations(range(len(pooled)), len(b))
+    else:
+        rng = np.random.default_rng(seed)
+        splits = (rng.permutation(len(pooled))[: len(b)] for _ in range(n_resamples))
+
+    diffs = []
+    for split in splits:
+        mask = np.zeros(len(pooled), dtype=bool)
+        mask[list(split)] = True
+        diffs.append(np.median(pooled[~mask]) - np.median(pooled[mask]))
+    diffs = np.array(diffs)
+
+    # (with a small tolerance for floating point noise)
+    eps = 1e-12 * max(abs(observed), 1)
+    p_slower = np.mean(diffs >= observed - eps)
+    p_faster = np.mean(diffs <= observed + eps)
+    p_min = np.mean(diffs >= diffs.max() - eps)
+    return float(p_slower), float(p_faster), float(p_min)
+
+
+parser = argparse.ArgumentParser(
+    description="Track benchmark results over time and flag regressions."
+)
+parser.add_argument(
+    "--db", type=Path, default=HISTORY_DB, help="Path to the history database."
+)
+subparsers = parser.add_subparsers(dest="command", required=True)
+
+record_parser = subparsers.add_parser(
+    "record", help="Add benchmark results or a build profile to the history."
+)
+compare_parser = subparsers.add_parser(
+    "compare", help="Compare benchmark results or a build profile to a baseline."
+)
+for p in (record_parser, compare_parser):
+    p.add_argument(
+        "results", type=Path, help="Benchmark results or build profile (JSON)."
+    )
+    p.add_argument("--commit", help="Commit of the run (overrides the results).")
+    p.add_argument(
+        "--data-version", help="Data version of the run (overrides the results)."
+    )
+    p.add_argument(
+        "--baseline",
+        help="Commit, branch or run ID to compare against (default: the most "
+        "recent run of another commit).",
+    )
+    p.add_argument("--alpha", type=float, default=0.05, help="Significance level.")
+    p.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="Minimum relative change of a stage's median time to flag it.",
+    )
+record_parser.add_argument(
+    "--compare",
+    action="store_true",
+    help="Also compare against the baseline after recording.",
+)
+list_parser = subparsers.add_parser("list", help="List the recorded runs.")
+list_parser.add_argument("--benchmark", help="Only list runs of this benchmark.")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    history = BenchmarkHistory(args.db)
+
+    if args.command == "list":
+        from datetime import datetime
+
+        print(
+            f"  {'id':>5}  {'date':<19}  {'benchmark':<16} {'commit':<10}  "
+            "data version",
+            flush=True,
+        )
+        for r in history.runs(args.benchmark):
+            date = datetime.fromtimestamp(r["timestamp"]).strftime("%Y-%m-%d %H:%M:%S")
+            print(
+                f"  {r['id']:>5}  {date}  {r['benchmark']:<16} "
+                f"{(r['commit'] or '')[:10]:<10}  {r['data_version']}",
+                flush=True,
+            )
+        sys.exit()
+
+    run = load_run(args.results, commit=args.commit, data_version=args.data_version)
+    run_id = None
+    if args.command == "record":
+        run_id = history.add(run)
+        print(f"Recorded run {run_id} ({run['benchmark']}).", flush=True)
+        if not args.compare:
+            sys.exit()
+
+    slower = check(
+        run,
+        history,
+        args.baseline,
+        exclude=run_id,
+        alpha=args.alpha,
+        threshold=args.threshold,
+    )
+    if slower:
+        print(f"Significantly slower: {', '.join(slower)}", flush=True)
+        sys.exit(1)
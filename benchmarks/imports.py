@@ -0,0 +1,86 @@
+"""
+Report the import time of the build tools and check for heavy imports.
+
+Importing the build tools for a run with `--skip-thumbnails --skip-graphs`
+(as on CI) should not pull in the rendering or graph stacks. With `--check`,
+this exits with an error if any of them are imported.
+
+Usage::
+
+    uv run python -m benchmarks.imports --top 15 --check
+"""
+
+import sys
+import argparse
+import subprocess
+
+# What `build_pages.py` imports at start-up
+MODULES = ("build_tools.loading", "build_tools.building", "build_tools.thumbnails")
+
+# Packages that should only be imported once the respective stage runs
+HEAVY = ("octarine", "cloudvolume", "navis", "d3graph", "neuprint", "cocoa", "dvid")
+
+parser = argparse.ArgumentParser(
+    description="Report import times of the build tools (via `python -X importtime`)."
+)
+parser.add_argument(
+    "--top", type=int, default=10, help="Number of slowest packages to show."
+)
+parser.add_argument(
+    "--check",
+    action="store_true",
+    help="Exit with an error if any of the heavy packages are imported.",
+)
+
+
+def import_times(modules):
+    """Import modules in a fresh interpreter and parse the import times.
+
+    Returns
+    -------
+    dict
+                Maps the names of all imported modules to their cumulative
+                import time in seconds.
+    top_level : list of str
+                The modules imported directly by `modules` (or by the
+                interpreter itself), i.e. not nested in another import.
+
+    """
+    code = "; ".join(f"import {m}" for m in modules)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"Failed to import {modules}:\n{proc.stderr}")
+
+    times, top_level = {}, []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative) / 1e6
+        # Nested imports are indented
+        if not name[1:].startswith(" "):
+            top_level.append(name.strip())
+
+    return times, top_level
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    times, top_level = import_times(MODULES)
+    total = sum(times[name] for name in top_level)
+    print(f"Imported {', '.join(MODULES)} in {total:.2f}s", flush=True)
+    slowest = sorted(top_level, key=lambda name: times[name], reverse=True)
+    width = max(len(name) for name in slowest[: args.top])
+    for name in slowest[: args.top]:
+        print(f"  {name + ':':<{width + 1}} {times[name]:.3f}s", flush=True)
+
+    heavy = sorted({name.split(".")[0] for name in times} & set(HEAVY))
+    if heavy:
+        print(f"Heavy packages imported at start-up: {', '.join(heavy)}", flush=True)
+        if args.check:
+            sys.exit(1)
@@ -0,0 +1,513 @@
+"""
+Benchmark the stages of the build pipeline on synthetic data.
+
+A synthetic data set (see `benchmarks/synthetic.py`) is written as fixtures
+and the pages are built from it offline, into a temporary build directory.
+Each stage is timed separately so that we can see how it scales with the
+number of neurons and edges. Thumbnails are never rendered.
+
+Usage::
+
+    uv run python -m benchmarks.pipeline --scale medium --output results.json
+    uv run python -m benchmarks.pipeline --neurons 200000 --edges 20000000
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import contextlib
+
+import numpy as np
+
+from pathlib import Path
+
+from build_tools.profiling import Profiler, format_bytes
+
+from .history import HISTORY_DB, BenchmarkHistory, check, make_run
+from .synthetic import SCALES
+
+# Stages in the order they are run
+STAGES = (
+    "loading",
+    "extract_type_data",
+    "group_by_region",
+    "group_by_synonyms",
+    "group_by_hemilineage",
+    "make_supertype_pages",
+    "make_synonyms_pages",
+    "make_hemilineage_pages",
+    "make_dimorphism_pages",
+    "type_connectivity",
+    "generate_graphs",
+)
+
+parser = argparse.ArgumentParser(
+    description="Benchmark the build pipeline on synthetic data."
+)
+parser.add_argument(
+    "--scale",
+    choices=SCALES,
+    default="small",
+    help="Pre-defined scale (overridden by --neurons/--edges).",
+)
+parser.add_argument("--neurons", type=int, help="Number of neurons per dataset.")
+parser.add_argument("--edges", type=int, help="Number of edges per dataset.")
+parser.add_argument(
+    "--types", type=int, help="Number of types (defaults to neurons / 10)."
+)
+parser.add_argument("--seed", type=int, default=0, help="Seed for the data.")
+parser.add_argument(
+    "--stages",
+    nargs="+",
+    choices=STAGES,
+    default=STAGES,
+    help="Stages to benchmark (defaults to all).",
+)
+parser.add_argument(
+    "--repeat", type=int, default=1, help="Number of times to run each stage."
+)
+parser.add_argument(
+    "--graph-types",
+    type=int,
+    default=100,
+    help="Number of (dimorphic) types to generate graphs for.",
+)
+parser.add_argument(
+    "--fixtures",
+    type=Path,
+    help="Directory for the fixtures. Re-used if it already contains the same "
+    "synthetic data set. Defaults to a temporary directory.",
+)
+parser.add_argument(
+    "--output", type=Path, help="Write the results as JSON to this file."
+)
+parser.add_argument(
+    "--verbose",
+    action="store_true",
+    help="Show the output of the build tools.",
+)
+parser.add_argument(
+    "--history",
+    nargs="?",
+    type=Path,
+    const=HISTORY_DB,
+    default=None,
+    metavar="DB",
+    help="Record the results in a history database (default: "
+    ".cache/benchmark_history.sqlite, see `benchmarks/history.py`).",
+)
+parser.add_argument(
+    "--baseline",
+    nargs="?",
+    const="",
+    default=None,
+    metavar="REF",
+    help="Compare the results against a baseline commit, branch or run ID from "
+    "the history (default: the most recent run of another commit) and fail if "
+    "any stage is significantly slower.",
+)
+parser.add_argument(
+    "--memory",
+    action="store_true",
+    help="Also record peak memory (RSS and tracemalloc) and the largest "
+    "allocations per stage. N.B. this slows down the stages considerably.",
+)
+parser.add_argument(
+    "--memory-budget",
+    nargs="+",
+    default=(),
+    metavar="[STAGE=]MB",
+    help="Fail if the peak RSS of a stage exceeds the budget (in MB), e.g. "
+    "`4096 group_by_region=2048` (implies --memory).",
+)
+
+
+def run_stage(name, func, repeat=1, setup=None, verbose=False, profiler=None):
+    """Time a stage.
+
+    Parameters
+    ----------
+    name :      str
+                Name of the stage.
+    func :      callable
+                Function without arguments running the stage. Should return
+                the number of items (types, pages, ...) it processed.
+    repeat :    int
+                Number of times to run the stage.
+    setup :     callable, optional
+                Function to run (untimed) before each run.
+    verbose :   bool
+                If False, the stage's output is suppressed.
+    profiler :  build_tools.profiling.Profiler, optional
+                If provided (with memory tracking), the stage's peak memory
+                and largest allocations are recorded.
+
+    Returns
+    -------
+    dict
+                With the stage's `name`, the wall `times` of all runs (in
+                seconds), the `best` and `median` time, and the number of
+                `items` processed. With memory tracking, also the highest
+                `rss_peak` and `py_peak` (in bytes) across all runs and the
+                `top_allocations` of the first run.
+
+    """
+    times, records = [], []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        with contextlib.ExitStack() as stack:
+            if not verbose:
+                stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+            if profiler is not None:
+                records.append(stack.enter_context(profiler.stage(name)))
+            start = time.perf_counter()
+            items = func()
+            times.append(time.perf_counter() - start)
+
+    result = {
+        "name": name,
+        "times": times,
+        "best": min(times),
+        "median": float(np.median(times)),
+        "items": items,
+    }
+    if records:
+        result["rss_peak"] = max(r["rss_peak"] for r in records)
+        result["py_peak"] = max(r["py_peak"] for r in records)
+        result["top_allocations"] = records[0].get("top_allocations", [])
+
+    print(
+        f"  {name:<24} {result['best']:>9.3f}s (best of {repeat})"
+        + (f"  {items:>9,} items" if items is not None else "")
+        + (
+            f"  {format_bytes(result['rss_peak'])} peak RSS"
+            if "rss_peak" in result
+            else ""
+        ),
+        flush=True,
+    )
+    return result
+
+
+def check_budgets(results, budgets):
+    """Check the peak RSS of each stage against the memory budgets.
+
+    Parameters
+    ----------
+    results :   list of dicts
+                As returned by `run_stage`.
+    budgets :   list of str
+                Budgets in MB, either "{stage}={MB}" for a single stage or
+                just "{MB}" for all other stages.
+
+    Returns
+    -------
+    list of str
+                A message for each stage that exceeded its budget.
+
+    """
+    default, per_stage = None, {}
+    for budget in budgets:
+        name, _, mb = budget.rpartition("=")
+        if name:
+            per_stage[name] = float(mb) * 1024**2
+        else:
+            default = float(mb) * 1024**2
+
+    violations = []
+    for result in results:
+        budget = per_stage.get(result["name"], default)
+        if budget is not None and result.get("rss_peak", 0) > budget:
+            violations.append(
+                f"{result['name']}: peak RSS of {format_bytes(result['rss_peak'])} "
+                f"exceeds the budget of {format_bytes(budget)}"
+            )
+    return violations
+
+
+def environment():
+    """Collect information about the environment the benchmark runs in."""
+    import pandas as pd
+    import pyarrow as pa
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "pyarrow": pa.__version__,
+    }
+
+
+def prepare_fixtures(directory, params):
+    """Write the synthetic data set to `directory` unless it's already there."""
+    from .synthetic import make_dataset, write_fixtures
+
+    marker = directory / "synthetic.json"
+    if marker.exists() and json.loads(marker.read_text()) == params:
+        print(f"Re-using synthetic data in {directory}.", flush=True)
+        return
+
+    print(
+        f"Generating synthetic data ({params['neurons']:,} neurons and "
+        f"{params['edges']:,} edges per dataset)...",
+        flush=True,
+    )
+    start = time.perf_counter()
+    dataset = make_dataset(
+        params["neurons"], params["edges"], n_types=params["types"], seed=params["seed"]
+    )
+    write_fixtures(dataset, directory)
+    marker.write_text(json.dumps(params))
+    print(f"Done in {time.perf_counter() - start:.1f}s.", flush=True)
+
+
+def run(args):
+    """Run the benchmarks (requires the fixtures to be set up)."""
+    # N.B. the build tools read the fixture and build directories from the
+    # environment on import, so they must only be imported at this point
+    from build_tools import loading, building
+
+    stages = set(args.stages)
+    results = []
+    profiler = Profiler(memory=True) if args.memory else None
+
+    def stage(name, func, **kwargs):
+        kwargs.setdefault("repeat", args.repeat)
+        results.append(
+            run_stage(name, func, verbose=args.verbose, profiler=profiler, **kwargs)
+        )
+
+    # Loading always runs (but is only reported if requested)
+    data = {}
+
+    def load():
+        mcns_meta, fw_meta, mcns_roi_info, fw_roi_info, mappings = (
+            loading.load_cache_all(force_update=True, skip_edges=True)
+        )
+        mcns_meta["mapping"] = mcns_meta["bodyId"].map(mappings)
+        fw_meta["mapping"] = fw_meta["root_id"].map(mappings)
+        data.update(
+            mcns_meta=mcns_meta,
+            fw_meta=fw_meta,
+            profiles=loading.load_cache_roi_profiles(mcns_roi_info, fw_roi_info),
+        )
+        return len(mcns_meta) + len(fw_meta)
+
+    if "loading" in stages:
+        stage("loading", load)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            load()
+    mcns_meta, fw_meta = data["mcns_meta"], data["fw_meta"]
+    mcns_profiles, fw_profiles = data["profiles"]
+
+    def reset():
+        # `extract_type_data` caches its results between calls
+        building.DIMORPHIC_META = None
+
+    def extract():
+        data["records"] = building.extract_type_data(mcns_meta, fw_meta)
+        return sum(len(r) for r in data["records"])
+
+    if "extract_type_data" in stages:
+        stage("extract_type_data", extract, setup=reset)
+    else:
+        with contextlib.redirect_stdout(io.StringIO()):
+            extract()
+    dimorphic, male, female, iso = data["records"]
+
+    if "group_by_region" in stages:
+        stage(
+            "group_by_region",
+            lambda: len(
+                building.group_by_region(
+                    dimorphic, male, female, mcns_profiles, fw_profiles
+                )
+            ),
+        )
+    if "group_by_synonyms" in stages:
+        stage(
+            "group_by_synonyms",
+            lambda: len(
+                building.group_by_synonyms(
+                    dimorphic, male, female, iso, mcns_meta, fw_meta
+                )
+            ),
+        )
+    if "group_by_hemilineage" in stages:
+        stage(
+            "group_by_hemilineage",
+            lambda: len(
+                building.group_by_hemilineage(
+                    dimorphic, male, female, mcns_meta, fw_meta
+                )
+            ),
+        )
+
+    # Page generation (the number of items is the number of pages written)
+    def pages(directory, func):
+        def wrapped():
+            func()
+            return sum(1 for _ in directory.glob("*.md"))
+
+        return wrapped
+
+    if "make_supertype_pages" in stages:
+        stage(
+            "make_supertype_pages",
+            pages(
+                building.SUPERTYPE_DIR,
+                lambda: building.make_supertype_pages(
+                    mcns_meta, fw_meta, skip_thumbnails=True
+                ),
+            ),
+        )
+    if "make_synonyms_pages" in stages:
+        stage(
+            "make_synonyms_pages",
+            pages(
+                building.SYNONYMS_DIR,
+                lambda: building.make_synonyms_pages(
+                    mcns_meta, fw_meta, skip_thumbnails=True
+                ),
+            ),
+        )
+    if "make_hemilineage_pages" in stages:
+        stage(
+            "make_hemilineage_pages",
+            pages(
+                building.HEMILINEAGE_DIR,
+                lambda: building.make_hemilineage_pages(mcns_meta, fw_meta),
+            ),
+        )
+    if "make_dimorphism_pages" in stages:
+        stage(
+            "make_dimorphism_pages",
+            pages(
+                building.SUMMARY_TYPES_DIR,
+                lambda: building.make_dimorphism_pages(
+                    mcns_meta,
+                    fw_meta,
+                    None,
+                    None,
+                    mcns_profiles,
+                    fw_profiles,
+                    skip_graphs=True,
+                    skip_thumbnails=True,
+                ),
+            ),
+        )
+
+    if stages & {"type_connectivity", "generate_graphs"}:
+
+        def connectivity():
+            data["conn"] = (
+                loading.load_cache_mcns_type_connectivity(mcns_meta, force_update=True),
+                loading.load_cache_fw_type_connectivity(fw_meta, force_update=True),
+            )
+            return sum(len(c) for c in data["conn"])
+
+        if "type_connectivity" in stages:
+            stage("type_connectivity", connectivity)
+        else:
+            with contextlib.redirect_stdout(io.StringIO()):
+                connectivity()
+
+    if "generate_graphs" in stages:
+        from build_tools.graphs import generate_graphs
+
+        mcns_conn, fw_conn = data["conn"]
+        mcns_by_type = mcns_meta.groupby("mapping").indices
+        fw_by_type = fw_meta.groupby("mapping").indices
+        sample = [r["mapping"] for r in dimorphic[: args.graph_types]]
+
+        def graphs():
+            for t in sample:
+                generate_graphs(
+                    t,
+                    mcns_meta.iloc[mcns_by_type.get(t, [])],
+                    fw_meta.iloc[fw_by_type.get(t, [])],
+                    mcns_conn,
+                    fw_conn,
+                )
+            return len(sample)
+
+        stage("generate_graphs", graphs)
+
+    return results
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.memory = args.memory or bool(args.memory_budget)
+
+    n_neurons, n_edges = SCALES[args.scale]
+    params = {
+        "neurons": args.neurons or n_neurons,
+        "edges": args.edges or n_edges,
+        "types": args.types,
+        "seed": args.seed,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="mcns-benchmark-") as tmp:
+        fixtures = args.fixtures or Path(tmp) / "fixtures"
+        fixtures.mkdir(parents=True, exist_ok=True)
+
+        # Build from the fixtures into a temporary directory
+        os.environ["MCNS_FIXTURES"] = str(fixtures.absolute())
+        os.environ["MCNS_BUILD_DIR"] = str(Path(tmp) / "build")
+
+        prepare_fixtures(fixtures, params)
+        print("Running benchmarks...", flush=True)
+        results = {
+            "benchmark": "pipeline",
+            "timestamp": time.time(),
+            "params": params,
+            "environment": environment(),
+            "memory": args.memory,
+            "stages": run(args),
+        }
+
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+        print(f"Results written to {args.output}.", flush=True)
+
+    failed = False
+    if args.history or args.baseline is not None:
+        history = BenchmarkHistory(args.history or HISTORY_DB)
+        this_run = make_run(results)
+        run_id = history.add(this_run) if args.history else None
+        if run_id is not None:
+            print(f"Recorded run {run_id} in {history.filepath}.", flush=True)
+        if args.baseline is not None:
+            slower = check(this_run, history, args.baseline or None, exclude=run_id)
+            if slower:
+                print(f"Significantly slower: {', '.join(slower)}", flush=True)
+                failed = True
+
+    violations = check_budgets(results["stages"], args.memory_budget)
+    if violations:
+        print("Memory budget exceeded:", flush=True)
+        for v in violations:
+            print(f"  {v}", flush=True)
+        failed = True
+
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,466 @@
+"""
+Generate synthetic MCNS/FlyWire-like data sets and write them as fixtures.
+
+The data mimics the structure (not the content) of the real data: neurons
+are grouped into types with a dimorphism, supertype, hemilineage and
+(sometimes) synonyms, both datasets share a cross-dataset mapping, and every
+neuron has an ROI profile and random edges. The fixtures can be used for
+offline builds (see `build_tools/backends.py`).
+
+Usage::
+
+    uv run python -m benchmarks.synthetic fixtures/ --neurons 100000 --edges 10000000
+"""
+
+import json
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from urllib.parse import quote, urlsplit
+
+# Pre-defined scales: (neurons per dataset, edges per dataset)
+SCALES = {
+    "small": (10_000, 1_000_000),
+    "medium": (100_000, 10_000_000),
+    "large": (500_000, 100_000_000),
+}
+
+# Primary ROIs (without sides) for each compartment of the ROI hierarchy
+ROIS = {
+    "CentralBrain": (
+        "AL", "AOTU", "AVLP", "CRE", "EB", "FB", "GNG", "ICL", "IPS", "LAL",
+        "LH", "PB", "PVLP", "SCL", "SIP", "SLP", "SMP", "SPS", "VES", "WED",
+    ),
+    "Optic": ("AME", "LA", "LO", "LOP", "ME"),
+    "VNC": (
+        "ANm", "HTct(UTct-T3)", "IntTct", "LTct", "LegNp(T1)", "LegNp(T2)",
+        "LegNp(T3)", "NTct(UTct-T1)", "Ov", "WTct(UTct-T2)",
+    ),
+}  # fmt: skip
+
+# Mushroom body compartments in MaleCNS and their FlyWire equivalents
+MB_ROIS = {"aL": "MB_VL", "gL": "MB_ML", "bL": "MB_ML", "PED": "MB_PED"}
+
+# Superclasses in MaleCNS, their FlyWire equivalents and where they live
+SUPERCLASSES = {
+    "cb_intrinsic": ("central", ("CentralBrain",)),
+    "optic": ("optic", ("Optic",)),
+    "vnc_intrinsic": ("central", ("VNC",)),
+    "ascending_neuron": ("ascending", ("VNC", "CentralBrain")),
+    "descending_neuron": ("descending", ("CentralBrain", "VNC")),
+}
+
+# Fraction of types that are dimorphic, male- or female-specific
+DIMORPHISMS = {
+    "sexually dimorphic": 0.05,
+    "potentially sexually dimorphic": 0.03,
+    "male-specific": 0.04,
+    "female-specific": 0.04,
+}
+
+parser = argparse.ArgumentParser(
+    description="Write a synthetic data set as fixtures for offline builds."
+)
+parser.add_argument("directory", help="Directory to write the fixtures to.")
+parser.add_argument(
+    "--scale",
+    choices=SCALES,
+    default="small",
+    help="Pre-defined scale (overridden by --neurons/--edges).",
+)
+parser.add_argument("--neurons", type=int, help="Number of neurons per dataset.")
+parser.add_argument("--edges", type=int, help="Number of edges per dataset.")
+parser.add_argument(
+    "--types", type=int, help="Number of types (defaults to neurons / 10)."
+)
+parser.add_argument("--seed", type=int, default=0, help="Seed for the data.")
+
+
+def make_dataset(n_neurons, n_edges, n_types=None, seed=0):
+    """Generate a synthetic data set.
+
+    Parameters
+    ----------
+    n_neurons : int
+                Number of neurons in each of MaleCNS and FlyWire.
+    n_edges :   int
+                Number of neuron-to-neuron edges in each dataset.
+    n_types :   int, optional
+                Number of cell types. Defaults to `n_neurons // 10`.
+    seed :      int
+                Seed for the random number generator.
+
+    Returns
+    -------
+    dict
+                With `mcns_meta`, `mcns_roi_info`, `mcns_edges`, `fw_meta`,
+                `fw_roi_info`, `fw_edges`, `mapping` and `roi_hierarchy`.
+
+    """
+    rng = np.random.default_rng(seed)
+    n_types = n_types or max(n_neurons // 10, 1)
+    types = _make_types(n_types, rng)
+
+    mcns_meta, mcns_types = _make_mcns_meta(n_neurons, types, rng)
+    fw_meta, fw_types = _make_fw_meta(n_neurons, types, rng)
+
+    # Both datasets are mapped to the same types (untyped neurons are not mapped)
+    mapping = {}
+    for prefix, ids, codes in (
+        ("cns", mcns_meta["bodyId"].values, mcns_types),
+        ("fw", fw_meta["root_id"].values, fw_types),
+    ):
+        has_type = codes >= 0
+        mapping.update(
+            zip(
+                [f"{prefix}:{id}" for id in ids[has_type]],
+                types["name"].values[codes[has_type]].tolist(),
+            )
+        )
+
+    return {
+        "mcns_meta": mcns_meta,
+        "mcns_roi_info": _make_roi_info(
+            mcns_meta["bodyId"].values, mcns_types, types, "bodyId", False, rng
+        ),
+        "mcns_edges": _make_edges(
+            mcns_meta["bodyId"].values,
+            n_edges,
+            ("bodyId_pre", "bodyId_post", "weight"),
+            rng,
+        ),
+        "fw_meta": fw_meta,
+        "fw_roi_info": _make_roi_info(
+            fw_meta["root_id"].values, fw_types, types, "root_id", True, rng
+        ),
+        "fw_edges": _make_edges(
+            fw_meta["root_id"].values,
+            n_edges,
+            ("pre_pt_root_id", "post_pt_root_id", "syn_count"),
+            rng,
+        ),
+        "mapping": mapping,
+        "roi_hierarchy": _make_roi_hierarchy(),
+    }
+
+
+def write_fixtures(dataset, directory):
+    """Write a synthetic data set as fixtures (see `build_tools/backends.py`).
+
+    Parameters
+    ----------
+    dataset :   dict
+                As returned by `make_dataset`.
+    directory : Path
+                The fixture directory.
+
+    """
+    # (imported here so that e.g. `MCNS_FIXTURES` can be set before `env` is
+    # imported for the first time)
+    from build_tools import env
+
+    directory = Path(directory)
+    for sub in ("neuprint", "flytable", "neuroglancer"):
+        (directory / sub).mkdir(parents=True, exist_ok=True)
+
+    dataset["mcns_meta"].to_feather(directory / "neuprint" / "neurons.feather")
+    dataset["mcns_roi_info"].to_feather(directory / "neuprint" / "roi_info.feather")
+    dataset["mcns_edges"].to_feather(directory / "neuprint" / "edges.feather")
+    with open(directory / "neuprint" / "meta.json", "w") as f:
+        json.dump({"roiHierarchy": dataset["roi_hierarchy"]}, f)
+
+    dataset["fw_meta"].to_feather(directory / "flytable" / "annotations.feather")
+
+    with open(directory / "neuroglancer" / "scenes.json", "w") as f:
+        json.dump(
+            _make_scenes(
+                (env.NGL_BASE_URL, env.NGL_BASE_URL_VNC, env.NGL_BASE_URL_TOP)
+            ),
+            f,
+        )
+
+    # Files that are downloaded via HTTP
+    for url, write in (
+        (
+            env.MCNS_FW_MAPPING_URL,
+            lambda p: p.write_text(json.dumps(dataset["mapping"])),
+        ),
+        (env.FW_EDGES_URL, dataset["fw_edges"].to_feather),
+        (env.FW_ROI_INFO_URL, dataset["fw_roi_info"].to_feather),
+    ):
+        url = urlsplit(url)
+        filepath = directory / "http" / url.netloc / url.path.lstrip("/")
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        write(filepath)
+
+
+def _make_types(n_types, rng):
+    """Generate per-type properties."""
+    names = np.array([f"T{i}" for i in range(n_types)], dtype=object)
+
+    # Dimorphism (None for isomorphic types)
+    dimorphism = np.full(n_types, None, dtype=object)
+    u, cutoff = rng.random(n_types), 0
+    for name, fraction in DIMORPHISMS.items():
+        dimorphism[(u >= cutoff) & (u < cutoff + fraction)] = name
+        cutoff += fraction
+
+    # Groups of ~4 types form supertypes (not all types have one)
+    supertype = np.array([f"ST{i // 4}" for i in range(n_types)], dtype=object)
+    supertype[rng.random(n_types) < 0.4] = None
+
+    superclass = rng.choice(list(SUPERCLASSES), n_types, p=(0.5, 0.3, 0.1, 0.05, 0.05))
+
+    # Hemilineages (Ito/Lee for the brain, Truman for the VNC)
+    n_hl = max(n_types // 50, 1)
+    hl = rng.integers(0, n_hl, n_types)
+    in_vnc = superclass == "vnc_intrinsic"
+    itolee = np.array([f"HL{i}" for i in hl], dtype=object)
+    itolee[in_vnc | (rng.random(n_types) < 0.2)] = None
+    truman = np.array([f"{i % 24}A" for i in hl], dtype=object)
+    truman[~in_vnc] = None
+
+    # Some types have (possibly shared) synonyms from the literature
+    synonyms = np.full(n_types, None, dtype=object)
+    has_syn = np.nonzero(rng.random(n_types) < 0.05)[0]
+    authors = ("Cachero", "Yu", "Kimura", "Lee", "Rideout")
+    synonyms[has_syn] = [
+        f"{authors[i % len(authors)]} {2010 + i % 15}: syn{i // 3}" for i in has_syn
+    ]
+
+    # Each type innervates a few "home" ROIs
+    home = np.empty((n_types, 3), dtype=object)
+    for i, sc in enumerate(superclass):
+        comps = SUPERCLASSES[sc][1]
+        rois = [r for c in comps for r in ROIS[c]]
+        home[i] = rng.choice(rois, 3, replace=False)
+
+    return pd.DataFrame(
+        {
+            "name": names,
+            "dimorphism": dimorphism,
+            "supertype": supertype,
+            "superclass": superclass,
+            "itoleeHl": itolee,
+            "trumanHl": truman,
+            "synonyms": synonyms,
+            "home_rois": list(home),
+        }
+    )
+
+
+def _assign_types(n_neurons, types, exclude, rng):
+    """Assign neurons to types (-1 for untyped neurons)."""
+    allowed = np.nonzero(types["dimorphism"].values != exclude)[0]
+    codes = np.sort(allowed[rng.integers(0, len(allowed), n_neurons)])
+    codes[rng.random(n_neurons) < 0.05] = -1
+    return codes
+
+
+def _take(values, codes):
+    """Index per-type values with type codes (None for untyped neurons)."""
+    out = np.asarray(values, dtype=object)[codes]
+    out[codes < 0] = None
+    return out
+
+
+def _make_mcns_meta(n_neurons, types, rng):
+    codes = _assign_types(n_neurons, types, "female-specific", rng)
+    name = _take(types["name"], codes)
+    side = rng.choice(
+        np.array(["L", "R", None], dtype=object), n_neurons, p=(0.48, 0.48, 0.04)
+    )
+
+    meta = pd.DataFrame(
+        {
+            "bodyId": rng.choice(10**11, size=n_neurons, replace=False),
+            "type": name,
+            "flywireType": name,
+            "instance": [f"{t}_{s}" if t else None for t, s in zip(name, side)],
+            "somaSide": side,
+            "rootSide": np.where(pd.isnull(side), "R", side),
+            "superclass": _take(types["superclass"], codes),
+            "dimorphism": _take(types["dimorphism"], codes),
+            "supertype": _take(types["supertype"], codes),
+            "synonyms": _take(types["synonyms"], codes),
+            "itoleeHl": _take(types["itoleeHl"], codes),
+            "trumanHl": _take(types["trumanHl"], codes),
+            "fruDsx": rng.choice(
+                np.array([None, "fru", "dsx", "fru/dsx coexpress"], dtype=object),
+                n_neurons,
+                p=(0.85, 0.08, 0.05, 0.02),
+            ),
+            "predictedNt": rng.choice(
+                np.array(["acetylcholine", "gaba", "glutamate"], dtype=object),
+                n_neurons,
+            ),
+            "status": "Anchor",
+            "pre": rng.integers(0, 5_000, n_neurons),
+            "post": rng.integers(0, 20_000, n_neurons),
+        }
+    )
+    meta.loc[codes < 0, "superclass"] = "cb_intrinsic"
+
+    return meta, codes
+
+
+def _make_fw_meta(n_neurons, types, rng):
+    codes = _assign_types(n_neurons, types, "male-specific", rng)
+    name = _take(types["name"], codes)
+    superclass = _take(types["superclass"], codes)
+    superclass[codes < 0] = "cb_intrinsic"
+
+    dimorphism = _take(types["dimorphism"], codes)
+    dimorphism[dimorphism == "potentially sexually dimorphic"] = None
+
+    # Most FlyWire types come from FlyWire itself, some only from hemibrain/MCNS
+    source = rng.random(n_neurons)
+    meta = pd.DataFrame(
+        {
+            "root_id": 720575940600000000
+            + rng.choice(10**9, size=n_neurons, replace=False),
+            "cell_type": np.where(source < 0.8, name, None),
+            "hemibrain_type": np.where((source >= 0.8) & (source < 0.9), name, None),
+            "malecns_type": np.where(source >= 0.9, name, None),
+            "side": rng.choice(
+                np.array(["left", "right", "center"], dtype=object),
+                n_neurons,
+                p=(0.49, 0.49, 0.02),
+            ),
+            "super_class": [SUPERCLASSES[sc][0] for sc in superclass],
+            "dimorphism": dimorphism,
+            "supertype": _take(types["supertype"], codes),
+            "synonyms": _take(types["synonyms"], codes),
+            "ito_lee_hemilineage": _take(types["itoleeHl"], codes),
+            "top_nt": rng.choice(
+                np.array(["acetylcholine", "gaba", "glutamate"], dtype=object),
+                n_neurons,
+            ),
+        }
+    )
+
+    return meta, codes
+
+
+def _make_roi_info(ids, codes, types, id_col, flywire, rng, n_other=2):
+    """Generate per-neuron ROI info: a type's home ROIs plus a few random ones."""
+    all_rois = [r for rois in ROIS.values() for r in rois] + list(MB_ROIS)
+    home = np.stack(types["home_rois"].values)[np.maximum(codes, 0)]
+    other = rng.choice(np.array(all_rois, dtype=object), (len(ids), n_other))
+    rois = np.concatenate([home, other], axis=1)
+    n_per_neuron = rois.shape[1]
+
+    # Random sides; MB compartments have FlyWire-specific names
+    sides = rng.choice(np.array(["(L)", "(R)"], dtype=object), rois.size)
+    rois = rois.ravel()
+    if flywire:
+        rois = np.array([MB_ROIS.get(r, r) for r in rois], dtype=object)
+    rois = rois + sides
+
+    roi_info = pd.DataFrame(
+        {
+            id_col: np.repeat(ids, n_per_neuron),
+            "roi": rois,
+            "pre": rng.poisson(20, rois.size).astype(np.int32),
+            "post": rng.poisson(80, rois.size).astype(np.int32),
+        }
+    )
+
+    # (a neuron can have the same ROI twice)
+    return roi_info.groupby([id_col, "roi"], as_index=False, sort=False).sum()
+
+
+def _make_edges(ids, n_edges, columns, rng):
+    """Generate random edges with geometrically distributed weights."""
+    pre, post, weight = columns
+    return pd.DataFrame(
+        {
+            pre: ids[rng.integers(0, len(ids), n_edges)],
+            post: ids[rng.integers(0, len(ids), n_edges)],
+            weight: rng.geometric(0.2, n_edges).astype(np.int32),
+        }
+    )
+
+
+def _make_roi_hierarchy():
+    """Generate a neuPrint-like ROI hierarchy."""
+    children = []
+    for comp, rois in ROIS.items():
+        if comp == "CentralBrain":
+            rois = rois + tuple(MB_ROIS)
+        if comp == "Optic":
+            # There is one optic lobe per side
+            for side in ("(L)", "(R)"):
+                children.append(
+                    {
+                        "name": f"{comp}{side}",
+                        "children": [{"name": f"{r}{side}"} for r in rois],
+                    }
+                )
+            continue
+        children.append(
+            {
+                "name": comp,
+                "children": [
+                    {"name": f"{r}{s}"} for r in rois for s in ("(L)", "(R)")
+                ],
+            }
+        )
+    return {"name": "CNS", "children": children}
+
+
+def _make_scenes(base_urls):
+    """Generate full Neuroglancer scene URLs for the base scenes."""
+    state = {
+        "layers": [
+            {
+                "type": "segmentation",
+                "name": "brain-shell",
+                "source": "precomputed://gs://synthetic/brain-shell",
+                "segments": [],
+            },
+            {
+                "type": "segmentation",
+                "name": "maleCNS",
+                "source": {"url": "dvid://https://dvid.synthetic/abc123/segmentation"},
+                "segments": [],
+            },
+            {
+                "type": "segmentation",
+                "name": "female (FlyWire)",
+                "source": "precomputed://gs://synthetic/flywire-meshes",
+                "segments": [],
+            },
+            {
+                "type": "segmentation",
+                "name": "vnc-neuropil-shell",
+                "source": "precomputed://gs://synthetic/vnc-neuropil-shell",
+                "segments": [],
+            },
+        ],
+        "layout": "3d",
+    }
+    url = f"https://clio-ng.janelia.org/#!{quote(json.dumps(state))}"
+    return {base: url for base in base_urls}
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    n_neurons, n_edges = SCALES[args.scale]
+    dataset = make_dataset(
+        args.neurons or n_neurons,
+        args.edges or n_edges,
+        n_types=args.types,
+        seed=args.seed,
+    )
+    write_fixtures(dataset, args.directory)
+    print(
+        f"Wrote {len(dataset['mcns_meta']):,} + {len(dataset['fw_meta']):,} neurons "
+        f"and {len(dataset['mcns_edges']):,} + {len(dataset['fw_edges']):,} edges "
+        f"to {args.directory}.",
+        flush=True,
+    )
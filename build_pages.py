@@ -5,9 +5,10 @@ This script generates the following pages for the website:
 2. The summaries for individual sexually dimorphic cell types
 """
 
+import time
 import argparse
 
-from build_tools import loading, building
+from build_tools import cache, env, loading, building, network, profiling, thumbnails
 
 # Set up the argument parser
 parser = argparse.ArgumentParser(
@@ -25,6 +26,13 @@ parser.add_argument(
     action="store_true",
     help="Skip the generation of thumbnail images.",
 )
+parser.add_argument(
+    "--thumbnail-workers",
+    type=int,
+    default=None,
+    help="Number of processes to render thumbnails with (defaults to the "
+    "number of CPUs). Use 0 to render in the main process.",
+)
 parser.add_argument(
     "--skip-overview",
     action="store_true",
@@ -60,27 +68,81 @@ parser.add_argument(
     action="store_true",
     help="Clear the build directory before generating pages.",
 )
+# Add options for profiling the build
+parser.add_argument(
+    "--profile",
+    nargs="?",
+    const="build_profile.json",
+    default=None,
+    metavar="REPORT",
+    help="Record wall time, CPU time and item counts as well as the HTTP requests "
+    "for each stage of the build and write them to a JSON report (default: "
+    "build_profile.json).",
+)
+parser.add_argument(
+    "--profile-memory",
+    action="store_true",
+    help="With --profile, also record peak memory (RSS and tracemalloc) and the "
+    "largest allocations for each stage. Slows down the build considerably.",
+)
+parser.add_argument(
+    "--profile-stats",
+    default=None,
+    metavar="DIR",
+    help="With --profile, also run each stage under cProfile and write the "
+    "statistics to DIR/{stage}.prof.",
+)
 
 if __name__ == "__main__":
     # Load the template
     args = parser.parse_args()
 
-    # Load meta data
-    mcns_meta, fw_meta, mcns_roi_info, fw_roi_info = loading.load_cache_meta_data(
-        force_update=args.update_metadata
-    )
-    # mcns_meta["type"] = mcns_meta.type.fillna(mcns_meta.flywireType).fillna("unknown")
-    mappings = loading.load_cache_mapping(force_update=args.update_metadata)
-    fw_edges = loading.load_cache_fw_edges(force_update=args.update_metadata)
+    if args.profile:
+        profiling.start_profiler(args.profile_stats, memory=args.profile_memory)
+        network.start_monitor()
 
-    # Add MCNS <-> FlyWire mapping to the meta data
-    mcns_meta["mapping"] = mcns_meta["bodyId"].map(mappings)
-    fw_meta["mapping"] = fw_meta["root_id"].map(mappings)
+    # Re-resolve the Neuroglancer base scenes and neuPrint meta data on update
+    if args.update_metadata:
+        env.clear_remote_state_cache()
+
+    with profiling.stage("loading"):
+        # Load meta data, mapping and (if needed) edges concurrently
+        mcns_meta, fw_meta, mcns_roi_info, fw_roi_info, mappings = (
+            loading.load_cache_all(
+                force_update=args.update_metadata, skip_edges=args.skip_graphs
+            )
+        )
+        # mcns_meta["type"] = mcns_meta.type.fillna(mcns_meta.flywireType).fillna("unknown")
+
+        # Add MCNS <-> FlyWire mapping to the meta data
+        mcns_meta["mapping"] = mcns_meta["bodyId"].map(mappings)
+        fw_meta["mapping"] = fw_meta["root_id"].map(mappings)
+        profiling.count(len(mcns_meta) + len(fw_meta))
+
+    # Normalised per-neuron ROI profiles (used to group types by brain region)
+    with profiling.stage("roi_profiles"):
+        mcns_roi_profiles, fw_roi_profiles = loading.load_cache_roi_profiles(
+            mcns_roi_info, fw_roi_info
+        )
+
+    # Aggregate edges into type-level connectivity (only needed for graphs)
+    mcns_conn = fw_conn = None
+    if not args.skip_graphs:
+        with profiling.stage("type_connectivity"):
+            mcns_conn = loading.load_cache_mcns_type_connectivity(
+                mcns_meta, force_update=args.update_metadata
+            )
+            # (the edges were already fetched above)
+            fw_conn = loading.load_cache_fw_type_connectivity(fw_meta)
 
     if args.clear_build:
         # Clear the build directory
         building.clear_build_directory()
 
+    if not args.skip_thumbnails:
+        # Thumbnails are rendered in the background while we build the pages
+        thumbnails.start_thumbnail_engine(args.thumbnail_workers)
+
     # Generate the supertype pages
     if not args.skip_supertypes:
         building.make_supertype_pages(
@@ -101,9 +163,25 @@ if __name__ == "__main__":
     building.make_dimorphism_pages(
         mcns_meta,
         fw_meta,
-        fw_edges,
-        mcns_roi_info,
-        fw_roi_info,
+        mcns_conn,
+        fw_conn,
+        mcns_roi_profiles,
+        fw_roi_profiles,
         skip_graphs=args.skip_graphs,
         skip_thumbnails=args.skip_thumbnails,
     )
+
+    # Wait for any outstanding thumbnails
+    with profiling.stage("wait_for_thumbnails"):
+        thumbnails.wait_for_thumbnails()
+
+    if args.profile:
+        profiling.PROFILER.report()
+        network.MONITOR.report()
+        profiling.PROFILER.write(
+            args.profile,
+            timestamp=time.time(),
+            data_version=cache.MANIFEST.data_version(),
+            network=network.MONITOR.summary(),
+        )
+        print(f"Wrote build profile to {args.profile}.", flush=True)
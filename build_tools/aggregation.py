@@ -0,0 +1,202 @@
+"""
+Vectorised agglomeration of neuron-level meta data into per-type values.
+
+This module deliberately only depends on pandas/numpy so that it can be
+imported (and benchmarked) without setting up any of the remote clients.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def agglomerate(table, by, columns=None):
+    """Collapse each column of `table` into a single value per group.
+
+    For each group and column, the non-null values are reduced to:
+     - "N/A" if there are no values
+     - the value itself if there is exactly one distinct value
+     - a sorted, "; "-joined string if there are multiple distinct values
+
+    All groups are processed in one go per column, i.e. there is no Python
+    loop over groups.
+
+    Parameters
+    ----------
+    table :     pd.DataFrame
+                The neuron-level meta data.
+    by :        str
+                Column to group by. Rows where this is null are dropped.
+    columns :   list of str, optional
+                Columns to agglomerate. If None, will use all columns.
+
+    Returns
+    -------
+    pd.DataFrame
+                One row per group (sorted by group) and one column for each
+                agglomerated column. All columns are of dtype `object`.
+
+    """
+    if columns is None:
+        columns = table.columns
+
+    table = table[table[by].notnull()]
+    codes, groups = pd.factorize(table[by], sort=True)
+    n_groups = len(groups)
+
+    agg = {}
+    for col in columns:
+        # Unique (group, value) pairs - dropping NaNs before de-duplicating
+        pairs = pd.DataFrame({"group": codes, "value": table[col].values})
+        pairs = pairs[pairs.value.notnull()].drop_duplicates()
+        n_values = np.bincount(pairs.group.values, minlength=n_groups)
+
+        values = np.full(n_groups, "N/A", dtype=object)
+
+        # Groups with a single value keep that value as is
+        single = pairs[n_values[pairs.group.values] == 1]
+        values[single.group.values] = np.asarray(single.value.values, dtype=object)
+
+        # Groups with multiple values get a sorted, joined string
+        multi = pairs[n_values[pairs.group.values] > 1]
+        if not multi.empty:
+            multi = pd.DataFrame(
+                {
+                    "group": multi.group.values,
+                    "value": np.asarray(multi.value.astype(str), dtype=object),
+                }
+            ).sort_values(["group", "value"])
+            group, value = multi.group.values, multi.value.values
+
+            # Join strings within each group via a single reduction
+            is_first = np.append(True, group[1:] != group[:-1])
+            value = np.where(is_first, value, "; " + value)
+            starts = np.flatnonzero(is_first)
+            values[group[starts]] = np.add.reduceat(value, starts)
+
+        agg[col] = values
+
+    return pd.DataFrame(agg, index=pd.Index(groups, name=by))
+
+
+def group_slices(table, by):
+    """Sort the rows of `table` by group.
+
+    Unlike `table.groupby(by).indices`, this only allocates a single array:
+    each group's rows are a slice of it, so per-group data (e.g. neuron IDs)
+    can be taken as views into one shared, sorted buffer.
+
+    Parameters
+    ----------
+    table :     pd.DataFrame
+                The neuron-level meta data.
+    by :        str
+                Column to group by. Rows where this is null are dropped.
+
+    Returns
+    -------
+    order :     np.ndarray
+                Positional row indices, sorted by group (stable).
+    slices :    dict
+                Maps each group to the slice of `order` with its rows.
+
+    """
+    codes, groups = pd.factorize(table[by], sort=True)
+    order = np.argsort(codes, kind="stable")
+
+    # (null groups have code -1 and are sorted to the front)
+    bounds = np.searchsorted(codes[order], np.arange(len(groups) + 1))
+    order = order[bounds[0] :]
+    bounds = bounds - bounds[0]
+
+    slices = {
+        g: slice(start, stop) for g, start, stop in zip(groups, bounds[:-1], bounds[1:])
+    }
+    return order, slices
+
+
+def count_values(table, by, column, values, fallback=None):
+    """Count occurrences of given values in a column for each group.
+
+    Parameters
+    ----------
+    table :     pd.DataFrame
+                The neuron-level meta data.
+    by :        str
+                Column to group by. Rows where this is null are dropped.
+    column :    str
+                Column whose values to count.
+    values :    iterable
+                The values to count (e.g. `("L", "R")`).
+    fallback :  str, optional
+                Column to count instead for groups that have no non-null
+                values in `column` (e.g. "rootSide" for "somaSide").
+
+    Returns
+    -------
+    pd.DataFrame
+                One row per group (sorted by group) and one column per value.
+
+    """
+    values = list(values)
+    table = table[table[by].notnull()]
+    groups = pd.Index(pd.unique(table[by])).sort_values()
+
+    counts = _value_counts(table, by, column, values).reindex(groups, fill_value=0)
+
+    if fallback is not None:
+        observed = (
+            table[table[column].notnull()].groupby(by, observed=True).size().index
+        )
+        missing = groups[~groups.isin(observed)]
+        if len(missing):
+            counts.loc[missing] = _value_counts(
+                table[table[by].isin(missing)], by, fallback, values
+            ).reindex(missing, fill_value=0)
+
+    return counts
+
+
+def _value_counts(table, by, column, values):
+    """Count `values` in `column` for each group in `table`."""
+    table = table[table[column].isin(values)]
+    if table.empty:
+        return pd.DataFrame(0, index=pd.Index([], name=by), columns=values)
+    return (
+        pd.crosstab(
+            np.asarray(table[by], dtype=object), np.asarray(table[column], dtype=object)
+        )
+        .reindex(columns=values, fill_value=0)
+        .rename_axis(index=by, columns=None)
+    )
+
+
+def first_valid(table, by, columns):
+    """Get the first non-null value from the first column that has one.
+
+    Parameters
+    ----------
+    table :     pd.DataFrame
+                The neuron-level meta data.
+    by :        str
+                Column to group by. Rows where this is null are dropped.
+    columns :   iterable of str
+                Columns to check in order of priority. Columns that do not
+                exist in `table` are ignored.
+
+    Returns
+    -------
+    pd.Series
+                One value per group (sorted by group).
+
+    """
+    table = table[table[by].notnull()]
+    grouped = table.groupby(by, sort=True, observed=True)
+
+    first = None
+    for col in columns:
+        if col not in table.columns:
+            continue
+        this = grouped[col].first().astype(object)
+        first = this if first is None else first.fillna(this)
+
+    return first
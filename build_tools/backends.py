@@ -0,0 +1,238 @@
+"""
+Backends for the remote services used during the build.
+
+The `LiveBackend` talks to neuPrint, FlyTable and the various HTTP servers
+(flyem1, DVID, the FlyWire precomputed bucket). The `FixtureBackend` serves
+the same data from a local fixture directory instead, so that builds can run
+(and be timed) reproducibly without network access. Set the `MCNS_FIXTURES`
+environment variable to a fixture directory to use it (see `env.BACKEND`).
+
+A fixture directory has the following layout::
+
+    neuprint/neurons.feather        # MCNS meta data incl. roiInfo etc.
+    neuprint/roi_info.feather       # MCNS per-neuron ROI info
+    neuprint/edges.feather          # bodyId_pre, bodyId_post, weight
+    neuprint/meta.json              # neuPrint meta data (ROI hierarchy)
+    flytable/annotations.feather    # FlyWire meta data
+    neuroglancer/scenes.json        # maps base scene URLs to full scene URLs
+    shells/{BRAIN,VNC}.npz          # `vertices` and `faces` of the shells
+    http/{host}/{path}              # anything fetched via HTTP, e.g. the
+                                    # mapping, FlyWire edges and meshes
+
+Use `record_fixtures` to record a fixture directory from the local cache.
+"""
+
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+from . import env
+
+
+class LiveBackend:
+    """Fetch data from the live services."""
+
+    def __repr__(self):
+        return "<LiveBackend>"
+
+    def fetch_mcns_neurons(self):
+        """Fetch the MCNS meta data and ROI info from neuPrint."""
+        # (imported here so that cached builds don't pay for importing navis)
+        import navis.interfaces.neuprint as neu
+
+        return neu.fetch_neurons(neu.NeuronCriteria(), client=env.NEUPRINT_CLIENT)
+
+    def fetch_mcns_edges(self, body_ids):
+        """Fetch all edges from the given neurons from neuPrint."""
+        cypher = f"""
+            WITH {list(body_ids)} AS bodyIds
+            MATCH (a:Neuron)-[e:ConnectsTo]->(b:Neuron)
+            WHERE a.bodyId IN bodyIds
+            RETURN a.bodyId AS bodyId_pre, b.bodyId AS bodyId_post, e.weight AS weight
+        """
+        return env.NEUPRINT_CLIENT.fetch_custom(cypher)
+
+    def fetch_fw_annotations(self):
+        """Fetch the FlyWire meta data from FlyTable."""
+        # (imported here so that cached builds don't pay for importing cocoa)
+        import cocoa as cc
+
+        return cc.FlyWire(live_annot=True).get_annotations()
+
+    def fetch_shells(self):
+        """Fetch the brain and VNC shell meshes for the thumbnails.
+
+        Returns
+        -------
+        dict
+                    Maps "BRAIN" and "VNC" to `navis.Volume`.
+
+        """
+        import navis
+        import cloudvolume as cv
+
+        vol = cv.CloudVolume(
+            "gs://flyem-cns-roi-7c971aa681da83f9a074a1f0e8ef60f4/fullbrain-major-shells/",
+            use_https=True,
+            progress=False,
+        )
+        brain = navis.Volume(vol.mesh.get([1, 2, 3]), name="BRAIN")  # CB + optic lobes
+
+        vol = cv.CloudVolume(
+            "precomputed://gs://flyem-cns-roi-7c971aa681da83f9a074a1f0e8ef60f4/vnc-neuropil-shell",
+            use_https=True,
+            progress=False,
+        )
+        vnc = navis.Volume(vol.mesh.get([1]), name="VNC")
+
+        return {"BRAIN": brain, "VNC": vnc}
+
+    def resolve_url(self, url):
+        """Get the URL to actually fetch a given URL from."""
+        return url
+
+
+class FixtureBackend:
+    """Serve data from a fixture directory instead of the live services.
+
+    Files in `{directory}/http` are served by a local HTTP server that is
+    started on first use (and shared with worker processes via the
+    `MCNS_FIXTURE_SERVER` environment variable).
+
+    Parameters
+    ----------
+    directory : Path
+                The fixture directory.
+
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._server = None
+        self._edges = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<FixtureBackend(directory={self.directory})>"
+
+    def fetch_mcns_neurons(self):
+        return (
+            pd.read_feather(self.directory / "neuprint" / "neurons.feather"),
+            pd.read_feather(self.directory / "neuprint" / "roi_info.feather"),
+        )
+
+    def fetch_mcns_edges(self, body_ids):
+        # (edges are fetched in batches, so we only read them once)
+        if self._edges is None:
+            self._edges = pd.read_feather(
+                self.directory / "neuprint" / "edges.feather"
+            )
+        return self._edges[self._edges.bodyId_pre.isin(body_ids)]
+
+    def fetch_fw_annotations(self):
+        return pd.read_feather(self.directory / "flytable" / "annotations.feather")
+
+    def fetch_shells(self):
+        import navis
+
+        shells = {}
+        for name in ("BRAIN", "VNC"):
+            with np.load(self.directory / "shells" / f"{name}.npz") as f:
+                shells[name] = navis.Volume(f["vertices"], f["faces"], name=name)
+        return shells
+
+    def resolve_url(self, url):
+        """Map e.g. `https://{host}/{path}` to `{fixture server}/{host}/{path}`."""
+        url = urlsplit(url)
+        return f"{self.server_url}/{url.netloc}{url.path}"
+
+    @property
+    def server_url(self):
+        """URL of the local HTTP server (started on first access)."""
+        if "MCNS_FIXTURE_SERVER" in os.environ:
+            return os.environ["MCNS_FIXTURE_SERVER"]
+
+        with self._lock:
+            if self._server is None:
+                directory = str(self.directory / "http")
+
+                class Handler(SimpleHTTPRequestHandler):
+                    def __init__(self, *args, **kwargs):
+                        super().__init__(*args, directory=directory, **kwargs)
+
+                    def log_message(self, format, *args):
+                        pass
+
+                self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+                threading.Thread(target=self._server.serve_forever, daemon=True).start()
+                os.environ["MCNS_FIXTURE_SERVER"] = (
+                    f"http://127.0.0.1:{self._server.server_address[1]}"
+                )
+
+        return os.environ["MCNS_FIXTURE_SERVER"]
+
+
+def record_fixtures(directory):
+    """Record a fixture directory from the local cache.
+
+    Run a regular build first so that the cache is populated. Meshes are not
+    recorded: for thumbnails, put the mesh files into `{directory}/http` (or
+    build with `--skip-thumbnails`).
+
+    Parameters
+    ----------
+    directory : Path
+                The fixture directory to write to.
+
+    """
+    from . import loading
+
+    directory = Path(directory)
+    for sub in ("neuprint", "flytable", "neuroglancer", "shells", "http"):
+        (directory / sub).mkdir(parents=True, exist_ok=True)
+
+    # neuPrint: put the ROI columns back into the meta data
+    neurons = pd.read_feather(env.MCNS_META_DATA_CACHE)
+    if env.MCNS_ROI_COLUMNS_CACHE.exists():
+        neurons = neurons.merge(
+            loading.load_cache_mcns_roi_columns(), on="bodyId", how="left"
+        )
+    neurons.to_feather(directory / "neuprint" / "neurons.feather")
+    shutil.copy(env.MCNS_ROI_INFO_CACHE, directory / "neuprint" / "roi_info.feather")
+    shutil.copy(env.MCNS_EDGES_CACHE, directory / "neuprint" / "edges.feather")
+    shutil.copy(env.NEUPRINT_META_CACHE, directory / "neuprint" / "meta.json")
+
+    # FlyTable (without the columns we add after loading)
+    pd.read_feather(env.FW_META_DATA_CACHE).to_feather(
+        directory / "flytable" / "annotations.feather"
+    )
+
+    # Neuroglancer scenes
+    shutil.copy(env.NGL_SCENES_CACHE, directory / "neuroglancer" / "scenes.json")
+
+    # Files downloaded via HTTP
+    for url, filepath in (
+        (env.MCNS_FW_MAPPING_URL, env.MAPPING_CACHE),
+        (env.FW_EDGES_URL, env.CACHE_DIR / env.FW_EDGES_URL.split("/")[-1]),
+        (env.FW_ROI_INFO_URL, env.FW_ROI_INFO_CACHE),
+    ):
+        url = urlsplit(url)
+        target = directory / "http" / url.netloc / url.path.lstrip("/")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(filepath, target)
+
+    # Shell meshes
+    for name, vol in env.BACKEND.fetch_shells().items():
+        np.savez(
+            directory / "shells" / f"{name}.npz", vertices=vol.vertices, faces=vol.faces
+        )
+
+    print(f"Recorded fixtures to {directory}.", flush=True)
+
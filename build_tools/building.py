@@ -3,23 +3,20 @@ Functions for building the various bits and pieces of the website.
 """
 
 import re
-import navis
-import logging
-import warnings
 
-import dvid as dv
 import numpy as np
 import pandas as pd
-import octarine as oc
-import cloudvolume as cv
-import navis.interfaces.neuprint as neu
 
-from pathlib import Path
 from typing import List, Dict
 from urllib.parse import quote_plus
-from d3graph import d3graph, vec2adjmat
-from concurrent.futures import as_completed
 
+from . import env, profiling
+from .aggregation import agglomerate, count_values, first_valid, group_slices
+from .connectivity import TypeConnectivity
+from .links import SceneLink
+from .records import TypeRecord
+from .regions import MB_COMPARTMENTS, ProfileIndex, collapse_roi, group_roi_profiles
+from .thumbnails import generate_thumbnail
 from .env import (
     BUILD_DIR,
     GRAPH_DIR,
@@ -28,42 +25,28 @@ from .env import (
     SUPERTYPE_DIR,
     HEMILINEAGE_DIR,
     SYNONYMS_DIR,
-    NGL_BASE_SCENE,
-    NGL_BASE_SCENE_VNC,
-    NGL_BASE_SCENE_TOP,
     JINJA_ENV,
     NEUPRINT_SEARCH_URL,
     NEUPRINT_CONNECTIVITY_URL,
-    FLYWIRE_SOURCE,
-    DVID_SERVER,
-    DVID_NODE,
-    NEUPRINT_CLIENT,
-    FUTURE_SESSION,
 )
 
-# Silence the d3graph logger
-logging.getLogger("d3graph").setLevel(logging.WARNING)
-
 DIMORPHIC_META = None
 MALE_META = None
 FEMALE_META = None
 ISO_META = None
 
-MESH_BRAIN = None
-MESH_VNC = None
-OC_VIEWER = None
-
-dv.setup(DVID_SERVER, DVID_NODE)
-
-navis.patch_cloudvolume()
+# Stands in for the IDs of records without MaleCNS or FlyWire neurons
+_NO_IDS = np.array([], dtype=np.int64)
 
 
+@profiling.profiled
 def make_dimorphism_pages(
     mcns_meta: pd.DataFrame,
     fw_meta: pd.DataFrame,
-    fw_edges: pd.DataFrame,
-    mcns_roi_info: pd.DataFrame,
-    fw_roi_info: pd.DataFrame,
+    mcns_conn: TypeConnectivity,
+    fw_conn: TypeConnectivity,
+    mcns_roi_profiles: pd.DataFrame,
+    fw_roi_profiles: pd.DataFrame,
     skip_graphs: bool = False,
     skip_thumbnails: bool = False,
 ) -> None:
@@ -75,13 +58,17 @@ def make_dimorphism_pages(
                 The meta data for MaleCNS neurons as returned from neuPrint.
     fw_meta :   pd.DataFrame
                 The meta data for FlyWire neurons as returned from FlyTable.
-    fw_edges :  pd.DataFrame
-                Edge list for FlyWire neurons.
-    mcns_roi_info : pd.DataFrame
-                The ROI info for MaleCNS neurons as returned from neuPrint.
-    fw_roi_info : pd.DataFrame
-                The ROI info for FlyWire neurons. Compiled from Zenodo data dump
-                - see loading.py for details.
+    mcns_conn : TypeConnectivity
+                Type-level connectivity for MaleCNS neurons. Only required
+                if graphs are generated.
+    fw_conn :   TypeConnectivity
+                Type-level connectivity for FlyWire neurons. Only required
+                if graphs are generated.
+    mcns_roi_profiles : pd.DataFrame
+                The normalised ROI profiles for MaleCNS neurons.
+    fw_roi_profiles : pd.DataFrame
+                The normalised ROI profiles for FlyWire neurons. See
+                `loading.load_cache_roi_profiles` for details.
     skip_graphs : bool
                 If True, skip generating the graphs for the neurons.
     skip_thumbnails : bool
@@ -98,10 +85,10 @@ def make_dimorphism_pages(
     )
 
     # Sort the meta data alphabetically by type
-    dimorphic_meta = sorted(dimorphic_meta, key=lambda x: x["type"])
-    male_meta = sorted(male_meta, key=lambda x: x["type"])
-    female_meta = sorted(female_meta, key=lambda x: x["type"])
-    iso_meta = sorted(iso_meta, key=lambda x: x["type"])
+    dimorphic_meta = sorted(dimorphic_meta, key=lambda x: x.type)
+    male_meta = sorted(male_meta, key=lambda x: x.type)
+    female_meta = sorted(female_meta, key=lambda x: x.type)
+    iso_meta = sorted(iso_meta, key=lambda x: x.type)
 
     # Group types by hemilineages
     by_hemilineage = group_by_hemilineage(
@@ -115,9 +102,16 @@ def make_dimorphism_pages(
 
     # Group types by brain region
     by_region = group_by_region(
-        dimorphic_meta, male_meta, female_meta, mcns_roi_info, fw_roi_info
+        dimorphic_meta, male_meta, female_meta, mcns_roi_profiles, fw_roi_profiles
     )
 
+    # Find the most similar types by ROI profile (requires the ROI counts which
+    # `group_by_region` adds for all but the isomorphic types)
+    _add_roi_counts(
+        iso_meta, mcns_roi_profiles, "bodyId", "body_ids", _roi2compartment()
+    )
+    find_closest_types(dimorphic_meta + male_meta + female_meta + iso_meta)
+
     # Group types by synonyms
     by_synonyms = group_by_synonyms(
         dimorphic_meta, male_meta, female_meta, iso_meta, mcns_meta, fw_meta
@@ -126,236 +120,156 @@ def make_dimorphism_pages(
     # For the overview page, we will only show synonyms containing dimorphic types
     by_synonyms = {k: v for k, v in by_synonyms.items() if v["has_dimorphic_types"]}
 
-    print("Generating overview page...", flush=True)
-
-    # Load the template for the overview page
-    overview_template = JINJA_ENV.get_template("dimorphism_overview.md")
-
-    # Render the template with the meta data
-    rendered = overview_template.render(
-        dimorphic_types=dimorphic_meta,
-        male_types=male_meta,
-        female_types=female_meta,
-        summary_types_dir=SUMMARY_TYPES_DIR.name,
-        hemilineages=[by_hemilineage[k] for k in sorted(by_hemilineage)],
-        supertypes=[by_supertype[k] for k in sorted(by_supertype)],
-        regions=by_region,
-        synonyms=[by_synonyms[k] for k in sorted(by_synonyms)],
-        synonyms_dir=SYNONYMS_DIR.name,
-    )
-
-    #  Write the rendered HTML to a file
-    with open(BUILD_DIR / "dimorphism_overview.md", "w") as f:
-        f.write(rendered)
+    # Isomorphic types only get a page if they contribute to one of these
+    # synonyms, so we can't link to the other ones from the closest types
+    iso_synonym_meta = [r for syn in by_synonyms.values() for r in syn["types_iso"]]
+    pages = {r.type_file for r in dimorphic_meta + male_meta + female_meta}
+    pages.update(r.type_file for r in iso_synonym_meta)
+    for record in dimorphic_meta + male_meta + female_meta + iso_meta:
+        for row in record.closest_types:
+            if row["type_file"] not in pages:
+                row["type_file"] = None
 
-    print("Done.", flush=True)
+    with profiling.stage("overview"):
+        print("Generating overview page...", flush=True)
 
-    # Generate individual pages for each cell type
-    print("Generating individual type pages...", flush=True, end="")
+        # Load the template for the overview page
+        overview_template = JINJA_ENV.get_template("dimorphism_overview.md")
 
-    # Loop through each dimorphic cell type and generate a page for it
-    individual_template = JINJA_ENV.get_template("dimorphism_individual.md")
-    for record in dimorphic_meta:
-        print(
-            f"  Generating summary page for type {record['type']} (dimorphic)...",
-            flush=True,
+        # Render the template with the meta data
+        rendered = overview_template.render(
+            dimorphic_types=dimorphic_meta,
+            male_types=male_meta,
+            female_types=female_meta,
+            summary_types_dir=SUMMARY_TYPES_DIR.name,
+            hemilineages=[by_hemilineage[k] for k in sorted(by_hemilineage)],
+            supertypes=[by_supertype[k] for k in sorted(by_supertype)],
+            regions=by_region,
+            synonyms=[by_synonyms[k] for k in sorted(by_synonyms)],
+            synonyms_dir=SYNONYMS_DIR.name,
         )
 
-        # Generate the graph
-        if not skip_graphs:
-            try:
-                generate_graphs(
-                    record["type"],
-                    mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                    fw_meta[fw_meta["mapping"] == record["mapping"]],
-                    mcns_meta,
-                    fw_meta,
-                    fw_edges,
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate graph for {record['type']}: {e}", flush=True
-                )
-        record["graph_file_mcns"] = (
-            BUILD_DIR / "graphs" / (record["type"] + "_mcns.html")
-        )
-        record["graph_file_mcns_rel"] = f"../../graphs/{record['type']}_mcns.html"
-        record["graph_file_fw"] = BUILD_DIR / "graphs" / (record["type"] + "_fw.html")
-        record["graph_file_fw_rel"] = f"../../graphs/{record['type']}_fw.html"
+        #  Write the rendered HTML to a file
+        with open(BUILD_DIR / "dimorphism_overview.md", "w") as f:
+            f.write(rendered)
 
-        if not skip_thumbnails:
-            # Generate the thumbnail
-            try:
-                generate_thumbnail(
-                    mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                    fw_meta[fw_meta["mapping"] == record["mapping"]],
-                    THUMBNAILS_DIR / f"{record['type_file']}.png",
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate thumbnail for {record['type']}: {e}",
-                    flush=True,
-                )
+    print("Done.", flush=True)
 
-        # Render the template with the meta data
-        rendered = individual_template.render(meta=record)
+    # Generate individual pages for each cell type
+    print("Generating individual type pages...", flush=True, end="")
 
-        # Write the rendered HTML to a file
-        with open(SUMMARY_TYPES_DIR / f"{record['type_file']}.md", "w") as f:
-            f.write(rendered)
+    for records, template in (
+        (dimorphic_meta, "dimorphism_individual.md"),
+        (male_meta, "male_spec_individual.md"),
+        (female_meta, "female_spec_individual.md"),
+        (iso_synonym_meta, "isomorphism_individual.md"),
+    ):
+        individual_template = JINJA_ENV.get_template(template)
+        for record in records:
+            _make_type_page(
+                record,
+                individual_template,
+                mcns_meta,
+                fw_meta,
+                mcns_conn,
+                fw_conn,
+                skip_graphs=skip_graphs,
+                skip_thumbnails=skip_thumbnails,
+            )
 
-    # Loop through each male-specific cell type and generate a page for it
-    individual_template = JINJA_ENV.get_template("male_spec_individual.md")
-    for record in male_meta:
-        print(
-            f"  Generating summary page for type {record['type']} (male-specific)...",
-            flush=True,
-        )
+    print("Done.", flush=True)
 
-        # Generate the graph
-        if not skip_graphs:
-            try:
-                generate_graphs(
-                    record["type"],
-                    mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                    pd.DataFrame(),
-                    mcns_meta,
-                    fw_meta,
-                    fw_edges,
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate graph for {record['type']}: {e}", flush=True
-                )
 
-        record["graph_file_mcns"] = (
-            BUILD_DIR / "graphs" / (record["type"] + "_mcns.html")
-        )
-        record["graph_file_mcns_rel"] = f"../../graphs/{record['type']}_mcns.html"
+def _make_type_page(
+    record,
+    template,
+    mcns_meta,
+    fw_meta,
+    mcns_conn,
+    fw_conn,
+    skip_graphs,
+    skip_thumbnails,
+):
+    """Generate the graphs, thumbnail and summary page for a single type.
 
-        if not skip_thumbnails:
-            # Generate the thumbnail
-            try:
-                generate_thumbnail(
-                    mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                    fw_meta[fw_meta["mapping"] == record["mapping"]],
-                    THUMBNAILS_DIR / f"{record['type_file']}.png",
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate thumbnail for {record['type']}: {e}",
-                    flush=True,
-                )
+    Graphs are generated for the MaleCNS side of dimorphic and male-specific
+    types and for the FlyWire side of dimorphic and female-specific types.
+    Isomorphic types only link to (possibly existing) FlyWire graphs.
 
-        # Render the template with the meta data
-        rendered = individual_template.render(meta=record)
+    Parameters
+    ----------
+    record :    TypeRecord
+                The type to generate the page for. Gets the relative paths
+                to its graphs.
+    template :  jinja2.Template
+                The template for the type's kind of dimorphism.
+    mcns_meta : pd.DataFrame
+                The meta data for MaleCNS neurons.
+    fw_meta :   pd.DataFrame
+                The meta data for FlyWire neurons.
+    mcns_conn : TypeConnectivity
+                Type-level connectivity for MaleCNS neurons.
+    fw_conn :   TypeConnectivity
+                Type-level connectivity for FlyWire neurons.
+    skip_graphs : bool
+                If True, skip generating the graphs.
+    skip_thumbnails : bool
+                If True, skip generating the thumbnail.
 
-        # Write the rendered HTML to a file
-        with open(SUMMARY_TYPES_DIR / f"{record['type_file']}.md", "w") as f:
-            f.write(rendered)
+    """
+    print(
+        f"  Generating summary page for type {record.type} "
+        f"({record.dimorphism_type})...",
+        flush=True,
+    )
+    has_mcns_graph = record.dimorphism_type in ("dimorphic", "male-specific")
+    has_fw_graph = record.dimorphism_type in ("dimorphic", "female-specific")
 
-    # Loop through each male-specific cell type and generate a page for it
-    individual_template = JINJA_ENV.get_template("female_spec_individual.md")
-    for record in female_meta:
-        print(
-            f"  Generating summary page for type {record['type']} (female-specific)...",
-            flush=True,
-        )
+    this_mcns = mcns_meta[mcns_meta["mapping"] == record.mapping]
+    this_fw = fw_meta[fw_meta["mapping"] == record.mapping]
 
-        # Generate the graph
-        if not skip_graphs:
-            try:
+    # Generate the graph
+    if not skip_graphs and (has_mcns_graph or has_fw_graph):
+        # The graph backend (d3graph) is only imported if needed
+        from .graphs import generate_graphs
+
+        try:
+            with profiling.stage("graph", type=record.type):
                 generate_graphs(
-                    record["type"],
-                    pd.DataFrame(),
-                    fw_meta[fw_meta["mapping"] == record["mapping"]],
-                    mcns_meta,
-                    fw_meta,
-                    fw_edges,
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate graph for {record['type']}: {e}", flush=True
+                    record.type,
+                    this_mcns if has_mcns_graph else pd.DataFrame(),
+                    this_fw if has_fw_graph else pd.DataFrame(),
+                    mcns_conn,
+                    fw_conn,
                 )
+        except Exception as e:
+            print(f"  Failed to generate graph for {record.type}: {e}", flush=True)
 
-        record["graph_file_fw"] = BUILD_DIR / "graphs" / (record["type"] + "_fw.html")
-        record["graph_file_fw_rel"] = f"../../graphs/{record['type']}_fw.html"
+    if has_mcns_graph:
+        record.graph_file_mcns_rel = f"../../graphs/{record.type}_mcns.html"
+    if has_fw_graph or record.dimorphism_type == "isomorphic":
+        record.graph_file_fw_rel = f"../../graphs/{record.type}_fw.html"
 
-        if not skip_thumbnails:
-            # Generate the thumbnail
-            try:
+    if not skip_thumbnails:
+        # Generate the thumbnail
+        try:
+            with profiling.stage("thumbnail", type=record.type):
                 generate_thumbnail(
-                    mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                    fw_meta[fw_meta["mapping"] == record["mapping"]],
-                    THUMBNAILS_DIR / f"{record['type_file']}.png",
-                )
-            except Exception as e:
-                print(
-                    f"  Failed to generate thumbnail for {record['type']}: {e}",
-                    flush=True,
+                    this_mcns, this_fw, THUMBNAILS_DIR / f"{record.type_file}.png"
                 )
+        except Exception as e:
+            print(f"  Failed to generate thumbnail for {record.type}: {e}", flush=True)
 
+    with profiling.stage("page", type=record.type):
         # Render the template with the meta data
-        rendered = individual_template.render(meta=record)
+        rendered = template.render(meta=record)
 
         # Write the rendered HTML to a file
-        with open(SUMMARY_TYPES_DIR / f"{record['type_file']}.md", "w") as f:
+        with open(SUMMARY_TYPES_DIR / f"{record.type_file}.md", "w") as f:
             f.write(rendered)
 
-    # Loop through each isomorphic cell type that contributes to a synonym
-    individual_template = JINJA_ENV.get_template("isomorphism_individual.md")
-    for name, syn in by_synonyms.items():
-        for record in syn["types_iso"]:
-            print(
-                f"  Generating summary page for isomorphic type {record['type']} ({name})...",
-                flush=True,
-            )
-
-            # Generate the graph
-            # if not skip_graphs:
-            #     try:
-            #         generate_graphs(
-            #             record["type"],
-            #             pd.DataFrame(),
-            #             fw_meta[fw_meta["mapping"] == record["mapping"]],
-            #             mcns_meta,
-            #             fw_meta,
-            #             fw_edges,
-            #         )
-            #     except Exception as e:
-            #         print(
-            #             f"  Failed to generate graph for {record['type']}: {e}", flush=True
-            #         )
-
-            record["graph_file_fw"] = (
-                BUILD_DIR / "graphs" / (record["type"] + "_fw.html")
-            )
-            record["graph_file_fw_rel"] = f"../../graphs/{record['type']}_fw.html"
-
-            if not skip_thumbnails:
-                # Generate the thumbnail
-                try:
-                    generate_thumbnail(
-                        mcns_meta[mcns_meta["mapping"] == record["mapping"]],
-                        fw_meta[fw_meta["mapping"] == record["mapping"]],
-                        THUMBNAILS_DIR / f"{record['type_file']}.png",
-                    )
-                except Exception as e:
-                    print(
-                        f"  Failed to generate thumbnail for {record['type']}: {e}",
-                        flush=True,
-                    )
-
-            # Render the template with the meta data
-            rendered = individual_template.render(meta=record)
-
-            # Write the rendered HTML to a file
-            with open(SUMMARY_TYPES_DIR / f"{record['type_file']}.md", "w") as f:
-                f.write(rendered)
-
-    print("Done.", flush=True)
-
 
+@profiling.profiled
 def extract_type_data(mcns_meta, fw_meta):
     """Extract the data for the iso- and dimorphic cell types.
 
@@ -370,13 +284,13 @@ def extract_type_data(mcns_meta, fw_meta):
 
     Returns
     -------
-    dimorphic_meta : list of dicts
+    dimorphic_meta : list of TypeRecord
                     The meta data for the dimorphic cell types.
-    male_meta :     list of dicts
+    male_meta :     list of TypeRecord
                     The meta data for the male-specific cell types.
-    female_meta :   list of dicts
+    female_meta :   list of TypeRecord
                     The meta data for the female-specific cell types.
-    iso_meta :      list of dicts
+    iso_meta :      list of TypeRecord
                     The meta data for the isomorphic cell types.
 
     """
@@ -390,9 +304,6 @@ def extract_type_data(mcns_meta, fw_meta):
             ISO_META.copy(),
         )
 
-    # Prepare FlyWire meta data for faster indexing
-    fw_meta_grp = {k: v for k, v in fw_meta.groupby("mapping")}
-
     ####
     # Dimorphic types
     ####
@@ -401,90 +312,16 @@ def extract_type_data(mcns_meta, fw_meta):
     # (i.e. "sexually dimorphic" and "potentially sexually dimorphic")
     dimorphic_types = mcns_meta[
         mcns_meta.dimorphism.str.contains("dimorphic", na=False)
-    ].drop(columns=["roiInfo", "inputRois", "outputRois"])
+    ]
 
     # For each type compile a dictionary with relevant data
-    dimorphic_meta = []
-    for t, table in dimorphic_types.groupby("mapping"):
-        dimorphic_meta.append({})
-
-        dimorphic_meta[-1]["type_file"] = t.replace(" ", "_").replace("/", "_")
-
-        # Agglomerate into a single value for each column (if possible)
-        for col in table.columns:
-            vals = table[col].unique()
-            vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-            if len(vals) == 1:
-                dimorphic_meta[-1][col] = vals[0]
-            elif len(vals) == 0:
-                dimorphic_meta[-1][col] = "N/A"
-            else:
-                dimorphic_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-        # What type of dimorphism is this?
-        dimorphic_meta[-1]["dimorphism_type"] = "dimorphic"
-
-        # Add counts
-        counts = table.somaSide.value_counts()
-        if counts.empty:
-            counts = table.rootSide.value_counts()
-
-        dimorphic_meta[-1]["n_mcnsr"] = counts.get("R", 0)
-        dimorphic_meta[-1]["n_mcnsl"] = counts.get("L", 0)
-
-        # Generate links to neuPrint
-        dimorphic_meta[-1]["neuprint_url"] = NEUPRINT_SEARCH_URL.format(
-            neuron_name=quote_plus(dimorphic_meta[-1]["type"])
-        )
-        dimorphic_meta[-1]["neuprint_conn_url"] = NEUPRINT_CONNECTIVITY_URL.format(
-            neuron_name=quote_plus(dimorphic_meta[-1]["type"])
-        )
-
-        # Get a neuroglancer scene to populate
-        scene = prep_scene(table)
-        scene.layers[1]["segments"] = table["bodyId"].values
-
-        # Grab the corresponding type in FlyWire
-        table_fw = fw_meta_grp.get(t, pd.DataFrame([]))
-        if table_fw.empty:
-            print(f"  No matching FlyWire type for {t}.", flush=True)
-        else:
-            # Agglomerate into a single value for each column (if possible)
-            for col in table_fw.columns:
-                # Skip columns that are already in the MCNS meta data
-                if col in mcns_meta.columns:
-                    continue
-                vals = table_fw[col].unique()
-                vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-                if len(vals) == 1:
-                    dimorphic_meta[-1][col] = vals[0]
-                elif len(vals) == 0:
-                    dimorphic_meta[-1][col] = "N/A"
-                else:
-                    dimorphic_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-            # Add counts
-            counts = table_fw.side.value_counts()
-            dimorphic_meta[-1]["n_fwr"] = counts.get("right", 0)
-            dimorphic_meta[-1]["n_fwl"] = counts.get("left", 0)
-
-            scene.layers[2]["segments"] = table_fw["root_id"].values
-
-        dimorphic_meta[-1]["url"] = scene.url
-
-        # Last but not least: find a label to use for this type
-        for col in (
-            "type",
-            "hemibrain_type",
-            "flywire_type",
-            "malecns_type",
-            "cell_type",
-            "mapping",  # resort to the mapping if all else fails
-        ):
-            if col in table.columns:
-                if table[col].notnull().any():
-                    dimorphic_meta[-1]["label"] = table[col].dropna().unique()[0]
-                    break
+    dimorphic_meta = _compile_type_records(
+        dimorphic_types,
+        by="mapping",
+        dimorphism_type="dimorphic",
+        fw_meta=fw_meta,
+        skip_columns=mcns_meta.columns,
+    )
 
     print(f"Found {len(dimorphic_meta):,} dimorphic cell types.", flush=True)
 
@@ -499,48 +336,9 @@ def extract_type_data(mcns_meta, fw_meta):
     # !!!! do not have a type. We will drop them for now.
     male_types = male_types[male_types.type.notnull()]
 
-    male_meta = []
-    for t, table in male_types.groupby("type"):
-        male_meta.append({})
-
-        male_meta[-1]["type_file"] = t.replace(" ", "_").replace("/", "_")
-
-        for col in table.columns:
-            vals = table[col].unique()
-            vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-            if len(vals) == 1:
-                male_meta[-1][col] = vals[0]
-            elif len(vals) == 0:
-                male_meta[-1][col] = "N/A"
-            else:
-                male_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-        # What type of dimorphism is this?
-        male_meta[-1]["dimorphism_type"] = "male-specific"
-
-        # Add counts
-        counts = table.somaSide.value_counts()
-        if counts.empty:
-            counts = table.rootSide.value_counts()
-
-        male_meta[-1]["n_mcnsr"] = counts.get("R", 0)
-        male_meta[-1]["n_mcnsl"] = counts.get("L", 0)
-
-        # Generate links to neuPrint
-        male_meta[-1]["neuprint_url"] = NEUPRINT_SEARCH_URL.format(
-            neuron_name=quote_plus(male_meta[-1]["type"])
-        )
-        male_meta[-1]["neuprint_conn_url"] = NEUPRINT_CONNECTIVITY_URL.format(
-            neuron_name=quote_plus(male_meta[-1]["type"])
-        )
-
-        # Get a neuroglancer scene to populate
-        scene = prep_scene(table)
-        scene.layers[1]["segments"] = table["bodyId"].values
-        male_meta[-1]["url"] = scene.url
-
-        # For male-specific neurons we should always have a `type`
-        male_meta[-1]["label"] = t
+    male_meta = _compile_type_records(
+        male_types, by="type", dimorphism_type="male-specific"
+    )
 
     print(f"Found {len(male_meta):,} male-specific cell types.", flush=True)
 
@@ -558,39 +356,9 @@ def extract_type_data(mcns_meta, fw_meta):
         )
         # .fillna("unknown")
     )
-    female_meta = []
-    for t, table_fw in female_types.groupby("type"):
-        female_meta.append({})
-
-        female_meta[-1]["type_file"] = t.replace(" ", "_").replace("/", "_")
-
-        # Agglomerate into a single value for each column (if possible)
-        for col in table_fw.columns:
-            vals = table_fw[col].unique()
-            vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-            if len(vals) == 1:
-                female_meta[-1][col] = vals[0]
-            elif len(vals) == 0:
-                female_meta[-1][col] = "N/A"
-            else:
-                female_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-        # What type of dimorphism is this?
-        female_meta[-1]["dimorphism_type"] = "female-specific"
-
-        # Add counts
-        counts = table_fw.side.value_counts()
-        female_meta[-1]["n_fwr"] = counts.get("right", 0)
-        female_meta[-1]["n_fwl"] = counts.get("left", 0)
-
-        # Get a neuroglancer scene to populate
-        scene = prep_scene(table_fw)
-        scene.layers[2]["segments"] = table_fw["root_id"].values
-
-        female_meta[-1]["url"] = scene.url
-
-        # For female-specific neurons we should always have a `type`
-        female_meta[-1]["label"] = t
+    female_meta = _compile_type_records(
+        female_types, by="type", dimorphism_type="female-specific"
+    )
 
     print(f"Found {len(female_meta):,} female-specific cell types.", flush=True)
 
@@ -599,92 +367,16 @@ def extract_type_data(mcns_meta, fw_meta):
     ####
 
     # Filter to isomorphic types
-    isomorphic_types = mcns_meta[mcns_meta.dimorphism.isnull()].drop(
-        columns=["roiInfo", "inputRois", "outputRois"]
-    )
+    isomorphic_types = mcns_meta[mcns_meta.dimorphism.isnull()]
 
     # For each type compile a dictionary with relevant data
-    iso_meta = []
-    for t, table in isomorphic_types.groupby("mapping"):
-        iso_meta.append({})
-
-        iso_meta[-1]["type_file"] = t.replace(" ", "_").replace("/", "_")
-
-        # Agglomerate into a single value for each column (if possible)
-        for col in table.columns:
-            vals = table[col].unique()
-            vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-            if len(vals) == 1:
-                iso_meta[-1][col] = vals[0]
-            elif len(vals) == 0:
-                iso_meta[-1][col] = "N/A"
-            else:
-                iso_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-        # What type of dimorphism is this?
-        iso_meta[-1]["dimorphism_type"] = "isomorphic"
-
-        # Add counts
-        counts = table.somaSide.value_counts()
-        if counts.empty:
-            counts = table.rootSide.value_counts()
-
-        iso_meta[-1]["n_mcnsr"] = counts.get("R", 0)
-        iso_meta[-1]["n_mcnsl"] = counts.get("L", 0)
-
-        # Generate links to neuPrint
-        iso_meta[-1]["neuprint_url"] = NEUPRINT_SEARCH_URL.format(
-            neuron_name=quote_plus(iso_meta[-1]["type"])
-        )
-        iso_meta[-1]["neuprint_conn_url"] = NEUPRINT_CONNECTIVITY_URL.format(
-            neuron_name=quote_plus(iso_meta[-1]["type"])
-        )
-
-        # Get a neuroglancer scene to populate
-        scene = prep_scene(table)
-        scene.layers[1]["segments"] = table["bodyId"].values
-
-        # Grab the corresponding type in FlyWire
-        table_fw = fw_meta_grp.get(t, pd.DataFrame([]))
-        if table_fw.empty:
-            print(f"  No matching FlyWire type for {t}.", flush=True)
-        else:
-            # Agglomerate into a single value for each column (if possible)
-            for col in table_fw.columns:
-                # Skip columns that are already in the MCNS meta data
-                if col in mcns_meta.columns:
-                    continue
-                vals = table_fw[col].unique()
-                vals = vals[~pd.isnull(vals)]  # dropping NaNs afterwards is faster
-                if len(vals) == 1:
-                    iso_meta[-1][col] = vals[0]
-                elif len(vals) == 0:
-                    iso_meta[-1][col] = "N/A"
-                else:
-                    iso_meta[-1][col] = "; ".join(sorted(vals.astype(str)))
-
-            # Add counts
-            counts = table_fw.side.value_counts()
-            iso_meta[-1]["n_fwr"] = counts.get("right", 0)
-            iso_meta[-1]["n_fwl"] = counts.get("left", 0)
-
-            scene.layers[2]["segments"] = table_fw["root_id"].values
-
-        iso_meta[-1]["url"] = scene.url
-
-        # Last but not least: find a label to use for this type
-        for col in (
-            "type",
-            "hemibrain_type",
-            "flywire_type",
-            "malecns_type",
-            "cell_type",
-            "mapping",  # resort to the mapping if all else fails
-        ):
-            if col in table.columns:
-                if table[col].notnull().any():
-                    iso_meta[-1]["label"] = table[col].dropna().unique()[0]
-                    break
+    iso_meta = _compile_type_records(
+        isomorphic_types,
+        by="mapping",
+        dimorphism_type="isomorphic",
+        fw_meta=fw_meta,
+        skip_columns=mcns_meta.columns,
+    )
 
     print(f"Found {len(iso_meta):,} isomorphic cell types.", flush=True)
 
@@ -693,7 +385,7 @@ def extract_type_data(mcns_meta, fw_meta):
         # Add hyperlinks to the synonyms
         synonyms = record.get("synonyms", None)
         if not synonyms or synonyms == "N/A":
-            record["synonyms_linked"] = ""
+            record.synonyms_linked = ""
             continue
 
         # Parse synonyms
@@ -711,7 +403,7 @@ def extract_type_data(mcns_meta, fw_meta):
             synonyms_linked.append(
                 f'{author_year}: <a href="../../synonyms/{syn}">{syn}</a>'
             )
-        record["synonyms_linked"] = "; ".join(synonyms_linked)
+        record.synonyms_linked = "; ".join(synonyms_linked)
 
     # Save the meta data for later use
     DIMORPHIC_META = dimorphic_meta.copy()
@@ -722,29 +414,161 @@ def extract_type_data(mcns_meta, fw_meta):
     return dimorphic_meta, male_meta, female_meta, iso_meta
 
 
+def _compile_type_records(
+    table: pd.DataFrame,
+    by: str,
+    dimorphism_type: str,
+    fw_meta: pd.DataFrame = None,
+    skip_columns=(),
+) -> List[TypeRecord]:
+    """Compile a record for each type in the given meta data.
+
+    All columns are agglomerated in a single vectorised pass (see
+    `aggregation.agglomerate`) instead of looping over each type.
+
+    Parameters
+    ----------
+    table :     pd.DataFrame
+                Meta data for the neurons to compile records for. Can be either
+                MaleCNS (i.e. has a `bodyId` column) or FlyWire neurons.
+    by :        str
+                The column to group neurons into types by.
+    dimorphism_type : str
+                What kind of dimorphism these types represent.
+    fw_meta :   pd.DataFrame, optional
+                If provided, will add data for the corresponding FlyWire
+                neurons (matched via the `by` column) to each record.
+    skip_columns : iterable
+                FlyWire columns to skip when adding FlyWire data (typically
+                because they already exist in the MaleCNS meta data).
+
+    Returns
+    -------
+    records :   list of TypeRecord
+                One record for each type, sorted by `by`.
+
+    """
+    is_mcns = "bodyId" in table.columns
+    table = table[table[by].notnull()]
+
+    # Agglomerate into a single value for each column (if possible)
+    # (only the columns that end up in the records)
+    agg = agglomerate(
+        table, by, columns=[c for c in table.columns if c in TypeRecord.COLUMNS]
+    )
+    if is_mcns:
+        counts = count_values(table, by, "somaSide", ("R", "L"), fallback="rootSide")
+        counts.columns = ["n_mcnsr", "n_mcnsl"]
+    else:
+        counts = count_values(table, by, "side", ("right", "left"))
+        counts.columns = ["n_fwr", "n_fwl"]
+    counts = counts.to_dict("index")
+
+    # Find a label to use for each type
+    labels = first_valid(
+        table,
+        by,
+        (
+            "type",
+            "hemibrain_type",
+            "flywire_type",
+            "malecns_type",
+            "cell_type",
+            "mapping",  # resort to the mapping if all else fails
+        ),
+    )
+
+    # Grab the corresponding types in FlyWire
+    if fw_meta is not None:
+        fw_meta = fw_meta[fw_meta[by].isin(agg.index)]
+        fw_agg = agglomerate(
+            fw_meta,
+            by,
+            columns=[
+                c
+                for c in fw_meta.columns
+                if c in TypeRecord.COLUMNS and c not in skip_columns
+            ],
+        ).to_dict("index")
+        fw_counts = count_values(fw_meta, by, "side", ("right", "left"))
+        fw_counts.columns = ["n_fwr", "n_fwl"]
+        fw_counts = fw_counts.to_dict("index")
+        fw_order, fw_slices = group_slices(fw_meta, by)
+        fw_ids = fw_meta["root_id"].values.astype(np.int64)[fw_order]
+
+    # Each type's neuron IDs are views into a single array sorted by type
+    order, slices = group_slices(table, by)
+    ids = table["bodyId" if is_mcns else "root_id"].values.astype(np.int64)[order]
+
+    records = []
+    for t, fields in agg.to_dict("index").items():
+        record = TypeRecord(type_file=t.replace(" ", "_").replace("/", "_"), **fields)
+
+        # What type of dimorphism is this?
+        record.dimorphism_type = dimorphism_type
+
+        # Add counts
+        record.update(counts[t])
+
+        # Generate links to neuPrint
+        if is_mcns:
+            record.neuprint_url = NEUPRINT_SEARCH_URL.format(
+                neuron_name=quote_plus(record.type)
+            )
+            record.neuprint_conn_url = NEUPRINT_CONNECTIVITY_URL.format(
+                neuron_name=quote_plus(record.type)
+            )
+
+        # Get a neuroglancer scene to populate
+        scene = prep_scene(table.iloc[order[slices[t]]])
+        if is_mcns:
+            record.body_ids = ids[slices[t]]
+            scene.layers[1]["segments"] = record.body_ids
+        else:
+            record.root_ids = ids[slices[t]]
+            scene.layers[2]["segments"] = record.root_ids
+
+        if fw_meta is not None:
+            if t not in fw_slices:
+                print(f"  No matching FlyWire type for {t}.", flush=True)
+            else:
+                record.update(fw_agg[t])
+                record.update(fw_counts[t])
+                record.root_ids = fw_ids[fw_slices[t]]
+                scene.layers[2]["segments"] = record.root_ids
+
+        record.url = scene.url
+        record.label = labels.loc[t]
+
+        records.append(record)
+
+    return records
+
+
+@profiling.profiled
 def group_by_region(
-    dimorphic_meta: List[Dict],
-    male_meta: List[Dict],
-    female_meta: List[Dict],
-    mcns_roi_info: pd.DataFrame,
-    fw_roi_info: pd.DataFrame,
+    dimorphic_meta: List[TypeRecord],
+    male_meta: List[TypeRecord],
+    female_meta: List[TypeRecord],
+    mcns_roi_profiles: pd.DataFrame,
+    fw_roi_profiles: pd.DataFrame,
     threshold=0.1,
 ) -> List[List[Dict]]:
     """Sort the dimorphic/sex-specific cell types into brain regions.
 
     Parameters
     ----------
-    dimorphic_meta :    list of dicts
+    dimorphic_meta :    list of TypeRecord
                         The meta data for the dimorphic cell types.
-    male_meta :         list of dicts
+    male_meta :         list of TypeRecord
                         The meta data for the male-specific cell types.
-    female_meta :       list of dicts
+    female_meta :       list of TypeRecord
                         The meta data for the female-specific cell types.
-    mcns_roi_info :     pd.DataFrame
-                        The ROI info for MaleCNS neurons as returned from neuPrint.
-    fw_roi_info :       pd.DataFrame
-                        The ROI info for FlyWire neurons. Compiled from Zenodo
-                        data dump - see loading.py for details.
+    mcns_roi_profiles : pd.DataFrame
+                        The normalised ROI profiles for MaleCNS neurons. See
+                        `loading.load_cache_roi_profiles` for details.
+    fw_roi_profiles :   pd.DataFrame
+                        The normalised ROI profiles for FlyWire neurons.
     threshold :         float [0-1]
                         Fraction of the total in- OR outputs to a given ROI to be
                         considered a main input/output. Default is 0.1.
@@ -756,118 +580,34 @@ def group_by_region(
                         {"CentralBrain": [{"name": "region1", "types": []}, ...], ...}
 
     """
-    # First assign each primary ROI to either Optic, VNC or brain
-    roi_hierarchy = NEUPRINT_CLIENT.meta["roiHierarchy"]
-    roi2compartment = {}
-    for comp in roi_hierarchy["children"]:
-        roi2compartment.update({c["name"]: comp["name"] for c in comp["children"]})
-
-    # Collapse left and right compartments
-    roi2compartment = {
-        r.replace("(L)", "").replace("(R)", ""): c.replace("(L)", "").replace("(R)", "")
-        for r, c in roi2compartment.items()
-    }
-
-    # Collapse left and right ROIs in the ROI info
-    mcns_roi_info["roi"] = (
-        mcns_roi_info["roi"].str.replace("(L)", "").str.replace("(R)", "")
-    )
-    fw_roi_info["roi"] = (
-        fw_roi_info["roi"].str.replace("(L)", "").str.replace("(R)", "")
-    )
+    roi2compartment = _roi2compartment()
 
-    # Fix up Mushroom body compartments to align with FlyWire
-    mb_vl = ("aL", "a'L")
-    mb_ml = ("gL", "bL", "b'L")
-    mcns_roi_info.loc[mcns_roi_info.roi.isin((mb_vl)), "roi"] = "MB_VL"
-    mcns_roi_info.loc[mcns_roi_info.roi.isin((mb_ml)), "roi"] = "MB_ML"
-    mcns_roi_info.loc[mcns_roi_info.roi == "PED", "roi"] = "MB_PED"
-    roi2compartment.update(
-        {"MB_VL": "CentralBrain", "MB_ML": "CentralBrain", "MB_PED": "CentralBrain"}
-    )
-
-    # Aggregate the ROI info again
-    mcns_roi_info = (
-        mcns_roi_info.groupby(["bodyId", "roi"])[["pre", "post"]].sum().reset_index()
-    )
-    fw_roi_info = (
-        fw_roi_info.groupby(["root_id", "roi"])[["pre", "post"]].sum().reset_index()
-    )
-
-    # Normalise the ROI counts
-    mcns_roi_info["post_norm"] = (
-        mcns_roi_info["post"]
-        / mcns_roi_info.bodyId.map(mcns_roi_info.groupby("bodyId")["post"].sum())
-    ).fillna(0)
-    mcns_roi_info["pre_norm"] = (
-        mcns_roi_info["pre"]
-        / mcns_roi_info.bodyId.map(mcns_roi_info.groupby("bodyId")["pre"].sum())
-    ).fillna(0)
-    fw_roi_info["post_norm"] = (
-        fw_roi_info["post"]
-        / fw_roi_info.root_id.map(fw_roi_info.groupby("root_id")["post"].sum())
-    ).fillna(0)
-    fw_roi_info["pre_norm"] = (
-        fw_roi_info["pre"]
-        / fw_roi_info.root_id.map(fw_roi_info.groupby("root_id")["pre"].sum())
-    ).fillna(0)
-
-    # Drop non-primary ROIs from mcns_roi_info
-    mcns_roi_info = mcns_roi_info[mcns_roi_info.roi.isin(list(roi2compartment))]
-
-    # Loop through each dimorphic cell type and get its main input/output ROIs
+    # Average the ROI profiles of each type's neurons in one go and assign
+    # types to the ROIs where they have their main inputs/outputs
     by_region = {}
-    for record in dimorphic_meta + male_meta:
-        # Parse the body IDs
-        if isinstance(record["bodyId"], str):
-            bids = np.array(record["bodyId"].split(";")).astype(int)
-        else:
-            bids = np.array([record["bodyId"]]).astype(int)
-
-        # Get aggregate ROIs for these IDs
-        rois = (
-            mcns_roi_info[mcns_roi_info.bodyId.isin(bids)]
-            .groupby("roi")[["pre_norm", "post_norm"]]
-            .mean()
-        )
-        record["roi_counts"] = rois.to_dict()
-
-        for roi in rois.index.values[
-            (rois.pre_norm >= threshold) | (rois.post_norm >= threshold)
-        ]:
-            comp = roi2compartment.get(roi, "unknown")
-            if comp not in by_region:
-                by_region[comp] = {}
-            if roi not in by_region[comp]:
-                by_region[comp][roi] = {"types": []}
-            by_region[comp][roi]["name"] = roi
-            by_region[comp][roi]["types"].append(record)
-
-    for record in female_meta:
-        # Parse the root IDs
-        if isinstance(record["root_id"], str):
-            roots = np.array(record["root_id"].split(";")).astype(int)
-        else:
-            roots = np.array([record["root_id"]]).astype(int)
-
-        # Get aggregate ROIs for these IDs
-        rois = (
-            fw_roi_info[fw_roi_info.root_id.isin(roots)]
-            .groupby("roi")[["pre_norm", "post_norm"]]
-            .mean()
+    scores = {}
+    for records, profiles, id_col, ids in (
+        (dimorphic_meta + male_meta, mcns_roi_profiles, "bodyId", "body_ids"),
+        (female_meta, fw_roi_profiles, "root_id", "root_ids"),
+    ):
+        rois, pre, post = _add_roi_counts(
+            records, profiles, id_col, ids, roi2compartment
         )
-        record["roi_counts"] = rois.to_dict()
 
-        for roi in rois.index.values[
-            (rois.pre_norm >= threshold) | (rois.post_norm >= threshold)
-        ]:
+        # (np.nonzero goes through types in order and their ROIs alphabetically)
+        is_main = (pre >= threshold) | (post >= threshold)
+        score = np.fmax(pre, post)
+        for i, j in zip(*np.nonzero(is_main)):
+            roi = rois[j]
             comp = roi2compartment.get(roi, "unknown")
             if comp not in by_region:
                 by_region[comp] = {}
             if roi not in by_region[comp]:
                 by_region[comp][roi] = {"types": []}
+                scores[(comp, roi)] = []
             by_region[comp][roi]["name"] = roi
-            by_region[comp][roi]["types"].append(record)
+            by_region[comp][roi]["types"].append(records[i])
+            scores[(comp, roi)].append(score[i, j])
 
     # Drop some ROIs that we don't want
     for comp in by_region:
@@ -885,21 +625,163 @@ def group_by_region(
     # Sort types by how much they are in each compartment
     for comp in by_region:
         for roi in by_region[comp]:
-            by_region[comp][roi]["types"] = sorted(
-                by_region[comp][roi]["types"],
-                key=lambda x: max(
-                    x["roi_counts"]["pre_norm"][roi], x["roi_counts"]["post_norm"][roi]
-                ),
-                reverse=True,
-            )
+            order = np.argsort(-np.array(scores[(comp, roi)]), kind="stable")
+            types = by_region[comp][roi]["types"]
+            by_region[comp][roi]["types"] = [types[i] for i in order]
 
     return by_region
 
 
+@profiling.profiled
+def find_closest_types(records: List[TypeRecord], N: int = 10) -> None:
+    """Add the N types with the most similar ROI profiles to each record.
+
+    Types are compared by the cosine similarity of their mean input and output
+    fractions per ROI (see `group_by_region`), across MaleCNS and FlyWire.
+
+    Parameters
+    ----------
+    records :   list of TypeRecord
+                Type records with `roi_counts`. Modified in place: each record
+                gets a `closest_types` list with the `label`, `type_file`,
+                `dimorphism_type` and `similarity` of its closest types.
+    N :         int
+                Number of closest types to find.
+
+    """
+    features = pd.concat(
+        [
+            pd.DataFrame.from_records(
+                [r.roi_counts[col] for r in records], index=np.arange(len(records))
+            ).add_prefix(f"{col}:")
+            for col in ("pre_norm", "post_norm")
+        ],
+        axis=1,
+    )
+    neighbours, similarity = ProfileIndex(features.values).knn(N)
+
+    for record, nn, sim in zip(records, neighbours, similarity):
+        record.closest_types = [
+            {
+                "label": records[i].label,
+                "type_file": records[i].type_file,
+                "dimorphism_type": records[i].dimorphism_type,
+                "similarity": float(s),
+            }
+            for i, s in zip(nn, sim)
+            if i >= 0
+        ]
+
+
+def _roi2compartment() -> Dict[str, str]:
+    """Map each (collapsed) primary ROI to its compartment.
+
+    Returns
+    -------
+    dict
+                {roi: compartment}, e.g. {"AL": "CentralBrain", "ME": "Optic"}.
+
+    """
+    # First assign each primary ROI to either Optic, VNC or brain
+    roi_hierarchy = env.NEUPRINT_META["roiHierarchy"]
+    roi2compartment = {}
+    for comp in roi_hierarchy["children"]:
+        roi2compartment.update({c["name"]: comp["name"] for c in comp["children"]})
+
+    # Collapse left and right compartments
+    roi2compartment = {
+        collapse_roi(r): collapse_roi(c) for r, c in roi2compartment.items()
+    }
+
+    # Mushroom body compartments were combined to align with FlyWire
+    roi2compartment.update({r: "CentralBrain" for r in MB_COMPARTMENTS.values()})
+
+    return roi2compartment
+
+
+def _add_roi_counts(
+    records: List[TypeRecord],
+    profiles: pd.DataFrame,
+    id_col: str,
+    ids: str,
+    roi2compartment: Dict[str, str],
+):
+    """Add the mean ROI profile of each type's neurons to its record.
+
+    Parameters
+    ----------
+    records :           list of TypeRecord
+                        Type records with neuron ID arrays in `ids`.
+                        Modified in place: each record gets a `roi_counts` dict
+                        with the mean `pre_norm` and `post_norm` per ROI.
+    profiles :          pd.DataFrame
+                        The normalised ROI profiles. See
+                        `loading.load_cache_roi_profiles` for details.
+    id_col :            str
+                        The neuron ID column of the profiles ("bodyId" or
+                        "root_id").
+    ids :               "body_ids" | "root_ids"
+                        The record field with the neuron IDs.
+    roi2compartment :   dict
+                        Primary ROIs (keys) to keep. See `_roi2compartment`.
+
+    Returns
+    -------
+    rois :              (M, ) np.ndarray
+                        The ROIs.
+    pre, post :         (N, M) np.ndarray
+                        Mean pre/post fractions of each record (rows) per ROI
+                        (columns). NaN where a type has no neurons in the profiles.
+
+    """
+    # Drop non-primary ROIs
+    profiles = profiles[profiles.roi.isin(list(roi2compartment))]
+
+    pre, post = group_roi_profiles(profiles, _record_ids(records, ids), id_col)
+    pre = pre.reindex(np.arange(len(records)))
+    post = post.reindex(np.arange(len(records)))
+    rois = np.asarray(pre.columns, dtype=object)
+    pre, post = pre.values, post.values
+
+    for i, record in enumerate(records):
+        has_roi = ~np.isnan(pre[i])
+        record.roi_counts = {
+            "pre_norm": dict(zip(rois[has_roi], pre[i, has_roi].tolist())),
+            "post_norm": dict(zip(rois[has_roi], post[i, has_roi].tolist())),
+        }
+
+    return rois, pre, post
+
+
+def _record_ids(records, field):
+    """Map neuron IDs to the index of their type record.
+
+    Parameters
+    ----------
+    records :   list of TypeRecord
+                Type records with ID arrays in `field`.
+    field :     "body_ids" | "root_ids"
+                The record field with the neuron IDs.
+
+    Returns
+    -------
+    pd.Series
+                Record indices (values) indexed by neuron ID.
+
+    """
+    ids = [record.get(field, _NO_IDS) for record in records]
+    n_ids = [len(i) for i in ids]
+    return pd.Series(
+        np.repeat(np.arange(len(records)), n_ids),
+        index=np.concatenate(ids) if ids else _NO_IDS,
+    )
+
+
+@profiling.profiled
 def group_by_supertype(
-    dimorphic_meta: List[Dict],
-    male_meta: List[Dict],
-    female_meta: List[Dict],
+    dimorphic_meta: List[TypeRecord],
+    male_meta: List[TypeRecord],
+    female_meta: List[TypeRecord],
     mcns_meta: pd.DataFrame,
     fw_meta: pd.DataFrame,
 ) -> List[List[Dict]]:
@@ -907,11 +789,11 @@ def group_by_supertype(
 
     Parameters
     ----------
-    dimorphic_meta :    list of dicts
+    dimorphic_meta :    list of TypeRecord
                         The meta data for the dimorphic cell types.
-    male_meta :         list of dicts
+    male_meta :         list of TypeRecord
                         The meta data for the male-specific cell types.
-    female_meta :       list of dicts
+    female_meta :       list of TypeRecord
                         The meta data for the female-specific cell types.
     mcns_meta :         pd.DataFrame
                         The meta data for the neurons as returned from neuPrint.
@@ -947,12 +829,14 @@ def group_by_supertype(
                 }
             by_supertype[st]["name"] = st
             by_supertype[st]["types"].append(record)
-            by_supertype[st]["body_ids"].extend(body_ids)
-            by_supertype[st]["root_ids"].extend(root_ids)
-            by_supertype[st]["dimorphism_types"].add(record["dimorphism_type"])
+            by_supertype[st]["body_ids"].append(body_ids)
+            by_supertype[st]["root_ids"].append(root_ids)
+            by_supertype[st]["dimorphism_types"].add(record.dimorphism_type)
 
     # For each supertype collect some meta data
     for name, st in by_supertype.items():
+        st["body_ids"] = np.concatenate(st["body_ids"])
+        st["root_ids"] = np.concatenate(st["root_ids"])
         # MCNS counts
         st["n_mcns"] = len(st["body_ids"])
         # FlyWire counts
@@ -963,11 +847,12 @@ def group_by_supertype(
     return by_supertype
 
 
+@profiling.profiled
 def group_by_synonyms(
-    dimorphic_meta: List[Dict],
-    male_meta: List[Dict],
-    female_meta: List[Dict],
-    iso_meta: List[Dict],
+    dimorphic_meta: List[TypeRecord],
+    male_meta: List[TypeRecord],
+    female_meta: List[TypeRecord],
+    iso_meta: List[TypeRecord],
     mcns_meta: pd.DataFrame,
     fw_meta: pd.DataFrame,
 ) -> List[List[Dict]]:
@@ -977,13 +862,13 @@ def group_by_synonyms(
 
     Parameters
     ----------
-    dimorphic_meta :    list of dicts
+    dimorphic_meta :    list of TypeRecord
                         The meta data for the dimorphic cell types.
-    male_meta :         list of dicts
+    male_meta :         list of TypeRecord
                         The meta data for the male-specific cell types.
-    female_meta :       list of dicts
+    female_meta :       list of TypeRecord
                         The meta data for the female-specific cell types.
-    iso_meta :          list of dicts
+    iso_meta :          list of TypeRecord
                         The meta data for the isomorphic cell types.
     mcns_meta :         pd.DataFrame
                         The meta data for the neurons as returned from neuPrint.
@@ -1046,12 +931,12 @@ def group_by_synonyms(
             body_ids, root_ids = _get_ids_from_record(record)
 
             by_synonyms[syn]["name"] = syn
-            by_synonyms[syn]["body_ids"].extend(body_ids)
-            by_synonyms[syn]["root_ids"].extend(root_ids)
+            by_synonyms[syn]["body_ids"].append(body_ids)
+            by_synonyms[syn]["root_ids"].append(root_ids)
             by_synonyms[syn]["publications"].append(author_year)
-            by_synonyms[syn]["dimorphism_types"].add(record["dimorphism_type"])
+            by_synonyms[syn]["dimorphism_types"].add(record.dimorphism_type)
 
-            if record["dimorphism_type"] == "isomorphic":
+            if record.dimorphism_type == "isomorphic":
                 by_synonyms[syn]["types_iso"].append(record)
             else:
                 by_synonyms[syn]["types_dim"].append(record)
@@ -1060,6 +945,8 @@ def group_by_synonyms(
     for name, syn in by_synonyms.items():
         # There is at least one case of "aIP1/aIP4/aSP10" which causes issue with filepaths
         syn["file_name"] = name.replace(" ", "_").replace("/", "_")
+        syn["body_ids"] = np.concatenate(syn["body_ids"])
+        syn["root_ids"] = np.concatenate(syn["root_ids"])
 
         # MCNS counts
         syn["n_mcns"] = len(syn["body_ids"])
@@ -1083,10 +970,11 @@ def group_by_synonyms(
     return by_synonyms
 
 
+@profiling.profiled
 def group_by_hemilineage(
-    dimorphic_meta: List[Dict],
-    male_meta: List[Dict],
-    female_meta: List[Dict],
+    dimorphic_meta: List[TypeRecord],
+    male_meta: List[TypeRecord],
+    female_meta: List[TypeRecord],
     mcns_meta: pd.DataFrame,
     fw_meta: pd.DataFrame,
 ) -> List[List[Dict]]:
@@ -1094,11 +982,11 @@ def group_by_hemilineage(
 
     Parameters
     ----------
-    dimorphic_meta :    list of dicts
+    dimorphic_meta :    list of TypeRecord
                         The meta data for the dimorphic cell types.
-    male_meta :         list of dicts
+    male_meta :         list of TypeRecord
                         The meta data for the male-specific cell types.
-    female_meta :       list of dicts
+    female_meta :       list of TypeRecord
                         The meta data for the female-specific cell types.
     mcns_meta :         pd.DataFrame
                         The meta data for the neurons as returned from neuPrint.
@@ -1199,11 +1087,12 @@ def group_by_hemilineage(
 
     # Sort types alphabetically
     for hl in by_hemilineage.values():
-        hl["types"] = sorted(hl["types"], key=lambda x: x["type"])
+        hl["types"] = sorted(hl["types"], key=lambda x: x.type)
 
     return by_hemilineage
 
 
+@profiling.profiled
 def make_supertype_pages(
     mcns_meta: pd.DataFrame, fw_meta: pd.DataFrame, skip_thumbnails: bool
 ) -> None:
@@ -1239,7 +1128,7 @@ def make_supertype_pages(
         else:
             # Agglomerate into a single value for each column (if possible)
             for col in table_mcns.columns:
-                vals = table_mcns[col].fillna("None").unique()
+                vals = table_mcns[col].astype(object).fillna("None").unique()
                 if len(vals) == 1:
                     supertypes_meta[-1][col] = vals[0]
                 else:
@@ -1247,14 +1136,14 @@ def make_supertype_pages(
 
         # Add neuron counts
         counts = table_mcns.somaSide.value_counts()
-        if counts.empty:
+        if not counts.any():
             counts = table_mcns.rootSide.value_counts()
 
         supertypes_meta[-1]["n_mcnsr"] = counts.get("R", 0)
         supertypes_meta[-1]["n_mcnsl"] = counts.get("L", 0)
 
         # Add type counts
-        type_counts = table_mcns.groupby("somaSide").type.nunique()
+        type_counts = table_mcns.groupby("somaSide", observed=True).type.nunique()
         supertypes_meta[-1]["n_types_mcnsr"] = type_counts.get("R", 0)
         supertypes_meta[-1]["n_types_mcnsl"] = type_counts.get("L", 0)
 
@@ -1278,7 +1167,7 @@ def make_supertype_pages(
         supertypes_meta[-1]["n_fwl"] = counts.get("left", 0)
 
         # Add type counts
-        type_counts = table_fw.groupby("side").type.nunique()
+        type_counts = table_fw.groupby("side", observed=True).type.nunique()
         supertypes_meta[-1]["n_types_fwr"] = type_counts.get("right", 0)
         supertypes_meta[-1]["n_types_fwl"] = type_counts.get("left", 0)
 
@@ -1307,6 +1196,7 @@ def make_supertype_pages(
         # Write the rendered HTML to a file
         with open(SUPERTYPE_DIR / f"{record['supertype']}.md", "w") as f:
             f.write(rendered)
+        profiling.count()
 
     if not skip_thumbnails:
         print("Generating thumbnails for supertypes...", flush=True)
@@ -1325,11 +1215,12 @@ def make_supertype_pages(
                 continue
 
             try:
-                generate_thumbnail(
-                    this_mcns_meta,
-                    this_fw_meta,
-                    THUMBNAILS_DIR / f"{record['supertype']}.png",
-                )
+                with profiling.stage("thumbnail", supertype=record["supertype"]):
+                    generate_thumbnail(
+                        this_mcns_meta,
+                        this_fw_meta,
+                        THUMBNAILS_DIR / f"{record['supertype']}.png",
+                    )
             except Exception as e:
                 print(
                     f"  Failed to generate thumbnail for supertype {record['supertype']}: {e}",
@@ -1339,6 +1230,7 @@ def make_supertype_pages(
     print("Done.", flush=True)
 
 
+@profiling.profiled
 def make_synonyms_pages(
     mcns_meta: pd.DataFrame, fw_meta: pd.DataFrame, skip_thumbnails: bool
 ) -> None:
@@ -1370,8 +1262,8 @@ def make_synonyms_pages(
         this_fw = fw_meta[fw_meta.synonyms == synonyms]
 
         # Get the IDs (this will include things that are not typed yet)
-        body_ids = this_mcns.bodyId.values.tolist()
-        root_ids = this_fw.root_id.values.tolist()
+        body_ids = this_mcns.bodyId.values.astype(np.int64)
+        root_ids = this_fw.root_id.values.astype(np.int64)
 
         # Do we have any kind of dimorphism in this synonym?
         dimorphisms = np.unique(
@@ -1431,8 +1323,8 @@ def make_synonyms_pages(
                 }
 
             synonyms_meta[syn]["name"] = syn
-            synonyms_meta[syn]["body_ids"].extend(body_ids)
-            synonyms_meta[syn]["root_ids"].extend(root_ids)
+            synonyms_meta[syn]["body_ids"].append(body_ids)
+            synonyms_meta[syn]["root_ids"].append(root_ids)
             synonyms_meta[syn]["publications"] = synonyms_meta[syn][
                 "publications"
             ].union(set(author_year_parsed))
@@ -1449,6 +1341,8 @@ def make_synonyms_pages(
     for name, syn in synonyms_meta.items():
         # There is at least one case of "aIP1/aIP4/aSP10" which causes issue with filepaths
         syn["file_name"] = name.replace(" ", "_").replace("/", "_")
+        syn["body_ids"] = np.concatenate(syn["body_ids"])
+        syn["root_ids"] = np.concatenate(syn["root_ids"])
 
         # MCNS & FlyWire counts
         syn["n_mcns"] = len(syn["body_ids"])
@@ -1484,14 +1378,16 @@ def make_synonyms_pages(
         # Write the rendered HTML to a file
         with open(SYNONYMS_DIR / f"{record['file_name']}.md", "w") as f:
             f.write(rendered)
+        profiling.count()
 
         if not skip_thumbnails:
             try:
-                generate_thumbnail(
-                    mcns_meta[mcns_meta.bodyId.isin(record["body_ids"])],
-                    fw_meta[fw_meta.root_id.isin(record["root_ids"])],
-                    THUMBNAILS_DIR / f"{record['file_name']}.png",
-                )
+                with profiling.stage("thumbnail", synonym=record["name"]):
+                    generate_thumbnail(
+                        mcns_meta[mcns_meta.bodyId.isin(record["body_ids"])],
+                        fw_meta[fw_meta.root_id.isin(record["root_ids"])],
+                        THUMBNAILS_DIR / f"{record['file_name']}.png",
+                    )
             except Exception as e:
                 print(
                     f"  Failed to generate thumbnail for synonym {record['file_name']}: {e}",
@@ -1501,6 +1397,7 @@ def make_synonyms_pages(
     print("Done.", flush=True)
 
 
+@profiling.profiled
 def make_hemilineage_pages(mcns_meta, fw_meta):
     """Generate the individual summaries for each (dimorphic) hemilineage.
 
@@ -1516,14 +1413,10 @@ def make_hemilineage_pages(mcns_meta, fw_meta):
     # Load the template for the summary pages
     template = JINJA_ENV.get_template("hemilineage_individual.md")
 
-    # Filter to dimorphic super types (we may remove this in the future)
-    mcns_meta = mcns_meta.copy()
-    mcns_meta = mcns_meta.drop(columns=["roiInfo", "inputRois", "outputRois"]).copy()
-
     # For each type compile a dictionary with relevant data
     hemilineages_meta = []
     for col in ("itoleeHl", "trumanHl"):
-        for t, table in mcns_meta.groupby(col):
+        for t, table in mcns_meta.groupby(col, observed=True):
             hemilineages_meta.append({})
 
             hemilineages_meta[-1]["hemilineage"] = t
@@ -1543,14 +1436,14 @@ def make_hemilineage_pages(mcns_meta, fw_meta):
 
             # Add neuron counts
             counts = table.somaSide.value_counts()
-            if counts.empty:
+            if not counts.any():
                 counts = table.rootSide.value_counts()
 
             hemilineages_meta[-1]["n_mcnsr"] = counts.get("R", 0)
             hemilineages_meta[-1]["n_mcnsl"] = counts.get("L", 0)
 
             # Add type counts
-            type_counts = table.groupby("somaSide").type.nunique()
+            type_counts = table.groupby("somaSide", observed=True).type.nunique()
             hemilineages_meta[-1]["n_types_mcnsr"] = type_counts.get("R", 0)
             hemilineages_meta[-1]["n_types_mcnsl"] = type_counts.get("L", 0)
 
@@ -1570,7 +1463,7 @@ def make_hemilineage_pages(mcns_meta, fw_meta):
                 hemilineages_meta[-1]["n_fwl"] = counts.get("left", 0)
 
                 # Add type counts
-                type_counts = table_fw.groupby("side").type.nunique()
+                type_counts = table_fw.groupby("side", observed=True).type.nunique()
                 hemilineages_meta[-1]["n_types_fwr"] = type_counts.get("right", 0)
                 hemilineages_meta[-1]["n_types_fwl"] = type_counts.get("left", 0)
 
@@ -1594,363 +1487,11 @@ def make_hemilineage_pages(mcns_meta, fw_meta):
         # Write the rendered HTML to a file
         with open(HEMILINEAGE_DIR / f"{record['hemilineage_file']}.md", "w") as f:
             f.write(rendered)
+        profiling.count()
 
     print("Done.", flush=True)
 
 
-def generate_thumbnail(
-    mcns_meta: pd.DataFrame,
-    fw_meta: pd.DataFrame,
-    outfile: Path,
-    skip_existing: bool = True,
-):
-    """Generate a thumbnail image for the given neuron type.
-
-    Parameters
-    ----------
-    mcns_meta : pd.DataFrame
-                Meta data of male CNS neurons to include in the thumbnail.
-    fw_meta :   iterable | None
-                Meta data of FlyWire neurons to include in the thumbnail.
-    outfile :   Path
-                Path to write the file to.
-
-    """
-    # Check if the output file already exists
-    if skip_existing and outfile.exists():
-        print(f"  Thumbnail {outfile.name} already exists, skipping...", flush=True)
-        return
-
-    print(f"  Generating thumbnail {outfile.name}...", flush=True)
-    global MESH_BRAIN, MESH_VNC, FLYWIRE_CLOUDVOL, OC_VIEWER
-    # Load the mesh if it is not already loaded
-    if MESH_BRAIN is None:
-        vol = cv.CloudVolume(
-            "gs://flyem-cns-roi-7c971aa681da83f9a074a1f0e8ef60f4/fullbrain-major-shells/",
-            use_https=True,
-            progress=False,
-        )
-        MESH_BRAIN = navis.Volume(
-            vol.mesh.get([1, 2, 3]), name="BRAIN"
-        )  # CB + optic lobes
-
-    if MESH_VNC is None:
-        vol = cv.CloudVolume(
-            "precomputed://gs://flyem-cns-roi-7c971aa681da83f9a074a1f0e8ef60f4/vnc-neuropil-shell",
-            use_https=True,
-            progress=False,
-        )
-        MESH_VNC = navis.Volume(vol.mesh.get([1]), name="VNC")
-
-    if not OC_VIEWER:
-        OC_VIEWER = oc.Viewer(offscreen=True)
-
-    # Hide progress bars while loading meshes
-    # (there is currently no way to do that with navis.read_precomputed)
-    navis.config.pbar_hide = True
-
-    # Get FlyWire meshes
-    fw_meshes = navis.NeuronList([])
-    if not fw_meta.empty:
-        # Read precomputed meshes from FlyWire
-        # Note: we could use navis.read_precomputed directly but that's slower
-        # (presumably because it uses processes rather than threads)
-        base_url = FLYWIRE_SOURCE.replace("precomputed://", "")
-        futures = {
-            FUTURE_SESSION.get(f"{base_url}/{id}"): id for id in fw_meta["root_id"]
-        }
-
-        for future in as_completed(futures):
-            id = futures[future]
-            r = future.result()
-            r.raise_for_status()
-            fw_meshes.append(
-                navis.read_precomputed(r.content, datatype="mesh", info=False, id=id)
-            )
-
-    # Get MCNS meshes
-    mcns_meshes = navis.NeuronList([])
-    if not mcns_meta.empty:
-        # Read precomputed meshes from DVID
-        base_url = f"{DVID_SERVER}/api/node/{DVID_NODE}/segmentation_meshes/key"
-        futures = {
-            FUTURE_SESSION.get(f"{base_url}/{id}.ngmesh"): id
-            for id in mcns_meta["bodyId"]
-        }
-
-        for future in as_completed(futures):
-            id = futures[future]
-            r = future.result()
-            r.raise_for_status()
-            mcns_meshes.append(
-                navis.read_precomputed(r.content, datatype="mesh", info=False, id=id)
-            )
-
-    # Show progress bars again
-    navis.config.pbar_hide = False
-
-    # Add neurons to viewer
-    if len(fw_meshes):
-        OC_VIEWER.add_neurons(fw_meshes, color="#e511d0")
-    if len(mcns_meshes):
-        OC_VIEWER.add_neurons(mcns_meshes, color="#00e9e7")
-
-    # What kind of neurons do we have?
-    if not mcns_meta.empty:
-        table = mcns_meta
-    else:
-        table = fw_meta
-    sc_col = "superclass" if "superclass" in table.columns else "super_class"
-    has_ascending = (
-        ("ascending_neuron" in table[sc_col].values)
-        or ("ascending" in table[sc_col].values)
-        or ("sensory_ascending" in table[sc_col].values)
-    )
-    has_descending = (
-        ("descending_neuron" in table[sc_col].values)
-        or ("descending" in table[sc_col].values)
-        or ("sensory_descending" in table[sc_col].values)
-    )
-    has_central = ("cb_intrinsic" in table[sc_col].values) or (
-        "central" in table[sc_col].values
-    )
-    has_vnc = "vnc_intrinsic" in table[sc_col].values
-
-    # Pick a scene based on the neuron type
-    if has_ascending or has_descending or (has_central and has_vnc):
-        # Brain and VNC neurons
-        OC_VIEWER.add_mesh(MESH_BRAIN, color=(0.8, 0.8, 0.8), alpha=0.1)
-        OC_VIEWER.add_mesh(MESH_VNC, color=(0.8, 0.8, 0.8), alpha=0.1)
-        OC_VIEWER.set_view(
-            {
-                "position": np.array(
-                    [-380324.37368731, 274816.33737857, 570152.25830276]
-                ),
-                "rotation": np.array([-0.7110673, -0.03489443, 0.70219136, 0.00964166]),
-                "scale": np.array([1.0, 1.0, 1.0]),
-                "reference_up": np.array([0.0, -1.0, 0.0]),
-                "fov": 0.0,
-                "width": 766557.316514536,
-                "height": 766557.316514536,
-                "zoom": 1.0,
-                "maintain_aspect": True,
-                "depth_range": None,
-            }
-        )
-    elif has_vnc:
-        # Just VNC neurons
-        OC_VIEWER.add_mesh(MESH_VNC, color=(0.8, 0.8, 0.8), alpha=0.1)
-        OC_VIEWER.set_view(
-            {
-                "position": np.array(
-                    [389551.99130054, -255612.95457865, 608158.34951343]
-                ),
-                "rotation": np.array([0.54627717, 0.54208679, -0.45810277, 0.4448202]),
-                "scale": np.array([1.0, 1.0, 1.0]),
-                "reference_up": np.array([0.0, 0.0, 1.0]),
-                "fov": 0.0,
-                "width": 525756.094337834,
-                "height": 525756.094337834,
-                "zoom": 1.0,
-                "maintain_aspect": True,
-                "depth_range": None,
-            }
-        )
-    else:
-        # Just brain neurons
-        OC_VIEWER.add_mesh(MESH_BRAIN, color=(0.8, 0.8, 0.8), alpha=0.1)
-        OC_VIEWER.set_view(
-            {
-                "position": np.array([387225.3840714, 229749.96777565, 95873.17475057]),
-                "rotation": np.array([1.0, 0.0, 0.0, 0.0]),
-                "scale": np.array([1.0, 1.0, 1.0]),
-                "reference_up": np.array([0.0, -1.0, 0.0]),
-                "fov": 0.0,
-                "width": 480452.4541556888,
-                "height": 480452.4541556888,
-                "zoom": 1.0,
-                "maintain_aspect": True,
-                "depth_range": None,
-            }
-        )
-
-    OC_VIEWER.screenshot(str(outfile.resolve()), size=(600, 400))
-    OC_VIEWER.clear()
-
-
-def generate_graphs(
-    type_name: str,
-    type_meta_mcns: pd.DataFrame,
-    type_meta_fw: pd.DataFrame,
-    mcns_meta_full: pd.DataFrame,
-    fw_meta_full: pd.DataFrame,
-    fw_edges: pd.DataFrame,
-    N: int = 5,
-) -> None:
-    """Generate D3 graphs for the given neurons.
-
-    Parameters
-    ----------
-    type_name : str
-                The type of neuron to generate the graph for.
-                This is primarily used for the filename as
-                the graphs are generated from the meta data
-                (see below).
-    type_meta_mcns : pd.DataFrame
-                The meta data for the MCNS neurons to generate graphs for.
-    type_meta_fw : pd.DataFrame
-                The meta data for the FlyWire neurons to generate graphs for.
-    mcns_meta_full : pd.DataFrame
-                The full meta data for MaleCNS. We need this to assign types
-                to synaptic partners.
-    fw_meta_full : pd.DataFrame
-                The full meta data for FlyWire. We need this to assign types
-                to synaptic partners.
-    fw_edges :  pd.DataFrame
-                The edges for the FlyWire neurons. See
-                loading.py for the function that loads this data.
-    N :         int
-                The number of top N in- and out-edges to keep.
-
-    Returns
-    -------
-    None
-                But will write the graphs to `GRAPH_DIR / f"{type_name}{_mcns/_fw}.html"`.
-
-    """
-    print(f"  Generating graphs for {type_name}...", flush=True)
-
-    mcns_mapping = mcns_meta_full.set_index("bodyId").mapping.to_dict()
-    fw_mapping = fw_meta_full.set_index("root_id").mapping.to_dict()
-
-    # We may need to drop duplicates here
-    fw_meta_full = fw_meta_full.drop_duplicates("root_id")
-
-    # Make our lives a bit easier and align column names
-    fw_edges = fw_edges.rename(columns={"syn_count": "weight"})
-
-    # First up: graph for the MCNS neurons
-    if not type_meta_mcns.empty:
-        # Fetch downstream partners (ignore userwarnings)
-        with warnings.catch_warnings(action="ignore"):
-            ann, down = neu.fetch_adjacencies(
-                sources=neu.NeuronCriteria(bodyId=type_meta_mcns["bodyId"].values),
-            )
-
-        # Add type information
-        down["pre_type"] = down.bodyId_pre.map(mcns_mapping)
-        down["post_type"] = down.bodyId_post.map(mcns_mapping)
-
-        # Group by pre- and post-synaptic types
-        down = (
-            down.groupby(["pre_type", "post_type"], as_index=False)
-            .weight.sum()
-            .sort_values("weight", ascending=False)
-        )
-        # Remove self-loops
-        down = down[down.pre_type != down.post_type]
-        # Remove unknown types
-        down = down[down.pre_type.notnull() & down.post_type.notnull()]
-
-        # Same for upstream partners
-        with warnings.catch_warnings(action="ignore"):
-            ann, up = neu.fetch_adjacencies(
-                targets=neu.NeuronCriteria(bodyId=type_meta_mcns["bodyId"].values),
-            )
-        up["pre_type"] = up.bodyId_pre.map(mcns_mapping)
-        up["post_type"] = up.bodyId_post.map(mcns_mapping)
-        up = (
-            up.groupby(["pre_type", "post_type"], as_index=False)
-            .weight.sum()
-            .sort_values("weight", ascending=False)
-        )
-        up = up[up.pre_type != up.post_type]
-        up = up[up.pre_type.notnull() & up.post_type.notnull()]
-
-        # Combine but keep only the top N in- and out-edges
-        df = (
-            pd.concat([down.iloc[:N], up.iloc[:N]], axis=0)
-            .drop_duplicates()
-            .reset_index(drop=True)
-        )
-
-        # Generate the D3 graph
-        edges2d3(df, GRAPH_DIR / f"{type_name}_mcns.html", color="#00ffff")
-
-    # Now do the same for FlyWire
-    if not type_meta_fw.empty:
-        # Subset the edges to the ones that are in the meta data
-        down = fw_edges[
-            fw_edges.pre_pt_root_id.isin(type_meta_fw["root_id"].values)
-        ].copy()
-        up = fw_edges[
-            fw_edges.post_pt_root_id.isin(type_meta_fw["root_id"].values)
-        ].copy()
-
-        # Add type information
-        down["pre_type"] = down.pre_pt_root_id.map(fw_mapping)
-        down["post_type"] = down.post_pt_root_id.map(fw_mapping)
-        up["pre_type"] = up.pre_pt_root_id.map(fw_mapping)
-        up["post_type"] = up.post_pt_root_id.map(fw_mapping)
-
-        # Group by pre- and post-synaptic types
-        down = (
-            down.groupby(["pre_type", "post_type"], as_index=False)
-            .weight.sum()
-            .sort_values("weight", ascending=False)
-        )
-        up = (
-            up.groupby(["pre_type", "post_type"], as_index=False)
-            .weight.sum()
-            .sort_values("weight", ascending=False)
-        )
-        # Remove self-loops
-        up = up[(up.pre_type != up.post_type)]
-        down = down[(down.pre_type != down.post_type)]
-        # Remove unknown types
-        up = up[up.pre_type.notnull() & up.post_type.notnull()]
-        down = down[down.pre_type.notnull() & down.post_type.notnull()]
-
-        # Combine but keep only the top N in- and out-edges
-        df = (
-            pd.concat([down.iloc[:N], up.iloc[:N]], axis=0)
-            .drop_duplicates()
-            .reset_index(drop=True)
-        )
-
-        # Generate the D3 graph
-        edges2d3(df, GRAPH_DIR / f"{type_name}_fw.html", color="#ff00ff")
-
-
-def edges2d3(edges, filepath, color=None):
-    # Convert to adjacency matrix
-    adjmat = vec2adjmat(edges.pre_type, edges.post_type, weight=edges.weight)
-
-    # Initialise the graph
-    d3 = d3graph()
-
-    # Process adjacency matrix
-    d3.graph(adjmat, color=None)
-
-    d3.set_edge_properties(directed=True, label="weight")
-    d3.set_node_properties(color=color, fontcolor="#000000")
-
-    # For some reason the library is not passing through the save_button parameter
-    # and we have to render the graph manually again
-    d3.show(
-        figsize=(400, 400),
-        title="Graph",
-        filepath=filepath,
-        showfig=False,
-        overwrite=True,
-        show_slider=False,
-        set_slider=0,
-        save_button=False,
-    )
-
-    return filepath
-
-
 def clear_build_directory():
     """Clear the build directory. This will only remove files but not the directories themselves."""
     for dir in (
@@ -1980,8 +1521,9 @@ def prep_scene(table):
 
     Returns
     -------
-    scene : nglscenes.Scene
-            The scene to use for the neuroglancer view.
+    scene : SceneLink
+            The scene to use for the neuroglancer view. Set e.g. its
+            `layers[1]["segments"]` and get the link via `scene.url`.
 
     """
     sc_col = "superclass" if "superclass" in table.columns else "super_class"
@@ -1998,13 +1540,13 @@ def prep_scene(table):
 
     # Pick a scene based on the neuron type
     if has_ascending or has_descending:
-        scene = NGL_BASE_SCENE_TOP.copy()
+        scene = SceneLink("NGL_BASE_SCENE_TOP")
     elif has_central and has_vnc:
-        scene = NGL_BASE_SCENE_TOP.copy()
+        scene = SceneLink("NGL_BASE_SCENE_TOP")
     elif has_central:
-        scene = NGL_BASE_SCENE.copy()
+        scene = SceneLink("NGL_BASE_SCENE")
     else:
-        scene = NGL_BASE_SCENE_VNC.copy()
+        scene = SceneLink("NGL_BASE_SCENE_VNC")
 
     # Hide the VNC neuropil mesh if we don't have any neurons in the VNC
     if not has_descending and not has_ascending and not has_vnc:
@@ -2018,17 +1560,4 @@ def prep_scene(table):
 
 def _get_ids_from_record(record):
     """Get the body and root IDs from a record."""
-    body_ids = np.array([], dtype=int)
-    if record.get("bodyId", None):
-        if isinstance(record["bodyId"], str):
-            body_ids = np.array(record["bodyId"].split(";")).astype(int)
-        else:
-            body_ids = np.array([record["bodyId"]], dtype=int)
-    root_ids = np.array([], dtype=int)
-    if record.get("root_id", None):
-        if isinstance(record["root_id"], str):
-            root_ids = np.array(record["root_id"].split(";")).astype(int)
-        else:
-            root_ids = np.array([record["root_id"]], dtype=int)
-
-    return body_ids, root_ids
+    return record.get("body_ids", _NO_IDS), record.get("root_ids", _NO_IDS)
@@ -0,0 +1,324 @@
+"""
+A manifest for the local data cache with conditional HTTP revalidation.
+
+For each cached artifact, the manifest (`.cache/manifest.json`) records where
+it came from, its ETag and Last-Modified headers, its size, a content hash,
+when it was last fetched/validated and for how long it is considered fresh
+(TTL). Once the TTL has expired, remote artifacts are revalidated using a
+conditional GET so that only artifacts that actually changed are re-fetched.
+"""
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+import requests
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from pathlib import Path
+
+from . import env, network
+from .env import CACHE_MANIFEST
+
+
+class CacheManifest:
+    """Freshness information for cached artifacts.
+
+    The manifest is (re-)written to disk after every update. Updates are
+    guarded by a lock, so artifacts can be fetched from multiple threads.
+
+    Parameters
+    ----------
+    filepath :  Path
+                Path to the JSON file to store the manifest in.
+
+    """
+
+    def __init__(self, filepath):
+        self.filepath = Path(filepath)
+        self._lock = threading.Lock()
+        try:
+            with open(self.filepath, "r") as f:
+                self.entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.entries = {}
+
+    def __repr__(self):
+        return f"<CacheManifest(filepath={self.filepath}, entries={len(self.entries)})>"
+
+    def __getitem__(self, name):
+        return self.entries[name]
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def get(self, name, default=None):
+        return self.entries.get(name, default)
+
+    def is_valid(self, name, filepath):
+        """Check that the cached file exists and matches the manifest."""
+        entry = self.entries.get(name)
+        if entry is None or entry.get("path") != Path(filepath).name:
+            return False
+        try:
+            return Path(filepath).stat().st_size == entry["size"]
+        except FileNotFoundError:
+            return False
+
+    def is_fresh(self, name, filepath):
+        """Check that the cached file is valid and within its TTL."""
+        if not self.is_valid(name, filepath):
+            return False
+        entry = self.entries[name]
+        if entry.get("ttl") is None:
+            return True
+        return (time.time() - entry["checked_at"]) < entry["ttl"]
+
+    def update(self, name, **kwargs):
+        """Update (or create) an entry and save the manifest."""
+        with self._lock:
+            self.entries.setdefault(name, {}).update(kwargs)
+            self._save()
+
+    def record(self, name, filepath, ttl=None, sha256=None, **kwargs):
+        """Record a freshly written file in the manifest.
+
+        Parameters
+        ----------
+        name :      str
+                    Name of the artifact.
+        filepath :  Path
+                    The file that was written.
+        ttl :       int, optional
+                    Time in seconds for which the file is considered fresh.
+                    If None, it never expires.
+        sha256 :    str, optional
+                    Content hash of the file, if already known. Otherwise it
+                    is computed from the file.
+        **kwargs
+                    Additional fields to store (e.g. `url`, `etag`).
+
+        """
+        filepath = Path(filepath)
+        now = time.time()
+        self.update(
+            name,
+            path=filepath.name,
+            size=filepath.stat().st_size,
+            sha256=sha256 or _hash_file(filepath),
+            ttl=ttl,
+            fetched_at=now,
+            checked_at=now,
+            **kwargs,
+        )
+
+    def data_version(self):
+        """A short hash of the content hashes of all cached artifacts.
+
+        This changes whenever any of the data (meta data, mapping, edges,
+        ROI info) changes, so that benchmarks can be compared on the same
+        data.
+
+        """
+        hashes = sorted(
+            (name, entry["sha256"])
+            for name, entry in self.entries.items()
+            if entry.get("sha256")
+        )
+        return hashlib.sha256(json.dumps(hashes).encode()).hexdigest()[:12]
+
+    def _save(self):
+        self.filepath.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.filepath.parent, suffix=".json", delete=False
+        ) as f:
+            json.dump(self.entries, f, indent=2, sort_keys=True)
+        os.replace(f.name, self.filepath)
+
+
+# A global cache manifest
+MANIFEST = CacheManifest(CACHE_MANIFEST)
+
+
+def fetch_cached(
+    name, url, filepath, ttl=None, force_update=False, max_retries=5, chunk_size=2**20
+):
+    """Download a file into the cache unless the cached copy is still fresh.
+
+    If the cached copy has expired (or `force_update` is True), it is
+    revalidated with a conditional GET (If-None-Match/If-Modified-Since)
+    and only re-downloaded if it changed on the server.
+
+    Downloads are streamed in chunks into a `{filepath}.part` file (so the
+    file is never held in memory) which is moved into place once complete.
+    If the connection drops, the download is resumed with a HTTP range
+    request. If the server can't be reached at all, a cached copy (even if
+    expired) is used instead. An incomplete `.part` file left behind by a previous run is
+    resumed too, as long as the file has not changed on the server.
+
+    Parameters
+    ----------
+    name :      str
+                Name of the artifact in the manifest.
+    url :       str
+                URL to download from.
+    filepath :  Path
+                Path to store the file at.
+    ttl :       int, optional
+                Time in seconds for which the cached file is considered fresh
+                without revalidating. If None, it never expires (but is still
+                revalidated if `force_update` is True).
+    force_update : bool
+                If True, will revalidate the cached file regardless of its TTL.
+    max_retries : int
+                How often to retry (resume) the download after a network error.
+    chunk_size : int
+                Size of the chunks (in bytes) written to disk.
+
+    Returns
+    -------
+    changed :   bool
+                Whether the file was (re-)downloaded with new content.
+
+    """
+    filepath = Path(filepath)
+    if not force_update and MANIFEST.is_fresh(name, filepath):
+        return False
+
+    # Ask the server to only send the file if it changed
+    headers = {}
+    entry = MANIFEST.get(name, {})
+    if MANIFEST.is_valid(name, filepath) and entry.get("url") == url:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    # The validator (ETag or Last-Modified) of a partial download; this is
+    # used with If-Range so that the server sends the full file if it changed
+    partial = filepath.with_name(filepath.name + ".part")
+    resume_from = (entry.get("partial") or {}).get(url)
+
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    validators = None
+    for attempt in range(max_retries + 1):
+        request_headers = dict(headers)
+        offset = partial.stat().st_size if resume_from and partial.exists() else 0
+        if offset:
+            request_headers["Range"] = f"bytes={offset}-"
+            request_headers["If-Range"] = resume_from
+
+        try:
+            # (the manifest always records the canonical URL)
+            with network.session() as session, session.get(
+                env.BACKEND.resolve_url(url),
+                headers=request_headers,
+                stream=True,
+                timeout=(10, 60),
+            ) as r:
+                if r.status_code == 304:
+                    MANIFEST.update(name, checked_at=time.time(), ttl=ttl)
+                    return False
+                r.raise_for_status()
+
+                validators = dict(
+                    url=url,
+                    etag=r.headers.get("ETag"),
+                    last_modified=r.headers.get("Last-Modified"),
+                )
+
+                # Only append if the server actually continues where we left off
+                if r.status_code != 206 or not r.headers.get(
+                    "Content-Range", ""
+                ).startswith(f"bytes {offset}-"):
+                    offset = 0
+
+                # Remember how to resume this download (if the server allows it)
+                resume_from = validators["etag"] or validators["last_modified"]
+                MANIFEST.update(name, partial={url: resume_from})
+
+                with open(partial, "ab" if offset else "wb") as f:
+                    for chunk in r.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+            break
+        except (
+            requests.ConnectionError,
+            requests.Timeout,
+            requests.exceptions.ChunkedEncodingError,
+        ) as e:
+            # If the server can't be reached at all, use the cached copy
+            if validators is None and MANIFEST.is_valid(name, filepath):
+                print(
+                    f"Could not reach {url} ({e.__class__.__name__}); "
+                    f"using cached {name}.",
+                    flush=True,
+                )
+                return False
+            if attempt == max_retries:
+                raise
+            network.retry(url)
+            print(
+                f"Download of {name} interrupted ({e.__class__.__name__}); "
+                f"resuming at {partial.stat().st_size if partial.exists() else 0:,} bytes...",
+                flush=True,
+            )
+            time.sleep(min(2**attempt, 30))
+
+    # Servers without validators will always send the full file: in that
+    # case we keep the existing file (and its mtime) if the content is the same
+    sha256 = _hash_file(partial)
+    if MANIFEST.is_valid(name, filepath) and entry.get("sha256") == sha256:
+        partial.unlink()
+        MANIFEST.update(
+            name, checked_at=time.time(), ttl=ttl, partial=None, **validators
+        )
+        return False
+
+    # Move the complete file into place
+    os.replace(partial, filepath)
+
+    MANIFEST.record(name, filepath, ttl=ttl, sha256=sha256, partial=None, **validators)
+    return True
+
+
+def read_feather(filepath, columns=None, exclude=None):
+    """Read a (cached) feather file via a memory map.
+
+    Unlike `pd.read_feather`, this maps the file instead of reading it into a
+    buffer first, so uncompressed columns are not copied before conversion.
+
+    Parameters
+    ----------
+    filepath :  Path
+                The feather file to read.
+    columns :   list of str, optional
+                If provided, only read these columns.
+    exclude :   list of str, optional
+                If provided, skip these columns (if present) without reading
+                them.
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+    if exclude is not None:
+        if columns is None:
+            with pa.memory_map(str(filepath)) as source:
+                columns = pa.ipc.open_file(source).schema.names
+        columns = [c for c in columns if c not in exclude]
+    table = feather.read_table(filepath, columns=columns, memory_map=True)
+    return table.to_pandas()
+
+
+def _hash_file(filepath, chunk_size=2**20):
+    """SHA256 hash of a file's content."""
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        while chunk := f.read(chunk_size):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,158 @@
+"""
+Type-level connectivity, aggregated once from neuron-level edge lists.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class TypeConnectivity:
+    """Sparse type-to-type connectivity matrix.
+
+    Edges are stored twice in compressed form: once ordered by presynaptic
+    type (rows) and once by postsynaptic type (columns). Within each row and
+    column, edges are sorted by descending weight so that the top N up- or
+    downstream partners of a type are a simple O(degree) slice.
+
+    Parameters
+    ----------
+    edges :     pd.DataFrame
+                Type-level edge list with `pre_type`, `post_type` and `weight`
+                columns. Each (pre_type, post_type) pair must be unique.
+
+    """
+
+    def __init__(self, edges: pd.DataFrame):
+        self.edges = edges[["pre_type", "post_type", "weight"]].reset_index(drop=True)
+
+        self.types = pd.Index(
+            np.unique(
+                np.append(self.edges.pre_type.values, self.edges.post_type.values)
+            )
+        )
+        self._pre = self.types.get_indexer(self.edges.pre_type.values)
+        self._post = self.types.get_indexer(self.edges.post_type.values)
+        weights = self.edges.weight.values
+
+        # Sort by type and then descending weight (ties are broken by partner)
+        self._by_pre = np.lexsort((self._post, -weights, self._pre))
+        self._by_post = np.lexsort((self._pre, -weights, self._post))
+        self._pre_ptr = np.searchsorted(
+            self._pre[self._by_pre], np.arange(len(self.types) + 1)
+        )
+        self._post_ptr = np.searchsorted(
+            self._post[self._by_post], np.arange(len(self.types) + 1)
+        )
+
+    def __len__(self):
+        return len(self.edges)
+
+    def __repr__(self):
+        return f"<TypeConnectivity(types={len(self.types):,}, edges={len(self):,})>"
+
+    @classmethod
+    def from_neuron_edges(
+        cls, edges: pd.DataFrame, mapping: pd.Series, pre: str, post: str, weight: str
+    ):
+        """Aggregate a neuron-level edge list into type-level connectivity.
+
+        Parameters
+        ----------
+        edges :     pd.DataFrame
+                    Neuron-level edge list.
+        mapping :   pd.Series
+                    Maps neuron IDs (index) to types (values). Neurons that are
+                    not in the mapping (or map to null) are dropped.
+        pre, post, weight : str
+                    The columns in `edges` containing the pre- and postsynaptic
+                    IDs and the weight, respectively.
+
+        """
+        mapping = mapping[~mapping.index.duplicated(keep="last")].dropna()
+        codes, types = pd.factorize(mapping.values)
+
+        # Map neuron IDs to type codes (-1 = no type)
+        ids = pd.Index(mapping.index)
+        pre_type = ids.get_indexer(edges[pre].values)
+        post_type = ids.get_indexer(edges[post].values)
+        keep = (pre_type >= 0) & (post_type >= 0)
+
+        agg = (
+            pd.DataFrame(
+                {
+                    "pre_type": codes[pre_type[keep]],
+                    "post_type": codes[post_type[keep]],
+                    "weight": edges[weight].values[keep],
+                }
+            )
+            .groupby(["pre_type", "post_type"], as_index=False, sort=False)
+            .weight.sum()
+        )
+        agg["pre_type"] = types[agg.pre_type.values]
+        agg["post_type"] = types[agg.post_type.values]
+
+        return cls(agg)
+
+    @classmethod
+    def from_feather(cls, filepath):
+        """Load type-level connectivity from a feather file."""
+        return cls(pd.read_feather(filepath))
+
+    def to_feather(self, filepath):
+        """Save type-level edge list to a feather file."""
+        self.edges.to_feather(filepath)
+
+    def downstream(self, type_name: str, N: int = None) -> pd.DataFrame:
+        """Get the (top N) downstream partners of a given type.
+
+        Self-loops are excluded.
+
+        Parameters
+        ----------
+        type_name : str
+                    The type to get partners for.
+        N :         int, optional
+                    If provided, will only return the N strongest partners.
+
+        Returns
+        -------
+        pd.DataFrame
+                    Edge list with `pre_type`, `post_type` and `weight` columns,
+                    sorted by descending weight.
+
+        """
+        return self._partners(type_name, self._by_pre, self._pre_ptr, self._post, N)
+
+    def upstream(self, type_name: str, N: int = None) -> pd.DataFrame:
+        """Get the (top N) upstream partners of a given type.
+
+        Self-loops are excluded.
+
+        Parameters
+        ----------
+        type_name : str
+                    The type to get partners for.
+        N :         int, optional
+                    If provided, will only return the N strongest partners.
+
+        Returns
+        -------
+        pd.DataFrame
+                    Edge list with `pre_type`, `post_type` and `weight` columns,
+                    sorted by descending weight.
+
+        """
+        return self._partners(type_name, self._by_post, self._post_ptr, self._pre, N)
+
+    def _partners(self, type_name, order, ptr, partner, N):
+        """Slice the edges of a given type from one of the compressed indices."""
+        ix = self.types.get_indexer([type_name])[0]
+        if ix < 0:
+            return self.edges.iloc[:0]
+
+        edges = order[ptr[ix] : ptr[ix + 1]]
+        edges = edges[partner[edges] != ix]  # drop self-loops
+        if N is not None:
+            edges = edges[:N]
+
+        return self.edges.iloc[edges].reset_index(drop=True)
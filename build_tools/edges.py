@@ -0,0 +1,92 @@
+"""
+A compact, memory-mapped store for neuron-level edge lists.
+
+The store is an uncompressed Arrow IPC (feather v2) file written as a single
+record batch that contains only the pre- and postsynaptic IDs and a compact
+weight column. Because it is uncompressed, columns can be memory-mapped and
+handed to numpy without copying, so only the pages that are actually touched
+end up in resident memory.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.feather as feather
+
+from pathlib import Path
+
+
+def write_edge_store(source, filepath, pre, post, weight):
+    """Convert a (compressed) feather edge list into an edge store.
+
+    Parameters
+    ----------
+    source :    Path
+                The feather file with the full edge list.
+    filepath :  Path
+                Where to write the edge store.
+    pre, post, weight : str
+                The columns in `source` containing the pre- and postsynaptic
+                IDs and the weight, respectively. All other columns are dropped.
+
+    """
+    filepath = Path(filepath)
+    table = feather.read_table(source, columns=[pre, post, weight], memory_map=True)
+
+    # Use the smallest signed integer type that fits the weights
+    max_weight = pc.max(table[weight]).as_py() or 0
+    weight_type = pa.int16() if max_weight < 2**15 else pa.int32()
+    table = table.set_column(2, weight, table[weight].cast(weight_type))
+
+    # A single record batch lets readers map each column as one contiguous array
+    table = table.combine_chunks()
+
+    # Write to a temporary file first and then move into place
+    tmp = filepath.with_name(filepath.name + ".tmp")
+    feather.write_feather(
+        table, tmp, compression="uncompressed", chunksize=max(len(table), 1)
+    )
+    os.replace(tmp, filepath)
+
+
+def read_edge_store(filepath, columns=None, ids=None):
+    """Read edges from a memory-mapped edge store.
+
+    Parameters
+    ----------
+    filepath :  Path
+                The edge store (see `write_edge_store`).
+    columns :   list of str, optional
+                The pre, post and weight columns (in that order). Defaults to
+                all three columns in the store.
+    ids :       iterable, optional
+                If provided, only edges where both the pre- and postsynaptic
+                neuron are among these IDs are returned.
+
+    Returns
+    -------
+    pd.DataFrame
+                Without `ids`, the columns are views into the memory map.
+
+    """
+    table = feather.read_table(filepath, columns=columns, memory_map=True)
+    data = {col: _to_numpy(table[col]) for col in table.column_names}
+
+    if ids is not None:
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        pre, post = table.column_names[:2]
+        keep = np.isin(data[pre], ids) & np.isin(data[post], ids)
+        data = {col: values[keep] for col, values in data.items()}
+
+    return pd.DataFrame(data, copy=False)
+
+
+def _to_numpy(column):
+    """Convert a column to numpy without copying (if possible)."""
+    if column.num_chunks == 1:
+        # For a single chunk without nulls this is a view of the memory map
+        return column.chunk(0).to_numpy(zero_copy_only=False)
+    return column.to_numpy()
@@ -2,47 +2,28 @@
 Some global variables and constants for the build tools.
 """
 
-import nglscenes as ngl
-import navis.interfaces.neuprint as neu
+import os
+import json
+import tempfile
+import threading
 
 from pathlib import Path
-from requests_futures.sessions import FuturesSession
 from jinja2 import Environment, FileSystemLoader, select_autoescape
 
-# FutureSession for async requests
-FUTURE_SESSION = FuturesSession(max_workers=10)
+# N.B. the Neuroglancer scenes, the neuPrint client and the FutureSession are
+# expensive to set up (they require network access). They are created lazily
+# on first access (see `__getattr__` at the bottom of this module). Modules
+# using them should therefore `from . import env` and access e.g.
+# `env.NEUPRINT_CLIENT` instead of importing the names directly.
+# Set the `MCNS_FIXTURES` environment variable to a fixture directory to build
+# without network access (see `backends.py`).
 
 #####
 # A basic Neuroglancer scene to use as a base for the visualisation
 #####
 NGL_BASE_URL = "https://clio-ng.janelia.org/#!gs://flyem-user-links/short/2025-04-14.184028.199909.json"
-NGL_BASE_SCENE = ngl.Scene.from_url(NGL_BASE_URL)
 NGL_BASE_URL_VNC = "https://clio-ng.janelia.org/#!gs://flyem-user-links/short/2025-04-28.110026.374589.json"
-NGL_BASE_SCENE_VNC = ngl.Scene.from_url(NGL_BASE_URL_VNC)
 NGL_BASE_URL_TOP = "https://clio-ng.janelia.org/#!gs://flyem-user-links/short/2025-04-28.112442.425526.json"
-NGL_BASE_SCENE_TOP = ngl.Scene.from_url(NGL_BASE_URL_TOP)
-
-# Make sure the segmentation layers are empty
-for scene in (NGL_BASE_SCENE, NGL_BASE_SCENE_VNC, NGL_BASE_SCENE_TOP):
-    for i in range(2):
-        scene.layers[i]['segments'] = []
-
-# Make backgrounds white
-# for scene in (NGL_BASE_SCENE, NGL_BASE_SCENE_VNC, NGL_BASE_SCENE_TOP):
-#     scene["projectionBackgroundColor"] = "#ffffff"
-
-#####
-# URLs for the MCNS and FlyWire meta data
-#####
-FLYWIRE_SOURCE = NGL_BASE_SCENE.layers["female (FlyWire)"][
-    "source"
-]  # precomputed layer
-MCNS_SOURCE = NGL_BASE_SCENE.layers["maleCNS"]["source"]["url"]  # DVID layer
-DVID_SERVER = "https://" + MCNS_SOURCE.replace("dvid://https://", "").split("/")[0]
-DVID_NODE = MCNS_SOURCE.replace("dvid://https://", "").split("/")[1]
-
-print(f"Using DVID server: {DVID_SERVER}")
-print(f"Using DVID node: {DVID_NODE}")
 
 #####
 # Mappings between MCNS -> FlyWire/MANC
@@ -61,6 +42,9 @@ MCNS_MANC_MAPPING_URL = (
 #####
 FW_EDGES_URL = "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/proofread_connections_783_grouped.feather"
 
+# Pre-compiled per-neuron ROI info for FlyWire
+FW_ROI_INFO_URL = "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/fw_roi_info.feather"
+
 #####
 # Various directories for the build / cache
 #####
@@ -71,8 +55,8 @@ REPO_BASE_PATH = Path(__file__).parent.parent
 # Directory for the JINJA templates
 TEMPLATE_DIR = REPO_BASE_PATH / "templates"
 
-# Directory for the generated HTML files
-BUILD_DIR = REPO_BASE_PATH / "docs/build"
+# Directory for the generated HTML files (can be overridden e.g. for benchmarks)
+BUILD_DIR = Path(os.environ.get("MCNS_BUILD_DIR") or REPO_BASE_PATH / "docs/build")
 SUMMARY_TYPES_DIR = BUILD_DIR / "summary_types"
 THUMBNAILS_DIR = BUILD_DIR / "thumbnails"
 GRAPH_DIR = BUILD_DIR / "graphs"
@@ -80,14 +64,44 @@ SUPERTYPE_DIR = BUILD_DIR / "supertypes"
 HEMILINEAGE_DIR = BUILD_DIR / "hemilineages"
 SYNONYMS_DIR = BUILD_DIR / "synonyms"
 
+# Fixture directory to use instead of the remote services (see `backends.py`)
+FIXTURE_DIR = os.environ.get("MCNS_FIXTURES") or None
+if FIXTURE_DIR is not None:
+    FIXTURE_DIR = Path(FIXTURE_DIR)
+
 # Directory for the some cached data (use the --update-metadata flag to trigger a refresh)
+# N.B. builds from fixtures get their own cache so they never mix with live data
 CACHE_DIR = REPO_BASE_PATH / ".cache"
+if FIXTURE_DIR is not None:
+    CACHE_DIR = CACHE_DIR / "fixtures"
 MCNS_META_DATA_CACHE = CACHE_DIR / "mcns_meta_data.feather"
 MCNS_ROI_INFO_CACHE = CACHE_DIR / "mcns_roi_info.feather"
+MCNS_ROI_COLUMNS_CACHE = CACHE_DIR / "mcns_roi_columns.feather"
+MCNS_EDGES_CACHE = CACHE_DIR / "mcns_edges.feather"
 FW_META_DATA_CACHE = CACHE_DIR / "fw_meta_data.feather"
 FW_ROI_INFO_CACHE = CACHE_DIR / "fw_roi_info.feather"
+FW_EDGES_STORE = CACHE_DIR / "fw_edges.arrow"  # memory-mapped subset of the edges
 MAPPING_CACHE = CACHE_DIR / "mapping.json"
 
+# Resolved Neuroglancer base scenes and neuPrint meta data (e.g. the ROI
+# hierarchy) so that cached builds work without network access
+NGL_SCENES_CACHE = CACHE_DIR / "ngl_base_scenes.json"
+NEUPRINT_META_CACHE = CACHE_DIR / "neuprint_meta.json"
+if FIXTURE_DIR is not None:
+    NGL_SCENES_CACHE = FIXTURE_DIR / "neuroglancer" / "scenes.json"
+    NEUPRINT_META_CACHE = FIXTURE_DIR / "neuprint" / "meta.json"
+
+# Manifest with freshness information for the cached files and the time (in
+# seconds) after which remote files are revalidated against the server
+CACHE_MANIFEST = CACHE_DIR / "manifest.json"
+MAPPING_TTL = 30 * 60  # the mapping is re-generated every 30 minutes
+FW_EDGES_TTL = 7 * 24 * 60 * 60  # the edges almost never change
+FW_ROI_INFO_TTL = 7 * 24 * 60 * 60
+
+# Directory for cached neuron meshes (used for thumbnails) and its maximum size
+MESH_CACHE_DIR = CACHE_DIR / "meshes"
+MESH_CACHE_MAX_SIZE = 10 * 1024**3  # 10 GB
+
 # Make sure the directories exist
 for dir in (
     CACHE_DIR,
@@ -110,9 +124,10 @@ JINJA_ENV = Environment(
 )
 
 #####
-# A global neuprint client
+# neuPrint server (see `__getattr__` for the global client)
 #####
-NEUPRINT_CLIENT = neu.Client(server="https://neuprint-cns.janelia.org", dataset="cns")
+NEUPRINT_SERVER = "https://neuprint-cns.janelia.org"
+NEUPRINT_DATASET = "cns"
 
 #####
 # Some BASE URLs for neuPrint
@@ -123,3 +138,150 @@ NEUPRINT_SEARCH_URL = "https://neuprint-cns.janelia.org/results?dataset=cns&qt=f
 
 # Connectivity search
 NEUPRINT_CONNECTIVITY_URL = "https://neuprint-cns.janelia.org/results?dataset=cns&qt=simpleconnection&q=1&qr%5B0%5D%5Bcode%5D=sc&qr%5B0%5D%5Bds%5D=cns&qr%5B0%5D%5Bpm%5D%5Bdataset%5D=cns&qr%5B0%5D%5Bpm%5D%5Benable_contains%5D=true&qr%5B0%5D%5Bpm%5D%5Bneuron_name%5D={neuron_name}&qr%5B0%5D%5Bpm%5D%5Bfind_inputs%5D=false&qr%5B0%5D%5BvisProps%5D%5BpaginateExpansion%5D=true&tab=0"
+
+
+#####
+# Lazily created objects
+#####
+
+
+def _load_scenes():
+    """Load the Neuroglancer base scenes and the sources they point to."""
+    import nglscenes as ngl
+
+    # The short links are resolved once and then cached as full URLs
+    try:
+        with open(NGL_SCENES_CACHE, "r") as f:
+            cached = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached = {}
+
+    scenes = {}
+    for name, url in (
+        ("NGL_BASE_SCENE", NGL_BASE_URL),
+        ("NGL_BASE_SCENE_VNC", NGL_BASE_URL_VNC),
+        ("NGL_BASE_SCENE_TOP", NGL_BASE_URL_TOP),
+    ):
+        if url not in cached:
+            cached[url] = ngl.Scene.from_url(url).url
+        scenes[name] = ngl.Scene.from_url(cached[url])
+    _save_json(cached, NGL_SCENES_CACHE)
+
+    # Make sure the segmentation layers are empty
+    for scene in scenes.values():
+        for i in range(2):
+            scene.layers[i]["segments"] = []
+
+    # Make backgrounds white
+    # for scene in scenes.values():
+    #     scene["projectionBackgroundColor"] = "#ffffff"
+
+    # URLs for the MCNS and FlyWire meta data
+    base = scenes["NGL_BASE_SCENE"]
+    scenes["FLYWIRE_SOURCE"] = base.layers["female (FlyWire)"][
+        "source"
+    ]  # precomputed layer
+    scenes["MCNS_SOURCE"] = base.layers["maleCNS"]["source"]["url"]  # DVID layer
+    dvid = scenes["MCNS_SOURCE"].replace("dvid://https://", "").split("/")
+    scenes["DVID_SERVER"] = "https://" + dvid[0]
+    scenes["DVID_NODE"] = dvid[1]
+
+    print(f"Using DVID server: {scenes['DVID_SERVER']}")
+    print(f"Using DVID node: {scenes['DVID_NODE']}")
+
+    return scenes
+
+
+def _make_neuprint_client():
+    """Connect to neuPrint."""
+    import navis.interfaces.neuprint as neu
+    from .network import instrument
+
+    client = neu.Client(server=NEUPRINT_SERVER, dataset=NEUPRINT_DATASET)
+    instrument(client.session)
+    return {"NEUPRINT_CLIENT": client}
+
+
+def _load_neuprint_meta():
+    """Load the (possibly cached) neuPrint meta data."""
+    try:
+        with open(NEUPRINT_META_CACHE, "r") as f:
+            meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        meta = __getattr__("NEUPRINT_CLIENT").meta  # connects on first access
+        _save_json(meta, NEUPRINT_META_CACHE)
+
+    return {"NEUPRINT_META": meta}
+
+
+def _make_future_session():
+    """FutureSession for async requests."""
+    from requests_futures.sessions import FuturesSession
+    from .network import instrument
+
+    # (one connection per worker thread)
+    session = instrument(FuturesSession(max_workers=10), pool_maxsize=10)
+    return {"FUTURE_SESSION": session}
+
+
+def _make_backend():
+    """Backend for fetching remote data (live services or fixtures)."""
+    from .backends import FixtureBackend, LiveBackend
+
+    if FIXTURE_DIR is not None:
+        print(f"Using fixtures from: {FIXTURE_DIR}")
+        return {"BACKEND": FixtureBackend(FIXTURE_DIR)}
+    return {"BACKEND": LiveBackend()}
+
+
+def _save_json(data, filepath):
+    # Write to a temporary file first and then move into place
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=filepath.parent, suffix=".json", delete=False
+    ) as f:
+        json.dump(data, f)
+    os.replace(f.name, filepath)
+
+
+# Maps lazily created names to the functions creating them
+_FACTORIES = {
+    "NGL_BASE_SCENE": _load_scenes,
+    "NGL_BASE_SCENE_VNC": _load_scenes,
+    "NGL_BASE_SCENE_TOP": _load_scenes,
+    "FLYWIRE_SOURCE": _load_scenes,
+    "MCNS_SOURCE": _load_scenes,
+    "DVID_SERVER": _load_scenes,
+    "DVID_NODE": _load_scenes,
+    "NEUPRINT_CLIENT": _make_neuprint_client,
+    "NEUPRINT_META": _load_neuprint_meta,
+    "FUTURE_SESSION": _make_future_session,
+    "BACKEND": _make_backend,
+}
+_FACTORY_LOCK = threading.RLock()
+
+
+def __getattr__(name):
+    """Create expensive module-level objects on first access."""
+    if name not in _FACTORIES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    with _FACTORY_LOCK:
+        if name not in globals():
+            globals().update(_FACTORIES[name]())
+    return globals()[name]
+
+
+def clear_remote_state_cache():
+    """Remove the cached Neuroglancer scenes and neuPrint meta data.
+
+    They will be re-fetched on next access.
+
+    """
+    with _FACTORY_LOCK:
+        # (the fixtures are the source of truth and must not be removed)
+        if FIXTURE_DIR is None:
+            for filepath in (NGL_SCENES_CACHE, NEUPRINT_META_CACHE):
+                filepath.unlink(missing_ok=True)
+        for name in _FACTORIES:
+            globals().pop(name, None)
@@ -0,0 +1,114 @@
+"""
+Network graphs of the strongest type-to-type connections.
+
+This module is imported lazily by `building.py` so that builds without graphs
+never import d3graph.
+"""
+
+import logging
+
+import pandas as pd
+
+from d3graph import d3graph, vec2adjmat
+
+from .connectivity import TypeConnectivity
+from .env import GRAPH_DIR
+
+# Silence the d3graph logger
+logging.getLogger("d3graph").setLevel(logging.WARNING)
+
+
+def generate_graphs(
+    type_name: str,
+    type_meta_mcns: pd.DataFrame,
+    type_meta_fw: pd.DataFrame,
+    mcns_conn: TypeConnectivity,
+    fw_conn: TypeConnectivity,
+    N: int = 5,
+) -> None:
+    """Generate D3 graphs for the given neurons.
+
+    Parameters
+    ----------
+    type_name : str
+                The type of neuron to generate the graph for.
+                This is primarily used for the filename as
+                the graphs are generated from the meta data
+                (see below).
+    type_meta_mcns : pd.DataFrame
+                The meta data for the MCNS neurons to generate graphs for.
+    type_meta_fw : pd.DataFrame
+                The meta data for the FlyWire neurons to generate graphs for.
+    mcns_conn : TypeConnectivity
+                Type-level connectivity for MaleCNS. See
+                loading.py for the function that loads this data.
+    fw_conn :   TypeConnectivity
+                Type-level connectivity for FlyWire. See
+                loading.py for the function that loads this data.
+    N :         int
+                The number of top N in- and out-edges to keep.
+
+    Returns
+    -------
+    None
+                But will write the graphs to `GRAPH_DIR / f"{type_name}{_mcns/_fw}.html"`.
+
+    """
+    print(f"  Generating graphs for {type_name}...", flush=True)
+
+    # First up: graph for the MCNS neurons
+    if not type_meta_mcns.empty:
+        # Get the top N up- and downstream partners from the type-level connectivity
+        # (self-loops and partners without a type are already excluded)
+        mapping = type_meta_mcns["mapping"].iloc[0]
+        down = mcns_conn.downstream(mapping, N=N)
+        up = mcns_conn.upstream(mapping, N=N)
+
+        # Combine the top N in- and out-edges
+        df = pd.concat([down, up], axis=0).drop_duplicates().reset_index(drop=True)
+
+        # Generate the D3 graph
+        edges2d3(df, GRAPH_DIR / f"{type_name}_mcns.html", color="#00ffff")
+
+    # Now do the same for FlyWire
+    if not type_meta_fw.empty:
+        # Get the top N up- and downstream partners from the type-level connectivity
+        # (self-loops and partners without a type are already excluded)
+        mapping = type_meta_fw["mapping"].iloc[0]
+        down = fw_conn.downstream(mapping, N=N)
+        up = fw_conn.upstream(mapping, N=N)
+
+        # Combine the top N in- and out-edges
+        df = pd.concat([down, up], axis=0).drop_duplicates().reset_index(drop=True)
+
+        # Generate the D3 graph
+        edges2d3(df, GRAPH_DIR / f"{type_name}_fw.html", color="#ff00ff")
+
+
+def edges2d3(edges, filepath, color=None):
+    # Convert to adjacency matrix
+    adjmat = vec2adjmat(edges.pre_type, edges.post_type, weight=edges.weight)
+
+    # Initialise the graph
+    d3 = d3graph()
+
+    # Process adjacency matrix
+    d3.graph(adjmat, color=None)
+
+    d3.set_edge_properties(directed=True, label="weight")
+    d3.set_node_properties(color=color, fontcolor="#000000")
+
+    # For some reason the library is not passing through the save_button parameter
+    # and we have to render the graph manually again
+    d3.show(
+        figsize=(400, 400),
+        title="Graph",
+        filepath=filepath,
+        showfig=False,
+        overwrite=True,
+        show_slider=False,
+        set_slider=0,
+        save_button=False,
+    )
+
+    return filepath
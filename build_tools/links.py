@@ -0,0 +1,166 @@
+"""
+Fast Neuroglancer links for the type, synonym, supertype and hemilineage pages.
+
+Building a link via `nglscenes` means deep-copying one of the base scenes and
+serialising and percent-encoding its whole state (which is large) for every
+single link. Instead, a `SceneLink` only records which layer properties
+(segments, colors, visibility) differ from the base scene. Each combination of
+base scene and overridden properties is serialised once with a placeholder
+for every overridden value, and links are then made by splicing the encoded
+values between the cached fragments::
+
+    scene = SceneLink("NGL_BASE_SCENE")
+    scene.layers[1]["segments"] = body_ids
+    scene.url
+
+The URL is byte-identical to that of an `nglscenes.Scene` with the same
+changes: values are converted the same way the `nglscenes` layers would
+convert them (e.g. segment IDs to strings) and encoded with the same JSON
+settings.
+"""
+
+import json
+
+import numpy as np
+
+from urllib.parse import quote
+
+from . import env
+
+# Cached (base scene, overridden properties) -> `_SceneTemplate`
+_TEMPLATES = {}
+
+
+class SceneLink:
+    """A Neuroglancer link based on one of the base scenes.
+
+    Parameters
+    ----------
+    base :      "NGL_BASE_SCENE" | "NGL_BASE_SCENE_VNC" | "NGL_BASE_SCENE_TOP"
+                Name of the base scene in `env`.
+
+    Attributes
+    ----------
+    layers :    dict
+                Properties to override per layer (by index or name), e.g.
+                `layers[1]["segments"] = [...]`.
+
+    """
+
+    def __init__(self, base):
+        self.base = base
+        self.layers = _Overrides()
+
+    def __repr__(self):
+        return f"<SceneLink(base={self.base}, overrides={self._keys()})>"
+
+    def _keys(self):
+        return tuple(
+            (layer, key) for layer, props in self.layers.items() for key in props
+        )
+
+    @property
+    def url(self):
+        """The URL for the base scene with the overridden properties."""
+        keys = self._keys()
+        template = _TEMPLATES.get((self.base, keys))
+        if template is None:
+            template = _TEMPLATES[(self.base, keys)] = _SceneTemplate(
+                getattr(env, self.base), keys
+            )
+        return template.render([self.layers[layer][key] for layer, key in keys])
+
+
+class _Overrides(dict):
+    """Per-layer overrides (creates an empty dict for a layer on access)."""
+
+    def __missing__(self, layer):
+        props = self[layer] = {}
+        return props
+
+
+class _SceneTemplate:
+    """A base scene's URL split at the values of the given layer properties.
+
+    Parameters
+    ----------
+    scene :     nglscenes.Scene
+                The base scene.
+    keys :      tuple of (layer, key) tuples
+                The layer properties to leave placeholders for.
+
+    """
+
+    def __init__(self, scene, keys):
+        scene = scene.copy()
+
+        # The conversions the layers apply when setting a property
+        self.keys = [key for _, key in keys]
+        self.conversions = []
+        placeholders = []
+        for i, (layer, key) in enumerate(keys):
+            layer = scene.layers[layer]
+            self.conversions.append(layer.STATE_CONVERSION.get(key, {}))
+
+            # (bypass the conversion so the placeholder stays a plain string)
+            placeholders.append(_encode(f"scenelink-placeholder-{i}"))
+            layer.state[key] = f"scenelink-placeholder-{i}"
+
+        # Split the encoded URL at each of the placeholders. N.B. the order in
+        # the URL depends on the layer order and the sorted keys
+        url = scene.url
+        for p in placeholders:
+            if url.count(p) != 1:
+                raise ValueError(f"Placeholder {p!r} found {url.count(p)} times")
+        self.order = sorted(range(len(keys)), key=lambda i: url.index(placeholders[i]))
+        self.fragments = []
+        start = 0
+        for i in self.order:
+            stop = url.index(placeholders[i])
+            self.fragments.append(url[start:stop])
+            start = stop + len(placeholders[i])
+        self.fragments.append(url[start:])
+
+        # Scalar values (colors, visibility) rarely change between links
+        self._encoded = [{} for _ in keys]
+
+    def render(self, values):
+        """Splice encoded values into the URL."""
+        parts = [self.fragments[0]]
+        for i, fragment in zip(self.order, self.fragments[1:]):
+            key, value = self.keys[i], values[i]
+            conversion, encoded = self.conversions[i], self._encoded[i]
+            if isinstance(value, (str, bool)):
+                # (True == 1, so the type is part of the cache key)
+                cached = (value, type(value))
+                if cached not in encoded:
+                    encoded[cached] = _encode_value(key, value, conversion)
+                parts.append(encoded[cached])
+            else:
+                parts.append(_encode_value(key, value, conversion))
+            parts.append(fragment)
+        return "".join(parts)
+
+
+def _encode_value(key, value, conversion):
+    """Convert a property value as the layer would and JSON-/URL-encode it."""
+    # Fast path for arrays of segment IDs: the digits need no escaping, so
+    # we can skip the conversion to a list of strings
+    if key == "segments" and isinstance(value, np.ndarray) and value.dtype.kind in "iu":
+        if not len(value):
+            return _EMPTY_LIST
+        return _LIST_START + _LIST_SEP.join(value.astype(str)) + _LIST_END
+
+    if type(value) in conversion:
+        value = conversion[type(value)](value)
+    return _encode(value)
+
+
+def _encode(value):
+    """Encode a value the way `nglscenes.Scene.url` does."""
+    return quote(json.dumps(value, sort_keys=True))
+
+
+# Encoded parts of a JSON list of strings
+_EMPTY_LIST = _encode([])
+_LIST_START, _LIST_SEP, _LIST_END = _encode(["x", "x"]).split("x")
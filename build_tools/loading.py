@@ -2,182 +2,747 @@
 Functions for loading and caching data from neuPrint and FlyWire.
 """
 
+import os
 import json
-import requests
+import time
+import hashlib
 
-import cocoa as cc
+import numpy as np
 import pandas as pd
-import navis.interfaces.neuprint as neu
+import pyarrow as pa
 
-from io import BytesIO
 
+from requests import RequestException
+from concurrent.futures import ThreadPoolExecutor
+
+from . import env
+from .cache import MANIFEST, fetch_cached, read_feather
+from .connectivity import TypeConnectivity
+from .edges import read_edge_store, write_edge_store
+from .regions import MB_COMPARTMENTS, roi_profiles
 from .env import (
     MCNS_FW_MAPPING_URL,
     # MCNS_MANC_MAPPING_URL,
     FW_EDGES_URL,
+    FW_ROI_INFO_URL,
+    MAPPING_TTL,
+    FW_EDGES_TTL,
+    FW_ROI_INFO_TTL,
     MCNS_META_DATA_CACHE,
     MCNS_ROI_INFO_CACHE,
+    MCNS_ROI_COLUMNS_CACHE,
+    MCNS_EDGES_CACHE,
     FW_META_DATA_CACHE,
     FW_ROI_INFO_CACHE,
+    FW_EDGES_STORE,
     MAPPING_CACHE,
     CACHE_DIR,
-    NEUPRINT_CLIENT,
+)
+
+# Columns and types of the cached MCNS edges
+MCNS_EDGES_SCHEMA = pa.schema(
+    [("bodyId_pre", pa.int64()), ("bodyId_post", pa.int64()), ("weight", pa.int32())]
+)
+
+
+# Heavy MCNS meta data columns that are cached separately and loaded on demand
+MCNS_ROI_COLUMNS = ("roiInfo", "inputRois", "outputRois")
+
+# Low-cardinality meta data columns that are stored as categoricals (i.e.
+# dictionary-encoded in the feather caches). All other object columns are
+# converted to strings - otherwise loading the data becomes obscenely slow
+MCNS_CATEGORICAL_COLUMNS = (
+    "superclass",
+    "class",
+    "somaSide",
+    "rootSide",
+    "somaNeuromere",
+    "dimorphism",
+    "itoleeHl",
+    "trumanHl",
+    "supertype",
+    "fruDsx",
+    "predictedNt",
+    "consensusNt",
+    "status",
+    "statusLabel",
+    "entryNerve",
+    "exitNerve",
+)
+FW_CATEGORICAL_COLUMNS = (
+    "flow",
+    "super_class",
+    "cell_class",
+    "side",
+    "nerve",
+    "ito_lee_hemilineage",
+    "hartenstein_hemilineage",
+    "top_nt",
+    "dimorphism",
+    "supertype",
+    "status",
 )
 
 
 def load_cache_meta_data(force_update=False):
-    """Load the (possibly cached) meta data."""
+    """Load the (possibly cached) meta data.
+
+    The MCNS meta data, FlyWire meta data and FlyWire ROI info are loaded
+    concurrently. See `load_cache_all` to also load the mapping and edges.
+
+    """
+    results = _load_concurrently(
+        {
+            "MCNS meta data": lambda: load_cache_mcns_meta_data(force_update),
+            "FlyWire meta data": lambda: load_cache_fw_meta_data(force_update),
+            "FlyWire ROI info": lambda: load_cache_fw_roi_info(force_update),
+        }
+    )
+    mcns_data, mcns_roi_info = results["MCNS meta data"]
+
+    return (
+        mcns_data,
+        results["FlyWire meta data"],
+        mcns_roi_info,
+        results["FlyWire ROI info"],
+    )
+
+
+def load_cache_all(force_update=False, skip_edges=False):
+    """Load all input datasets concurrently.
+
+    Each source (neuPrint, FlyTable, flyem1) is fetched or read from the cache
+    in its own thread, so that an update takes about as long as the slowest
+    source rather than the sum of all of them.
+
+    Parameters
+    ----------
+    force_update : bool
+                If True, will force re-fetching the data.
+    skip_edges : bool
+                If True, will not make sure the FlyWire edges are downloaded.
+                Otherwise they are fetched into the cache (but not loaded into
+                memory - see `load_cache_fw_type_connectivity`).
+
+    Returns
+    -------
+    mcns_data :     pd.DataFrame
+    fw_data :       pd.DataFrame
+    mcns_roi_info : pd.DataFrame
+    fw_roi_info :   pd.DataFrame
+    mappings :      dict
+
+    """
+    tasks = {
+        "MCNS meta data": lambda: load_cache_mcns_meta_data(force_update),
+        "FlyWire meta data": lambda: load_cache_fw_meta_data(force_update),
+        "FlyWire ROI info": lambda: load_cache_fw_roi_info(force_update),
+        "Mapping": lambda: load_cache_mapping(force_update),
+    }
+    if not skip_edges:
+        tasks["FlyWire edges"] = lambda: _fetch_fw_edges(force_update)
+
+    results = _load_concurrently(tasks)
+    mcns_data, mcns_roi_info = results["MCNS meta data"]
+
+    return (
+        mcns_data,
+        results["FlyWire meta data"],
+        mcns_roi_info,
+        results["FlyWire ROI info"],
+        results["Mapping"],
+    )
+
+
+def _load_concurrently(tasks):
+    """Run loading functions in parallel threads and report their timings.
+
+    Parameters
+    ----------
+    tasks :     dict
+                Maps names to functions without arguments.
+
+    Returns
+    -------
+    dict
+                Maps names to the functions' return values.
+
+    """
+
+    def timed(func):
+        start = time.perf_counter()
+        return func(), time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+        futures = {name: executor.submit(timed, func) for name, func in tasks.items()}
+        results = {name: future.result() for name, future in futures.items()}
+
+    print(
+        f"Loaded {len(tasks)} datasets in {time.perf_counter() - start:.1f}s:",
+        flush=True,
+    )
+    width = max(len(name) for name in tasks)
+    for name, (_, duration) in results.items():
+        print(f"  {name + ':':<{width + 1}} {duration:.1f}s", flush=True)
+
+    return {name: value for name, (value, _) in results.items()}
+
+
+def load_cache_mcns_meta_data(force_update=False):
+    """Load the (possibly cached) MCNS meta data and ROI info from neuPrint.
+
+    The heavy `roiInfo`, `inputRois` and `outputRois` columns are split off
+    into a separate cache and are not part of the returned meta data. Use
+    `load_cache_mcns_roi_columns` to load them if needed.
+
+    """
     if (
         MCNS_META_DATA_CACHE.exists()
         and MCNS_ROI_INFO_CACHE.exists()
         and not force_update
     ):
-        mcns_data = pd.read_feather(MCNS_META_DATA_CACHE)
+        # (older caches still contain the ROI columns)
+        mcns_data = _apply_schema(
+            read_feather(MCNS_META_DATA_CACHE, exclude=MCNS_ROI_COLUMNS),
+            MCNS_CATEGORICAL_COLUMNS,
+        )
         mcns_roi_info = pd.read_feather(MCNS_ROI_INFO_CACHE)
         print(
             "Loaded MCNS meta data from cache. Use the --update-metadata flag to force reloading.",
             flush=True,
         )
     else:
-        print("Loading MCNS meta data from neuPrint...", flush=True, end="")
-        mcns_data, mcns_roi_info = neu.fetch_neurons(
-            neu.NeuronCriteria(), client=NEUPRINT_CLIENT
+        print("Loading MCNS meta data from neuPrint...", flush=True)
+        mcns_data, mcns_roi_info = env.BACKEND.fetch_mcns_neurons()
+        roi_columns = [c for c in MCNS_ROI_COLUMNS if c in mcns_data.columns]
+        mcns_roi_columns = _apply_schema(mcns_data[["bodyId"] + roi_columns], ())
+        mcns_data = _apply_schema(
+            mcns_data.drop(columns=roi_columns), MCNS_CATEGORICAL_COLUMNS
         )
 
-        # Try to convert object columns to strings - otherwise loading the data becomes obscenely slow
-        for col in mcns_data.select_dtypes(include=["object"]).columns:
-            try:
-                mcns_data[col] = mcns_data[col].astype("string")
-            except Exception as e:
-                print(f"Failed to convert column {col}: {e}", flush=True)
-
         mcns_data.to_feather(MCNS_META_DATA_CACHE)
+        mcns_roi_columns.reset_index(drop=True).to_feather(MCNS_ROI_COLUMNS_CACHE)
         mcns_roi_info.to_feather(MCNS_ROI_INFO_CACHE)
+        MANIFEST.record("mcns_meta_data", MCNS_META_DATA_CACHE, source="neuPrint")
+        MANIFEST.record("mcns_roi_columns", MCNS_ROI_COLUMNS_CACHE, source="neuPrint")
+        MANIFEST.record("mcns_roi_info", MCNS_ROI_INFO_CACHE, source="neuPrint")
         print(f"Done. Found {len(mcns_data):,} MCNS neurons.", flush=True)
 
+    return mcns_data, mcns_roi_info
+
+
+def load_cache_mcns_roi_columns(force_update=False):
+    """Load the (possibly cached) `roiInfo`, `inputRois` and `outputRois` columns.
+
+    These are not part of the MCNS meta data returned by
+    `load_cache_mcns_meta_data` and are only read when requested.
+
+    Returns
+    -------
+    pd.DataFrame
+                The ROI columns with a `bodyId` column to join on.
+
+    """
+    if force_update or not MCNS_META_DATA_CACHE.exists():
+        load_cache_mcns_meta_data(force_update=force_update)
+
+    if MCNS_ROI_COLUMNS_CACHE.exists():
+        return pd.read_feather(MCNS_ROI_COLUMNS_CACHE)
+
+    # Older caches kept the ROI columns in the meta data itself
+    return read_feather(MCNS_META_DATA_CACHE, columns=["bodyId", *MCNS_ROI_COLUMNS])
+
+
+def load_cache_fw_meta_data(force_update=False):
+    """Load the (possibly cached) FlyWire meta data from FlyTable."""
     if FW_META_DATA_CACHE.exists() and not force_update:
-        fw_data = pd.read_feather(FW_META_DATA_CACHE)
+        fw_data = _apply_schema(
+            pd.read_feather(FW_META_DATA_CACHE), FW_CATEGORICAL_COLUMNS
+        )
         print(
             "Loaded FlyWire meta data from cache. Use the --update-metadata flag to force reloading.",
             flush=True,
         )
     else:
-        print("Loading FlyWire meta data from FlyTable...", flush=True, end="")
-        fw_data = cc.FlyWire(live_annot=True).get_annotations()
-
-        # Try to convert object columns to strings - otherwise loading the data becomes obscenely slow
-        for col in fw_data.select_dtypes(include=["object"]).columns:
-            try:
-                fw_data[col] = fw_data[col].astype("string")
-            except Exception as e:
-                print(f"Failed to convert column {col}: {e}", flush=True)
+        print("Loading FlyWire meta data from FlyTable...", flush=True)
+        fw_data = env.BACKEND.fetch_fw_annotations()
+        fw_data = _apply_schema(fw_data, FW_CATEGORICAL_COLUMNS)
 
         fw_data.to_feather(FW_META_DATA_CACHE)
+        MANIFEST.record("fw_meta_data", FW_META_DATA_CACHE, source="FlyTable")
         print(f"Done. Found {len(fw_data):,} FlyWire neurons.", flush=True)
 
     fw_data["type"] = fw_data.cell_type.fillna(fw_data.hemibrain_type).fillna(
         fw_data.malecns_type
     )
 
-    if FW_ROI_INFO_CACHE.exists():
-        fw_roi_info = pd.read_feather(FW_ROI_INFO_CACHE)
-        print(
-            "Loaded FlyWire ROI info from cache. Use the --update-metadata flag to force reloading.",
-            flush=True,
-        )
+    return fw_data
+
+
+def _apply_schema(data, categorical):
+    """Convert meta data columns to compact dtypes.
+
+    Parameters
+    ----------
+    data :          pd.DataFrame
+                    The meta data.
+    categorical :   iterable of str
+                    Columns to convert to categoricals (if present). All other
+                    object columns are converted to strings.
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+    for col in data.columns:
+        if col in categorical and (
+            data[col].dtype == object or isinstance(data[col].dtype, pd.StringDtype)
+        ):
+            data[col] = data[col].astype("string").astype("category")
+        elif data[col].dtype == object:
+            try:
+                data[col] = data[col].astype("string")
+            except Exception as e:
+                print(f"Failed to convert column {col}: {e}", flush=True)
+
+    return data
+
+
+def load_cache_fw_roi_info(force_update=False):
+    """Load the (possibly cached) FlyWire ROI info.
+
+    The cached file is revalidated against the server once it is older than
+    `FW_ROI_INFO_TTL` (or if `force_update` is True).
+
+    """
+    # # Load presynapses (17Mb)
+    # r = requests.get(
+    #     "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/per_neuron_neuropil_filtered_count_pre_783.feather"
+    # )
+    # r.raise_for_status()
+    # pre = pd.read_feather(BytesIO(r.content)).rename(
+    #     columns={"pre_pt_root_id": "root_id"}
+    # )
+    # # Load postsynapses (233Mb)
+    # r = requests.get(
+    #     "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/per_neuron_neuropil_filtered_count_post_783.feather"
+    # )
+    # r.raise_for_status()
+    # post = pd.read_feather(BytesIO(r.content)).rename(
+    #     columns={"post_pt_root_id": "root_id"}
+    # )
+    # # Combine
+    # fw_roi_info = pd.merge(
+    #     pre.set_index(["root_id", "neuropil"])["count"],
+    #     post.set_index(["root_id", "neuropil"])["count"],
+    #     left_index=True,
+    #     right_index=True,
+    # ).reset_index(drop=False)
+    # fw_roi_info.columns = ["root_id", "roi", "pre", "post"]
+
+    # # Rename neuropils to align to MaleCNS
+    # fw_roi_info.loc[fw_roi_info.roi.str.endswith("_L", na=False), "roi"] = (
+    #     fw_roi_info.loc[
+    #         fw_roi_info.roi.str.endswith("_L", na=False), "roi"
+    #     ].str.replace("_L", "(L)")
+    # )
+    # fw_roi_info.loc[fw_roi_info.roi.str.endswith("_R", na=False), "roi"] = (
+    #     fw_roi_info.loc[
+    #         fw_roi_info.roi.str.endswith("_R", na=False), "roi"
+    #     ].str.replace("_R", "(R)")
+    # )
+
+    # Load the finished file from flyem1 - we're trying to avoid issues on Github actions
+    changed = fetch_cached(
+        "fw_roi_info",
+        FW_ROI_INFO_URL,
+        FW_ROI_INFO_CACHE,
+        ttl=FW_ROI_INFO_TTL,
+        force_update=force_update,
+    )
+    fw_roi_info = read_feather(FW_ROI_INFO_CACHE)
+    if changed:
+        print("Downloaded updated FlyWire ROI info from flyem1.", flush=True)
     else:
-        print(
-            "Loading and compiling FlyWire ROI info from Zenodo...", flush=True, end=""
-        )
-        # # Load presynapses (17Mb)
-        # r = requests.get(
-        #     "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/per_neuron_neuropil_filtered_count_pre_783.feather"
-        # )
-        # r.raise_for_status()
-        # pre = pd.read_feather(BytesIO(r.content)).rename(
-        #     columns={"pre_pt_root_id": "root_id"}
-        # )
-        # # Load postsynapses (233Mb)
-        # r = requests.get(
-        #     "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/per_neuron_neuropil_filtered_count_post_783.feather"
-        # )
-        # r.raise_for_status()
-        # post = pd.read_feather(BytesIO(r.content)).rename(
-        #     columns={"post_pt_root_id": "root_id"}
-        # )
-        # # Combine
-        # fw_roi_info = pd.merge(
-        #     pre.set_index(["root_id", "neuropil"])["count"],
-        #     post.set_index(["root_id", "neuropil"])["count"],
-        #     left_index=True,
-        #     right_index=True,
-        # ).reset_index(drop=False)
-        # fw_roi_info.columns = ["root_id", "roi", "pre", "post"]
-
-        # # Rename neuropils to align to MaleCNS
-        # fw_roi_info.loc[fw_roi_info.roi.str.endswith("_L", na=False), "roi"] = (
-        #     fw_roi_info.loc[
-        #         fw_roi_info.roi.str.endswith("_L", na=False), "roi"
-        #     ].str.replace("_L", "(L)")
-        # )
-        # fw_roi_info.loc[fw_roi_info.roi.str.endswith("_R", na=False), "roi"] = (
-        #     fw_roi_info.loc[
-        #         fw_roi_info.roi.str.endswith("_R", na=False), "roi"
-        #     ].str.replace("_R", "(R)")
-        # )
-
-        # Load the finished file from flyem1 - we're trying to avoid issues on Github actions
-        fw_roi_info = pd.read_feather(
-            "https://flyem.mrc-lmb.cam.ac.uk/flyconnectome/flywire_connectivity/fw_roi_info.feather"
-        )
+        print("Loaded FlyWire ROI info from cache.", flush=True)
+
+    return fw_roi_info
+
 
-        # Save to cache
-        fw_roi_info.to_feather(FW_ROI_INFO_CACHE)
-        print("Done.", flush=True)
+def load_cache_roi_profiles(mcns_roi_info, fw_roi_info):
+    """Load the (possibly cached) ROI profiles for MaleCNS and FlyWire neurons.
 
-    return mcns_data, fw_data, mcns_roi_info, fw_roi_info
+    The profiles collapse left and right ROIs and are normalised by each
+    neuron's total number of synapses (see `regions.roi_profiles`). They are
+    cached next to the ROI info and only re-computed if the ROI info changes.
+    The input frames are not modified.
+
+    Parameters
+    ----------
+    mcns_roi_info : pd.DataFrame
+                The ROI info for MaleCNS neurons as returned from neuPrint.
+    fw_roi_info :   pd.DataFrame
+                The ROI info for FlyWire neurons.
+
+    Returns
+    -------
+    mcns_profiles : pd.DataFrame
+    fw_profiles :   pd.DataFrame
+
+    """
+    mcns_profiles = _load_cache_roi_profiles(
+        "MCNS",
+        mcns_roi_info,
+        MCNS_ROI_INFO_CACHE,
+        id_col="bodyId",
+        rename=MB_COMPARTMENTS,
+    )
+    fw_profiles = _load_cache_roi_profiles(
+        "FlyWire", fw_roi_info, FW_ROI_INFO_CACHE, id_col="root_id"
+    )
+
+    return mcns_profiles, fw_profiles
+
+
+def _load_cache_roi_profiles(name, roi_info, source_path, **kwargs):
+    """Load or compile ROI profiles cached next to the ROI info.
+
+    Parameters
+    ----------
+    name :      str
+                Name of the dataset (for printing).
+    roi_info :  pd.DataFrame
+                The per-neuron ROI info.
+    source_path : Path
+                Path to the cached ROI info.
+    **kwargs
+                Passed through to `regions.roi_profiles`.
+
+    Returns
+    -------
+    pd.DataFrame
+
+    """
+    # The cache key combines the ROI info file and the parameters
+    digest = hashlib.sha1(str(source_path.stat().st_mtime_ns).encode())
+    digest.update(repr(sorted(kwargs.items())).encode())
+    filepath = (
+        CACHE_DIR / f"{source_path.stem}_profiles_{digest.hexdigest()[:12]}.feather"
+    )
+
+    if filepath.exists():
+        profiles = read_feather(filepath)
+        print(f"Loaded {name} ROI profiles from cache.", flush=True)
+    else:
+        print(f"Compiling {name} ROI profiles...", flush=True)
+        profiles = roi_profiles(roi_info, **kwargs)
+
+        # Remove stale caches before saving the new one
+        for f in CACHE_DIR.glob(f"{source_path.stem}_profiles_*.feather"):
+            f.unlink()
+        profiles.to_feather(filepath)
+
+    return profiles
 
 
 def load_cache_mapping(force_update=False):
-    """Load the (possibly cached) male-female mapping."""
-    if MAPPING_CACHE.exists() and not force_update:
-        with open(MAPPING_CACHE, "r") as f:
-            mappings = json.load(f)
-            mappings = {int(k): v for k, v in mappings.items()}  # Convert keys to int
+    """Load the (possibly cached) male-female mapping.
+
+    The mapping is re-generated on the server every 30 minutes, so the cached
+    file is revalidated once it is older than `MAPPING_TTL` (or if
+    `force_update` is True).
+
+    """
+    changed = fetch_cached(
+        "mapping",
+        MCNS_FW_MAPPING_URL,
+        MAPPING_CACHE,
+        ttl=MAPPING_TTL,
+        force_update=force_update,
+    )
+    with open(MAPPING_CACHE, "r") as f:
+        mappings = json.load(f)
+
+    # Remove the dataset prefix from the "{dataset}:{id}" keys
+    mappings = {int(k.split(":")[-1]): v for k, v in mappings.items()}
+
+    if changed:
+        print("Downloaded updated cross-dataset mapping from flyem1.", flush=True)
+    else:
+        print("Loaded cross-dataset mapping from cache.", flush=True)
+
+    return mappings
+
+
+def load_cache_fw_edges(force_update=False, root_ids=None):
+    """Load the (possibly cached) FlyWire edges.
+
+    The edges are read from a memory-mapped edge store that only contains
+    the `pre_pt_root_id`, `post_pt_root_id` and `syn_count` columns (see
+    `_fetch_fw_edges`).
+
+    Parameters
+    ----------
+    force_update : bool
+                If True, will revalidate the downloaded edges.
+    root_ids :  iterable, optional
+                If provided, only edges between these neurons are loaded.
+
+    Returns
+    -------
+    fw_edges :  pd.DataFrame
+
+    """
+    filepath = _fetch_fw_edges(force_update=force_update)
+    fw_edges = read_edge_store(filepath, ids=root_ids)
+    print(f"Loaded {len(fw_edges):,} FlyWire edges.", flush=True)
+
+    return fw_edges
+
+
+def _fetch_fw_edges(force_update=False):
+    """Make sure the FlyWire edges are in the cache without loading them.
+
+    The edges rarely change, so the cached file is only revalidated once it
+    is older than `FW_EDGES_TTL` (or if `force_update` is True). The download
+    is converted into an uncompressed edge store (`FW_EDGES_STORE`) with just
+    the columns we need, which is returned.
+
+    """
+    filepath = CACHE_DIR / FW_EDGES_URL.split("/")[-1]
+    if fetch_cached(
+        "fw_edges",
+        FW_EDGES_URL,
+        filepath,
+        ttl=FW_EDGES_TTL,
+        force_update=force_update,
+    ):
+        print("Downloaded updated FlyWire edges from flyem1.", flush=True)
+
+    if (
+        not FW_EDGES_STORE.exists()
+        or FW_EDGES_STORE.stat().st_mtime_ns < filepath.stat().st_mtime_ns
+    ):
+        print("Compiling FlyWire edge store...", flush=True)
+        write_edge_store(
+            filepath,
+            FW_EDGES_STORE,
+            pre="pre_pt_root_id",
+            post="post_pt_root_id",
+            weight="syn_count",
+        )
+        MANIFEST.record("fw_edges_store", FW_EDGES_STORE, source=filepath.name)
+
+    return FW_EDGES_STORE
+
+
+def load_cache_mcns_edges(
+    body_ids, force_update=False, batch_size=500, max_retries=3
+):
+    """Load the (possibly cached) neuron-to-neuron edges for MaleCNS.
+
+    Instead of querying neuPrint for each type individually, this fetches
+    all edges between the given neurons and any other neuron in batched
+    queries and caches them locally. Each batch is written to the cache as
+    soon as it arrives, so only one batch is kept in memory at a time.
+
+    Parameters
+    ----------
+    body_ids :  iterable
+                Body IDs of the (presynaptic) neurons to fetch edges for.
+                Typically all neurons in the MaleCNS meta data.
+    force_update : bool
+                If True, will force re-fetching the edges from neuPrint.
+    batch_size : int
+                Number of presynaptic neurons to fetch per query. The IDs are
+                inlined in the Cypher query (neuPrint's custom endpoint has
+                no query parameters), and each query returns all of their
+                edges, so keep this small enough to stay well below the
+                neuPrint timeout.
+    max_retries : int
+                How often to retry a failed batch before giving up.
+
+    Returns
+    -------
+    mcns_edges : pd.DataFrame
+                Edge list with `bodyId_pre`, `bodyId_post` and `weight` columns.
+
+    """
+    if MCNS_EDGES_CACHE.exists() and not force_update:
+        mcns_edges = pd.read_feather(MCNS_EDGES_CACHE)
         print(
-            "Loaded cross-dataset mapping from cache. Use the --update-metadata flag to force reloading.",
+            "Loaded MCNS edges from cache. Use the --update-metadata flag to force reloading.",
             flush=True,
         )
     else:
-        print("Loading cross-dataset from flyem1...", flush=True, end="")
-        r = requests.get(MCNS_FW_MAPPING_URL)
-        mappings = r.json()
+        body_ids = np.sort(np.unique(np.asarray(body_ids, dtype=np.int64)))
+        n_batches = int(np.ceil(len(body_ids) / batch_size))
+        print(f"Loading MCNS edges from neuPrint in {n_batches} batches...", flush=True)
 
-        # Remove the dataset prefix from the "{dataset}:{id}" keys
-        mappings = {int(k.split(":")[1]): v for k, v in mappings.items()}
+        # Append the batches to an Arrow IPC file (i.e. feather) as we go and
+        # only move it into place once all batches are done
+        partial = MCNS_EDGES_CACHE.with_suffix(".partial")
+        with pa.ipc.new_file(partial, MCNS_EDGES_SCHEMA) as writer:
+            for i in range(0, len(body_ids), batch_size):
+                batch = _fetch_mcns_edges(body_ids[i : i + batch_size], max_retries)
+                writer.write_table(
+                    pa.Table.from_pandas(
+                        batch, schema=MCNS_EDGES_SCHEMA, preserve_index=False
+                    )
+                )
+        os.replace(partial, MCNS_EDGES_CACHE)
+        MANIFEST.record("mcns_edges", MCNS_EDGES_CACHE, source="neuPrint")
 
-        with open(MAPPING_CACHE, "w") as f:
-            json.dump(mappings, f)
-        print("Done.", flush=True)
+        mcns_edges = pd.read_feather(MCNS_EDGES_CACHE)
+        print(f"Done. Found {len(mcns_edges):,} MCNS edges.", flush=True)
 
-    return mappings
+    return mcns_edges
 
 
-def load_cache_fw_edges(force_update=False):
-    """Load the (possibly cached) FlyWire edges."""
-    filename = FW_EDGES_URL.split("/")[-1]
-    filepath = CACHE_DIR / filename
+def _fetch_mcns_edges(body_ids, max_retries=3):
+    """Fetch all edges from the given neurons from neuPrint (with retries)."""
+    for attempt in range(max_retries + 1):
+        try:
+            edges = env.BACKEND.fetch_mcns_edges(body_ids.tolist())
+            break
+        except RequestException as e:
+            if attempt == max_retries:
+                raise
+            print(
+                f"Fetching MCNS edges failed ({e.__class__.__name__}); retrying...",
+                flush=True,
+            )
+            time.sleep(min(2**attempt, 30))
 
-    if filepath.exists() and not force_update:
-        fw_edges = pd.read_feather(filepath)
-        print(
-            "Loaded FlyWire edges from cache. Use the --update-metadata flag to force reloading.",
-            flush=True,
+    return edges.astype(
+        {"bodyId_pre": np.int64, "bodyId_post": np.int64, "weight": np.int32}
+    )
+
+
+def load_cache_mcns_type_connectivity(mcns_meta, force_update=False):
+    """Load the (possibly cached) type-level connectivity for MaleCNS.
+
+    After the first run, this does not require any queries to neuPrint.
+    See `load_cache_mcns_edges` and `load_cache_fw_type_connectivity`
+    for details.
+
+    Parameters
+    ----------
+    mcns_meta : pd.DataFrame
+                MaleCNS meta data. Must contain a `mapping` column.
+    force_update : bool
+                If True, will force re-fetching the edges from neuPrint.
+
+    Returns
+    -------
+    TypeConnectivity
+
+    """
+    # Make sure the edges are fetched
+    mcns_edges = None
+    if force_update or not MCNS_EDGES_CACHE.exists():
+        mcns_edges = load_cache_mcns_edges(
+            mcns_meta["bodyId"].values, force_update=force_update
         )
+
+    return _load_cache_type_connectivity(
+        "MCNS",
+        mcns_meta.set_index("bodyId")["mapping"],
+        MCNS_EDGES_CACHE,
+        load_edges=lambda: (
+            mcns_edges
+            if mcns_edges is not None
+            else load_cache_mcns_edges(mcns_meta["bodyId"].values)
+        ),
+        pre="bodyId_pre",
+        post="bodyId_post",
+        weight="weight",
+    )
+
+
+def load_cache_fw_type_connectivity(fw_meta, force_update=False):
+    """Load the (possibly cached) type-level connectivity for FlyWire.
+
+    The grouped FlyWire edges are aggregated into a type x type matrix using
+    the `mapping` column in `fw_meta`. The result is cached next to the edges
+    and only re-computed if either the mapping or the edges change.
+
+    Parameters
+    ----------
+    fw_meta :   pd.DataFrame
+                FlyWire meta data. Must contain a `mapping` column.
+    force_update : bool
+                If True, will force reloading the edges.
+
+    Returns
+    -------
+    TypeConnectivity
+
+    """
+    # Make sure the edges are downloaded (and up-to-date)
+    edges_path = _fetch_fw_edges(force_update=force_update)
+
+    return _load_cache_type_connectivity(
+        "FlyWire",
+        fw_meta.set_index("root_id")["mapping"],
+        edges_path,
+        # Only edges between mapped neurons contribute to the type connectivity
+        load_edges=lambda: load_cache_fw_edges(
+            root_ids=fw_meta.loc[fw_meta["mapping"].notnull(), "root_id"].values
+        ),
+        pre="pre_pt_root_id",
+        post="post_pt_root_id",
+        weight="syn_count",
+    )
+
+
+def _load_cache_type_connectivity(name, mapping, edges_path, load_edges, **kwargs):
+    """Load or compile type-level connectivity cached next to the edges.
+
+    Parameters
+    ----------
+    name :      str
+                Name of the dataset (for printing).
+    mapping :   pd.Series
+                Maps neuron IDs (index) to types (values).
+    edges_path : Path
+                Path to the cached neuron-level edges.
+    load_edges : callable
+                Function returning the neuron-level edges. Only called if
+                the type-level connectivity is not cached.
+    **kwargs
+                Passed through to `TypeConnectivity.from_neuron_edges`.
+
+    Returns
+    -------
+    TypeConnectivity
+
+    """
+    # The cache key combines the ID -> mapping assignment and the edges file
+    mapping = mapping[~mapping.index.duplicated(keep="last")]
+    digest = hashlib.sha1(
+        pd.util.hash_pandas_object(mapping, index=True).values.tobytes()
+    )
+    digest.update(str(edges_path.stat().st_mtime_ns).encode())
+    filepath = (
+        CACHE_DIR / f"{edges_path.stem}_by_type_{digest.hexdigest()[:12]}.feather"
+    )
+
+    if filepath.exists():
+        conn = TypeConnectivity.from_feather(filepath)
+        print(f"Loaded {name} type connectivity from cache.", flush=True)
     else:
-        print("Loading FlyWire edges from flyem1...", flush=True, end="")
-        fw_edges = pd.read_feather(FW_EDGES_URL)
-        fw_edges.to_feather(filepath)
-        print("Done.", flush=True)
+        edges = load_edges()
 
-    return fw_edges
+        print(f"Aggregating {name} edges by type...", flush=True)
+        conn = TypeConnectivity.from_neuron_edges(edges, mapping, **kwargs)
+
+        # Remove stale caches before saving the new one
+        for f in CACHE_DIR.glob(f"{edges_path.stem}_by_type_*.feather"):
+            f.unlink()
+        conn.to_feather(filepath)
+        print(f"Done. Found {len(conn):,} type-to-type edges.", flush=True)
+
+    return conn
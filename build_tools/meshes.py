@@ -0,0 +1,180 @@
+"""
+Fetching and local caching of neuron meshes.
+"""
+
+import os
+import hashlib
+import tempfile
+
+from pathlib import Path
+from concurrent.futures import as_completed
+
+from . import env
+from .env import MESH_CACHE_DIR, MESH_CACHE_MAX_SIZE
+
+
+class MeshCache:
+    """Content-addressed on-disk cache for mesh files.
+
+    Files are keyed by dataset, segment ID and version (e.g. the DVID node or
+    the FlyWire materialization). Once the total size exceeds `max_size`,
+    the least recently used files are evicted. Access times are tracked via
+    the files' modification times, so the cache is safe to share between
+    processes.
+
+    Parameters
+    ----------
+    directory : Path
+                Directory to store the meshes in.
+    max_size :  int
+                Maximum size of the cache in bytes.
+
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = None
+
+    def __repr__(self):
+        return f"<MeshCache(directory={self.directory}, max_size={self.max_size:,})>"
+
+    def path(self, dataset, id, version):
+        """Path to the cached file for a given mesh."""
+        key = hashlib.sha1(f"{dataset}:{version}:{id}".encode()).hexdigest()
+        return self.directory / dataset / key[:2] / key
+
+    def get(self, dataset, id, version):
+        """Get a mesh from the cache. Returns None if not cached."""
+        path = self.path(dataset, id, version)
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        # Mark as recently used
+        os.utime(path)
+        return data
+
+    def put(self, dataset, id, version, data):
+        """Add a mesh to the cache."""
+        path = self.path(dataset, id, version)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temporary file first and then move into place
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+        if self._size is not None:
+            self._size += len(data)
+        self.evict()
+
+    @property
+    def size(self):
+        """Total size of the cache in bytes."""
+        if self._size is None:
+            self._size = sum(f.stat().st_size for f in self._files())
+        return self._size
+
+    def evict(self, low_water=0.9):
+        """Evict least recently used files if we are above `max_size`.
+
+        Files are evicted until the cache is below `low_water * max_size` so
+        that we do not have to re-scan the cache on every subsequent write.
+
+        """
+        if self.size <= self.max_size:
+            return
+
+        files = []
+        for f in self._files():
+            try:
+                stat = f.stat()
+            except FileNotFoundError:  # evicted by another process
+                continue
+            files.append((stat.st_mtime, stat.st_size, f))
+
+        size = sum(s for _, s, _ in files)
+        for _, s, f in sorted(files, key=lambda x: x[0]):
+            if size <= self.max_size * low_water:
+                break
+            f.unlink(missing_ok=True)
+            size -= s
+        self._size = size
+
+    def clear(self):
+        """Remove all files from the cache."""
+        for f in self._files():
+            f.unlink(missing_ok=True)
+        self._size = 0
+
+    def _files(self):
+        return (f for f in self.directory.glob("*/*/*") if f.is_file())
+
+
+# A global mesh cache
+MESH_CACHE = MeshCache(MESH_CACHE_DIR, MESH_CACHE_MAX_SIZE)
+
+
+def fetch_flywire_meshes(root_ids):
+    """Fetch (possibly cached) FlyWire meshes.
+
+    Parameters
+    ----------
+    root_ids :  iterable
+                Root IDs to fetch meshes for.
+
+    Returns
+    -------
+    dict
+                Maps root IDs to the raw (precomputed) mesh data.
+
+    """
+    base_url = env.FLYWIRE_SOURCE.replace("precomputed://", "")
+    return _fetch_meshes(root_ids, "flywire", base_url, lambda id: f"{base_url}/{id}")
+
+
+def fetch_mcns_meshes(body_ids):
+    """Fetch (possibly cached) MaleCNS meshes from DVID.
+
+    Parameters
+    ----------
+    body_ids :  iterable
+                Body IDs to fetch meshes for.
+
+    Returns
+    -------
+    dict
+                Maps body IDs to the raw (precomputed) mesh data.
+
+    """
+    base_url = f"{env.DVID_SERVER}/api/node/{env.DVID_NODE}/segmentation_meshes/key"
+    return _fetch_meshes(
+        body_ids, "mcns", env.DVID_NODE, lambda id: f"{base_url}/{id}.ngmesh"
+    )
+
+
+def _fetch_meshes(ids, dataset, version, make_url):
+    """Fetch meshes from the cache and download whatever is missing."""
+    meshes = {}
+    for id in ids:
+        data = MESH_CACHE.get(dataset, id, version)
+        if data is not None:
+            meshes[id] = data
+
+    session = env.FUTURE_SESSION
+    futures = {
+        session.get(env.BACKEND.resolve_url(make_url(id))): id
+        for id in ids
+        if id not in meshes
+    }
+    for future in as_completed(futures):
+        id = futures[future]
+        r = future.result()
+        r.raise_for_status()
+        meshes[id] = r.content
+        MESH_CACHE.put(dataset, id, version, r.content)
+
+    return meshes
@@ -0,0 +1,291 @@
+"""
+Transport-level instrumentation of the HTTP requests made during the build.
+
+All sessions used by the build (the `FUTURE_SESSION` for meshes, the neuPrint
+client's session and the downloads in `cache.py`) are mounted with an
+`InstrumentedAdapter`. This is a no-op unless the global monitor has been
+started (see `start_monitor`, done by the `--profile` flag of
+`build_pages.py`). Each request is then recorded with its endpoint family
+(e.g. "neuprint /api/custom/custom" or "dvid meshes"), status code, bytes
+sent and received, urllib3 retries and latency, and attributed to the stage
+of the build (see `profiling.stage`) it was made in.
+
+Requests made by the thumbnail workers are sent back to the main process
+with each rendered thumbnail and attributed to the "render" stage.
+"""
+
+import os
+import threading
+
+import numpy as np
+import requests
+
+from time import perf_counter
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+from . import env, profiling
+
+# The global monitor (see `start_monitor`)
+MONITOR = None
+
+
+class NetworkMonitor:
+    """Record HTTP requests by stage and endpoint family."""
+
+    def __init__(self):
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"<NetworkMonitor(requests={len(self.records):,})>"
+
+    def add(self, record):
+        """Add a request record (see `InstrumentedAdapter`)."""
+        with self._lock:
+            self.records.append(record)
+
+    def retry(self, url):
+        """Record a retry of a request that is not made by urllib3 itself."""
+        self.add(
+            {
+                "stage": profiling.current_stage(),
+                "family": endpoint_family(url),
+                "retry": True,
+            }
+        )
+
+    def drain(self):
+        """Remove and return all records (used to collect them from workers)."""
+        with self._lock:
+            records, self.records = self.records, []
+        return records
+
+    def summary(self):
+        """Summarise the requests by stage and endpoint family.
+
+        Returns
+        -------
+        list of dicts
+                    One per stage and family (in order of the first request)
+                    with the number of `requests`, bytes `sent` and
+                    `received`, `retries`, `errors` (failed connections and
+                    4xx/5xx responses), a count per `status` and the 50th,
+                    90th and 99th percentile and maximum latency in seconds.
+
+        """
+        groups = {}
+        for r in self.records:
+            groups.setdefault((r["stage"], r["family"]), []).append(r)
+
+        summary = []
+        for (stage, family), records in groups.items():
+            made = [r for r in records if not r.get("retry")]
+            status = {}
+            for r in made:
+                status[str(r["status"])] = status.get(str(r["status"]), 0) + 1
+
+            s = {
+                "stage": stage,
+                "family": family,
+                "requests": len(made),
+                "sent": sum(r["sent"] for r in made),
+                "received": sum(r["received"] for r in made),
+                "retries": sum(r["retries"] for r in made) + len(records) - len(made),
+                "errors": sum(
+                    not isinstance(r["status"], int) or r["status"] >= 400
+                    for r in made
+                ),
+                "status": status,
+            }
+            if made:
+                latency = np.array([r["latency"] for r in made])
+                p50, p90, p99 = np.percentile(latency, [50, 90, 99])
+                s.update(p50=p50, p90=p90, p99=p99, max=latency.max())
+            summary.append(s)
+
+        return summary
+
+    def report(self):
+        """Print a summary of the requests per stage and endpoint family."""
+        summary = self.summary()
+        if not summary:
+            print("Network: no requests.", flush=True)
+            return
+
+        print("Network requests:", flush=True)
+        print(
+            f"  {'stage / endpoint':<44} {'requests':>8} {'received':>10} "
+            f"{'sent':>10} {'retries':>7} {'errors':>6} "
+            f"{'p50 [ms]':>8} {'p90 [ms]':>8} {'p99 [ms]':>8}  status",
+            flush=True,
+        )
+        stage = False
+        for s in summary:
+            if s["stage"] != stage:
+                stage = s["stage"]
+                print(f"  {stage or '(outside of stages)'}", flush=True)
+            latency = "".join(
+                f" {s[p] * 1000:>8.0f}" if "p50" in s else f" {'':>8}"
+                for p in ("p50", "p90", "p99")
+            )
+            status = ", ".join(f"{k}: {v:,}" for k, v in sorted(s["status"].items()))
+            print(
+                f"    {s['family']:<42} {s['requests']:>8,} "
+                f"{profiling.format_bytes(s['received']):>10} "
+                f"{profiling.format_bytes(s['sent']):>10} "
+                f"{s['retries']:>7,} {s['errors']:>6,}{latency}  {status}",
+                flush=True,
+            )
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """HTTP adapter that records each request with the global monitor.
+
+    N.B. for streamed responses (e.g. the large downloads), the latency is
+    the time to the response headers and the bytes received are taken from
+    the Content-Length header. For all other responses, the latency includes
+    reading the body.
+
+    """
+
+    def send(self, request, **kwargs):
+        if MONITOR is None:
+            return super().send(request, **kwargs)
+
+        record = {
+            "stage": profiling.current_stage(),
+            "family": endpoint_family(request.url),
+            "method": request.method,
+            "sent": _body_size(request.body),
+            "received": 0,
+            "retries": 0,
+        }
+        start = perf_counter()
+        try:
+            r = super().send(request, **kwargs)
+            if kwargs.get("stream"):
+                record["received"] = int(r.headers.get("Content-Length") or 0)
+            else:
+                record["received"] = len(r.content)
+        except Exception as e:
+            record.update(status=e.__class__.__name__, latency=perf_counter() - start)
+            MONITOR.add(record)
+            raise
+
+        retries = getattr(r.raw, "retries", None)
+        record.update(
+            status=r.status_code,
+            latency=perf_counter() - start,
+            retries=len(getattr(retries, "history", None) or ()),
+        )
+        MONITOR.add(record)
+        return r
+
+
+def start_monitor():
+    """Start the global network monitor.
+
+    Returns
+    -------
+    NetworkMonitor
+
+    """
+    global MONITOR
+    MONITOR = NetworkMonitor()
+    return MONITOR
+
+
+def instrument(session, pool_maxsize=None):
+    """Mount an `InstrumentedAdapter` on a session (keeping its retries).
+
+    Parameters
+    ----------
+    session :       requests.Session
+                    The session to instrument (e.g. a `FuturesSession` or the
+                    session of a neuPrint client).
+    pool_maxsize :  int, optional
+                    Number of connections to keep open per host. Defaults to
+                    that of the existing adapter.
+
+    Returns
+    -------
+    requests.Session
+                    The same session.
+
+    """
+    for prefix in ("https://", "http://"):
+        current = session.get_adapter(prefix)
+        adapter = InstrumentedAdapter(
+            pool_connections=current._pool_connections,
+            pool_maxsize=pool_maxsize or current._pool_maxsize,
+            max_retries=current.max_retries,
+            pool_block=current._pool_block,
+        )
+        session.mount(prefix, adapter)
+    return session
+
+
+def session():
+    """Create an instrumented `requests.Session`."""
+    return instrument(requests.Session())
+
+
+def retry(url):
+    """Record a retry of a request to `url` (if monitoring)."""
+    if MONITOR is not None:
+        MONITOR.retry(url)
+
+
+def add(records, stage=None):
+    """Add request records from another process (if monitoring).
+
+    Parameters
+    ----------
+    records :   list of dicts
+                As returned by `NetworkMonitor.drain`.
+    stage :     str, optional
+                If provided, the records are attributed to this stage.
+
+    """
+    if MONITOR is None:
+        return
+    for r in records:
+        MONITOR.add({**r, "stage": stage} if stage else r)
+
+
+def endpoint_family(url):
+    """Group a URL into an endpoint family.
+
+    neuPrint requests are grouped by API endpoint, DVID meshes together,
+    downloads from flyem1 by file and everything else (e.g. FlyWire meshes)
+    by host and first path component.
+
+    """
+    url = urlsplit(url)
+    host, path = url.netloc, url.path
+
+    # Requests to the fixture server stand in for the original host
+    if f"{url.scheme}://{host}" == os.environ.get("MCNS_FIXTURE_SERVER"):
+        host, _, path = path.lstrip("/").partition("/")
+        path = "/" + path
+
+    if host == urlsplit(env.NEUPRINT_SERVER).netloc:
+        return f"neuprint {path}"
+    if "/segmentation_meshes/" in path:
+        return "dvid meshes"
+    if host == urlsplit(env.MCNS_FW_MAPPING_URL).netloc:
+        return f"flyem1 {path.rsplit('/', 1)[-1]}"
+    return f"{host}/{path.lstrip('/').split('/')[0]}"
+
+
+def _body_size(body):
+    """Size of a request body in bytes."""
+    if body is None:
+        return 0
+    if isinstance(body, str):
+        return len(body.encode())
+    try:
+        return len(body)
+    except TypeError:  # e.g. a generator
+        return 0
@@ -0,0 +1,384 @@
+"""
+Per-stage timing of the build (see the `--profile` flag of `build_pages.py`).
+
+Stages are timed with the `stage` context manager. This is a no-op unless
+the global profiler has been started (see `start_profiler`), so it can stay
+in the build code::
+
+    with profiling.stage("graph", type=record["type"]):
+        generate_graphs(...)
+
+Stages can be nested: the per-type stages inside `make_dimorphism_pages` are
+recorded as e.g. "dimorphism/graph". Optionally, each top-level stage is also
+run under cProfile and its statistics are dumped to `{stage}.prof` (these can
+be viewed with e.g. `snakeviz` or turned into flame graphs with `flameprof`).
+
+With `memory=True`, the profiler also records the resident set size (RSS)
+and the tracemalloc high-water mark of each stage, plus the largest
+allocations retained by each top-level stage.
+"""
+
+import sys
+import json
+import time
+import cProfile
+import functools
+import threading
+import contextlib
+import tracemalloc
+
+from pathlib import Path
+
+# The global profiler (see `start_profiler`)
+PROFILER = None
+
+# Keys of a record that are measurements (all others are tags)
+_METRICS = ("stage", "items", "wall", "cpu", "rss", "rss_peak", "py_peak")
+
+
+class Profiler:
+    """Record wall time, CPU time and item counts for stages of the build.
+
+    N.B. CPU time and memory are measured for the whole process, i.e. they
+    include any threads running concurrently (e.g. while loading) but not the
+    thumbnail worker processes. Thumbnails rendered by the workers are
+    recorded via `record` instead.
+
+    Parameters
+    ----------
+    stats_dir : Path, optional
+                If provided, each top-level stage is run under cProfile and
+                its statistics are written to `{stats_dir}/{stage}.prof`.
+    memory :    bool
+                If True, also record the peak RSS (`rss_peak`) and peak
+                memory allocated by Python and numpy (`py_peak`) for each
+                stage, in bytes. This uses tracemalloc which slows down the
+                build considerably. Peak RSS can only be tracked per stage
+                on Linux; elsewhere it is the peak of the process so far.
+    top :       int
+                With `memory=True`, the number of largest allocations to
+                record for each top-level stage.
+
+    """
+
+    def __init__(self, stats_dir=None, memory=False, top=10):
+        self.stats_dir = Path(stats_dir) if stats_dir else None
+        self.memory = memory
+        self.top = top
+        self.records = []
+        self._stack = []
+        self._lock = threading.Lock()
+        if self.stats_dir:
+            self.stats_dir.mkdir(parents=True, exist_ok=True)
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def __repr__(self):
+        return f"<Profiler(records={len(self.records):,})>"
+
+    @contextlib.contextmanager
+    def stage(self, name, **tags):
+        """Time a stage.
+
+        Parameters
+        ----------
+        name :      str
+                    Name of the stage.
+        **tags
+                    Added to the record, e.g. the cell type.
+
+        Yields
+        ------
+        dict
+                    The record for this stage. The number of items can be set
+                    via its `items` key or `count`.
+
+        """
+        parent = self._stack[-1]["stage"] + "/" if self._stack else ""
+        record = {"stage": parent + name, **tags}
+        record["items"] = None
+
+        # cProfile can't be nested, so we only profile top-level stages
+        profile = None
+        if self.stats_dir and not self._stack:
+            profile = cProfile.Profile()
+
+        snapshot = None
+        if self.memory:
+            snapshot = self._start_memory(record)
+
+        self._stack.append(record)
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.stats_dir / f"{name}.prof")
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            self._stack.pop()
+            if self.memory:
+                self._stop_memory(record, snapshot)
+            with self._lock:
+                self.records.append(record)
+
+    def _start_memory(self, record):
+        """Reset the memory high-water marks at the start of a stage."""
+        # The peaks so far count towards the parent stage
+        if self._stack:
+            self._update_peaks(self._stack[-1])
+        record["rss_peak"] = record["py_peak"] = 0
+
+        _reset_peak_rss()
+        tracemalloc.reset_peak()
+
+        # Only top-level stages get the (expensive) list of largest allocations
+        if not self._stack:
+            return _snapshot()
+
+    def _stop_memory(self, record, snapshot):
+        """Record the memory high-water marks at the end of a stage."""
+        self._update_peaks(record)
+        record["rss"] = _rss()[0]
+        if self._stack:
+            parent = self._stack[-1]
+            parent["rss_peak"] = max(parent["rss_peak"], record["rss_peak"])
+            parent["py_peak"] = max(parent["py_peak"], record["py_peak"])
+
+        if snapshot is not None:
+            stats = _snapshot().compare_to(snapshot, "lineno")
+            record["top_allocations"] = [
+                {
+                    "location": str(stat.traceback[0]),
+                    "size": stat.size_diff,
+                    "count": stat.count_diff,
+                }
+                for stat in stats[: self.top]
+                if stat.size_diff > 0
+            ]
+
+    @staticmethod
+    def _update_peaks(record):
+        record["rss_peak"] = max(record["rss_peak"], _rss()[1])
+        record["py_peak"] = max(record["py_peak"], tracemalloc.get_traced_memory()[1])
+
+    def count(self, n=1):
+        """Add to the number of items of the current stage."""
+        if self._stack:
+            record = self._stack[-1]
+            record["items"] = (record["items"] or 0) + n
+
+    def record(self, name, wall, cpu=None, **tags):
+        """Record a stage that was timed elsewhere (e.g. in a worker)."""
+        record = {"stage": name, **tags, "items": None, "wall": wall, "cpu": cpu}
+        with self._lock:
+            self.records.append(record)
+
+    def summary(self):
+        """Summarise the records by stage.
+
+        Returns
+        -------
+        list of dicts
+                    One per stage (in order of first completion) with the
+                    number of `calls`, the total `wall` and `cpu` time and
+                    the total number of `items`. With memory tracking, also
+                    the maximum `rss_peak` and `py_peak` of any call.
+
+        """
+        summary = {}
+        for r in self.records:
+            s = summary.setdefault(
+                r["stage"], {"stage": r["stage"], "calls": 0, "wall": 0, "cpu": 0}
+            )
+            s["calls"] += 1
+            s["wall"] += r["wall"]
+            s["cpu"] += r["cpu"] or 0
+            if r["items"] is not None:
+                s["items"] = s.get("items", 0) + r["items"]
+            for key in ("rss_peak", "py_peak"):
+                if key in r:
+                    s[key] = max(s.get(key, 0), r[key])
+        return list(summary.values())
+
+    def slowest(self, N=10):
+        """The N slowest records that are tagged (e.g. with a type)."""
+        tagged = [r for r in self.records if _tags(r)]
+        return sorted(tagged, key=lambda r: r["wall"], reverse=True)[:N]
+
+    def report(self, N=10):
+        """Print a summary of the stages and the slowest individual records."""
+        print("Build profile:", flush=True)
+        header = (
+            f"  {'stage':<36} {'calls':>7} {'wall [s]':>10} {'cpu [s]':>10} "
+            f"{'items':>9}"
+        )
+        if self.memory:
+            header += f" {'rss peak':>10} {'py peak':>10}"
+        print(header, flush=True)
+        for s in self.summary():
+            line = (
+                f"  {s['stage']:<36} {s['calls']:>7,} {s['wall']:>10.2f} "
+                f"{s['cpu']:>10.2f} "
+                + (f"{s['items']:>9,}" if "items" in s else f"{'':>9}")
+            )
+            if "rss_peak" in s:
+                line += f" {format_bytes(s['rss_peak']):>10}"
+                line += f" {format_bytes(s['py_peak']):>10}"
+            print(line, flush=True)
+
+        slowest = self.slowest(N)
+        if slowest:
+            print(f"Slowest {len(slowest)}:", flush=True)
+            for r in slowest:
+                tags = ", ".join(f"{k}={v}" for k, v in _tags(r).items())
+                print(f"  {r['wall']:>8.2f}s  {r['stage']} ({tags})", flush=True)
+
+        if self.memory:
+            print("Largest allocations retained by each stage:", flush=True)
+            for r in self.records:
+                if not r.get("top_allocations"):
+                    continue
+                print(f"  {r['stage']}:", flush=True)
+                for a in r["top_allocations"][:N]:
+                    print(
+                        f"    {format_bytes(a['size']):>10}  {a['location']}",
+                        flush=True,
+                    )
+
+    def write(self, filepath, **extra):
+        """Write the summary and all records (plus any `extra` data) as JSON."""
+        with open(filepath, "w") as f:
+            json.dump(
+                {"summary": self.summary(), "records": self.records, **extra},
+                f,
+                indent=2,
+                default=str,
+            )
+
+
+def start_profiler(stats_dir=None, memory=False):
+    """Start the global profiler.
+
+    Parameters
+    ----------
+    stats_dir : Path, optional
+                Directory to write cProfile statistics for each top-level
+                stage to.
+    memory :    bool
+                Whether to also track memory (see `Profiler`).
+
+    Returns
+    -------
+    Profiler
+
+    """
+    global PROFILER
+    PROFILER = Profiler(stats_dir, memory=memory)
+    return PROFILER
+
+
+def stage(name, **tags):
+    """Time a stage with the global profiler (no-op if it isn't started).
+
+    See `Profiler.stage` for details.
+
+    """
+    if PROFILER is None:
+        return contextlib.nullcontext({})
+    return PROFILER.stage(name, **tags)
+
+
+def current_stage():
+    """Path of the innermost running stage (None if not profiling)."""
+    if PROFILER is None or not PROFILER._stack:
+        return None
+    return PROFILER._stack[-1]["stage"]
+
+
+def profiled(func):
+    """Decorator to time each call of a function as a stage named after it."""
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with stage(func.__name__):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def count(n=1):
+    """Add to the number of items of the current stage (if profiling)."""
+    if PROFILER is not None:
+        PROFILER.count(n)
+
+
+def record(name, wall, cpu=None, **tags):
+    """Record a stage timed elsewhere (if profiling)."""
+    if PROFILER is not None:
+        PROFILER.record(name, wall, cpu, **tags)
+
+
+def format_bytes(n):
+    """Format a number of bytes, e.g. 1536 -> "1.5 KB"."""
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}" if unit != "B" else f"{n} B"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def _tags(record):
+    """The tags of a record (e.g. the cell type)."""
+    return {
+        k: v for k, v in record.items() if k not in _METRICS and k != "top_allocations"
+    }
+
+
+def _snapshot():
+    """Take a tracemalloc snapshot without the profiling overhead."""
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, contextlib.__file__),
+        ]
+    )
+
+
+def _rss():
+    """Current and peak resident set size of this process in bytes."""
+    try:
+        # Linux
+        with open("/proc/self/status", "r") as f:
+            status = dict(line.split(":", 1) for line in f if ":" in line)
+        return (
+            int(status["VmRSS"].split()[0]) * 1024,
+            int(status["VmHWM"].split()[0]) * 1024,
+        )
+    except (OSError, KeyError, ValueError):
+        pass
+
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0, 0
+
+    # N.B. the current RSS is not available here
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        peak *= 1024  # kilobytes everywhere but macOS
+    return peak, peak
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS of this process (Linux only)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
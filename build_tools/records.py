@@ -0,0 +1,159 @@
+"""
+The per-type records that the type, overview and grouping pages are built from.
+
+A `TypeRecord` holds only the (agglomerated) meta data columns that the
+templates and groupings actually use plus a few derived fields. Fields live
+in `__slots__` instead of a per-type dict, and records are shared by
+reference between the overview, region, supertype, synonym and hemilineage
+groupings.
+
+Fields that were never set behave like missing dictionary keys: `get`
+returns the default and the Jinja templates render them as empty (just like
+an undefined key), so the pages look exactly as before.
+"""
+
+
+class TypeRecord:
+    """Data for a single (dimorphic, sex-specific or isomorphic) cell type.
+
+    Records can be accessed like dictionaries (`record["type"]`,
+    `record.get("synonyms")`) or via attributes (`record.type`).
+
+    Attributes
+    ----------
+    type, mapping, supertype, synonyms, ... : str
+        The MaleCNS columns (see `MCNS_COLUMNS`), agglomerated over the
+        type's neurons (see `aggregation.agglomerate`): a single value, a
+        sorted "; "-joined string or "N/A". Female-specific types take
+        these from the FlyWire neurons where they exist.
+    super_class, top_nt, ... : str
+        The FlyWire columns (see `FW_COLUMNS`), as above. For dimorphic and
+        isomorphic types these come from the matching FlyWire neurons (if
+        any).
+    body_ids, root_ids : np.ndarray
+        The int64 IDs of the type's MaleCNS and FlyWire neurons (sorted by
+        position in the meta data). These are views into a single array per
+        table, not copies.
+    bodyId, root_id : str
+        The above as sorted "; "-joined strings (read-only, only built when
+        accessed, e.g. when rendering a template).
+    type_file : str
+        File name (without extension) for the type's page and thumbnail.
+    label : str
+        Label to show for the type.
+    dimorphism_type : str
+        "dimorphic", "male-specific", "female-specific" or "isomorphic".
+    n_mcnsr, n_mcnsl, n_fwr, n_fwl : int
+        Number of neurons per side in MaleCNS and FlyWire.
+    url, neuprint_url, neuprint_conn_url : str
+        Links to Neuroglancer and neuPrint.
+    synonyms_linked : str
+        The synonyms with links to their pages.
+    graph_file_mcns_rel, graph_file_fw_rel : str
+        Relative paths to the network graphs.
+    roi_counts : dict
+        The mean "pre_norm" and "post_norm" ROI profiles of the type.
+    closest_types : list of dicts
+        The types with the most similar ROI profiles.
+
+    """
+
+    # Meta data columns kept from the MaleCNS and FlyWire tables
+    MCNS_COLUMNS = (
+        "type",
+        "mapping",
+        "superclass",
+        "class",
+        "supertype",
+        "synonyms",
+        "itoleeHl",
+        "trumanHl",
+        "flywireType",
+        "hemibrainType",
+        "mancType",
+        "matchingNotes",
+        "consensusNt",
+        "somaNeuromere",
+        "mcnsSerial",
+    )
+    FW_COLUMNS = (
+        "super_class",
+        "cell_class",
+        "hemibrain_type",
+        "ito_lee_hemilineage",
+        "matching_notes",
+        "top_nt",
+    )
+    COLUMNS = MCNS_COLUMNS + FW_COLUMNS
+
+    # Fields derived while compiling the records and building the pages
+    DERIVED = (
+        "body_ids",
+        "root_ids",
+        "type_file",
+        "label",
+        "dimorphism_type",
+        "n_mcnsr",
+        "n_mcnsl",
+        "n_fwr",
+        "n_fwl",
+        "url",
+        "neuprint_url",
+        "neuprint_conn_url",
+        "synonyms_linked",
+        "graph_file_mcns_rel",
+        "graph_file_fw_rel",
+        "roi_counts",
+        "closest_types",
+    )
+
+    __slots__ = COLUMNS + DERIVED
+    _FIELDS = frozenset(__slots__ + ("bodyId", "root_id"))
+
+    def __init__(self, **fields):
+        self.update(fields)
+
+    def __repr__(self):
+        return (
+            f"<TypeRecord(type={self.get('type')!r}, "
+            f"dimorphism_type={self.get('dimorphism_type')!r})>"
+        )
+
+    @property
+    def bodyId(self):
+        return _join_ids(self.body_ids)
+
+    @property
+    def root_id(self):
+        return _join_ids(self.root_ids)
+
+    def __getitem__(self, key):
+        if key not in self._FIELDS or not hasattr(self, key):
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self._FIELDS and hasattr(self, key)
+
+    def get(self, key, default=None):
+        """Get a field (or `default` if it has not been set)."""
+        if key not in self._FIELDS:
+            return default
+        return getattr(self, key, default)
+
+    def update(self, fields):
+        """Set multiple fields from a dictionary."""
+        for key, value in fields.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        """All fields that have been set as a dictionary."""
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}
+
+
+def _join_ids(ids):
+    """Join IDs into a sorted "; "-separated string (as `agglomerate` would)."""
+    return "; ".join(sorted(ids.astype(str)))
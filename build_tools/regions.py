@@ -0,0 +1,193 @@
+"""
+Per-neuron ROI profiles used to sort cell types into brain regions.
+
+This module deliberately only depends on pandas/numpy so that it can be
+imported (and benchmarked) without setting up any of the remote clients.
+"""
+
+import numpy as np
+import pandas as pd
+
+# MaleCNS mushroom body compartments that are combined to align with FlyWire
+MB_COMPARTMENTS = {
+    "aL": "MB_VL",
+    "a'L": "MB_VL",
+    "gL": "MB_ML",
+    "bL": "MB_ML",
+    "b'L": "MB_ML",
+    "PED": "MB_PED",
+}
+
+
+def collapse_roi(roi):
+    """Collapse left and right ROIs, e.g. "AL(L)" -> "AL"."""
+    return roi.replace("(L)", "").replace("(R)", "")
+
+
+def roi_profiles(roi_info, id_col, rename=None):
+    """Compile normalised, left/right-collapsed ROI profiles for each neuron.
+
+    Parameters
+    ----------
+    roi_info :  pd.DataFrame
+                Per-neuron ROI info with `id_col`, `roi`, `pre` and `post`
+                columns. Not modified.
+    id_col :    str
+                The column with the neuron IDs.
+    rename :    dict, optional
+                Maps (collapsed) ROIs to new names, e.g. `MB_COMPARTMENTS`.
+                ROIs mapped to the same name are combined.
+
+    Returns
+    -------
+    pd.DataFrame
+                One row per neuron and ROI with `id_col`, `roi` (categorical),
+                `pre_norm` and `post_norm` columns. The latter are the fraction
+                of each neuron's pre-/postsynapses in that ROI.
+
+    """
+    # Rename the unique ROIs only instead of every row
+    codes, rois = pd.factorize(roi_info["roi"])
+    rois = pd.Index([collapse_roi(r) for r in rois])
+    if rename:
+        rois = rois.map(lambda r: rename.get(r, r))
+    roi_codes, rois = pd.factorize(rois, sort=True)
+    codes = np.where(codes >= 0, roi_codes[codes], -1)
+
+    # Combine rows that now have the same ROI
+    profiles = (
+        pd.DataFrame(
+            {
+                id_col: roi_info[id_col].values,
+                "roi": pd.Categorical.from_codes(codes, categories=rois),
+                "pre": roi_info["pre"].values,
+                "post": roi_info["post"].values,
+            }
+        )
+        .groupby([id_col, "roi"], observed=True, sort=True)[["pre", "post"]]
+        .sum()
+        .reset_index()
+    )
+
+    # Normalise by each neuron's total number of pre-/postsynapses
+    totals = profiles.groupby(id_col)[["pre", "post"]].transform("sum")
+    for col in ("pre", "post"):
+        profiles[f"{col}_norm"] = (
+            (profiles[col] / totals[col]).fillna(0).astype(np.float32)
+        )
+
+    return profiles[[id_col, "roi", "pre_norm", "post_norm"]]
+
+
+def group_roi_profiles(profiles, groups, id_col):
+    """Average the ROI profiles of neurons in each group.
+
+    Parameters
+    ----------
+    profiles :  pd.DataFrame
+                Per-neuron ROI profiles as returned by `roi_profiles`.
+    groups :    pd.Series
+                Maps neuron IDs (index) to groups (values). A neuron can be
+                in multiple groups.
+    id_col :    str
+                The column in `profiles` with the neuron IDs.
+
+    Returns
+    -------
+    pre, post : pd.DataFrame
+                Dense group x ROI matrices (sorted by group and ROI) with the
+                mean `pre_norm` and `post_norm`, respectively. As in the
+                per-neuron profiles, only neurons with synapses in a given ROI
+                contribute to its mean. ROIs in which none of a group's
+                neurons have synapses are NaN.
+
+    """
+    groups = pd.DataFrame(
+        {id_col: groups.index.values, "group": groups.values}
+    ).drop_duplicates()
+
+    mean = (
+        profiles.merge(groups, on=id_col, how="inner")
+        .groupby(["group", "roi"], observed=True, sort=True)[["pre_norm", "post_norm"]]
+        .mean()
+    )
+
+    pre = mean["pre_norm"].unstack("roi")
+    post = mean["post_norm"].unstack("roi").reindex_like(pre)
+
+    return pre, post
+
+
+class ProfileIndex:
+    """Nearest-neighbour index over ROI profiles using cosine similarity.
+
+    Similarities are computed as batched matrix products of the L2-normalised
+    profiles, so the memory footprint is `batch_size` x N rather than N x N.
+
+    Parameters
+    ----------
+    features :  (N, M) array
+                One ROI profile (e.g. input and output fractions per ROI) per
+                row. NaNs are treated as zeros.
+
+    """
+
+    def __init__(self, features):
+        features = np.nan_to_num(np.asarray(features, dtype=np.float32))
+        norms = np.linalg.norm(features, axis=1, keepdims=True)
+        self._features = np.divide(
+            features, norms, out=np.zeros_like(features), where=norms > 0
+        )
+
+    def __len__(self):
+        return len(self._features)
+
+    def __repr__(self):
+        n, m = self._features.shape
+        return f"<ProfileIndex(profiles={n:,}, features={m:,})>"
+
+    def knn(self, N=10, batch_size=1_024):
+        """Find the N most similar profiles for every profile.
+
+        Parameters
+        ----------
+        N :         int
+                    Number of neighbours. Profiles never count as their own
+                    neighbour.
+        batch_size : int
+                    Number of profiles to compare against all others at once.
+
+        Returns
+        -------
+        neighbours :    (len(self), N) int array
+                        Indices of the neighbours sorted by descending
+                        similarity. -1 where there are fewer than N profiles
+                        with a non-zero similarity.
+        similarity :    (len(self), N) float array
+                        The corresponding cosine similarities.
+
+        """
+        n = len(self)
+        N = min(N, max(n - 1, 0))
+        neighbours = np.full((n, N), -1, dtype=np.int64)
+        similarity = np.zeros((n, N), dtype=np.float32)
+        if N == 0:
+            return neighbours, similarity
+
+        for start in range(0, n, batch_size):
+            stop = min(start + batch_size, n)
+            sim = self._features[start:stop] @ self._features.T
+            sim[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+
+            # Pick the top N (unordered) and then sort only those
+            top = np.argpartition(-sim, N - 1, axis=1)[:, :N]
+            top_sim = np.take_along_axis(sim, top, axis=1)
+            order = np.argsort(-top_sim, axis=1, kind="stable")
+            top = np.take_along_axis(top, order, axis=1)
+            top_sim = np.take_along_axis(top_sim, order, axis=1)
+
+            valid = top_sim > 0
+            neighbours[start:stop] = np.where(valid, top, -1)
+            similarity[start:stop] = np.where(valid, top_sim, 0)
+
+        return neighbours, similarity
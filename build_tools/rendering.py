@@ -0,0 +1,155 @@
+"""
+The thumbnail rendering stack: offscreen octarine viewers with navis meshes.
+
+This module is imported lazily by `thumbnails.py` (and in the worker
+processes) so that builds without thumbnails never import octarine, navis or
+cloudvolume.
+"""
+
+import time
+import navis
+
+import numpy as np
+import octarine as oc
+
+from pathlib import Path
+
+from . import env, network
+from .meshes import fetch_flywire_meshes, fetch_mcns_meshes
+
+navis.patch_cloudvolume()
+
+# Camera settings for the different kinds of thumbnails
+VIEWS = {
+    # Brain and VNC neurons
+    "cns": {
+        "position": np.array([-380324.37368731, 274816.33737857, 570152.25830276]),
+        "rotation": np.array([-0.7110673, -0.03489443, 0.70219136, 0.00964166]),
+        "scale": np.array([1.0, 1.0, 1.0]),
+        "reference_up": np.array([0.0, -1.0, 0.0]),
+        "fov": 0.0,
+        "width": 766557.316514536,
+        "height": 766557.316514536,
+        "zoom": 1.0,
+        "maintain_aspect": True,
+        "depth_range": None,
+    },
+    # Just VNC neurons
+    "vnc": {
+        "position": np.array([389551.99130054, -255612.95457865, 608158.34951343]),
+        "rotation": np.array([0.54627717, 0.54208679, -0.45810277, 0.4448202]),
+        "scale": np.array([1.0, 1.0, 1.0]),
+        "reference_up": np.array([0.0, 0.0, 1.0]),
+        "fov": 0.0,
+        "width": 525756.094337834,
+        "height": 525756.094337834,
+        "zoom": 1.0,
+        "maintain_aspect": True,
+        "depth_range": None,
+    },
+    # Just brain neurons
+    "brain": {
+        "position": np.array([387225.3840714, 229749.96777565, 95873.17475057]),
+        "rotation": np.array([1.0, 0.0, 0.0, 0.0]),
+        "scale": np.array([1.0, 1.0, 1.0]),
+        "reference_up": np.array([0.0, -1.0, 0.0]),
+        "fov": 0.0,
+        "width": 480452.4541556888,
+        "height": 480452.4541556888,
+        "zoom": 1.0,
+        "maintain_aspect": True,
+        "depth_range": None,
+    },
+}
+
+# Which shell meshes to show for each view
+VIEW_SHELLS = {"cns": ("BRAIN", "VNC"), "vnc": ("VNC",), "brain": ("BRAIN",)}
+
+# Per-worker state (see `init_worker`)
+_VIEWER = None
+_SHELLS = None
+_MONITOR_NETWORK = False
+
+
+def init_worker(monitor_network=False):
+    """Set up the offscreen viewer and shell meshes for this process.
+
+    Parameters
+    ----------
+    monitor_network :   bool
+                        If True, record the requests made by this worker and
+                        return them with each thumbnail (see `render`).
+
+    """
+    global _VIEWER, _SHELLS, _MONITOR_NETWORK
+
+    if monitor_network:
+        network.start_monitor()
+        _MONITOR_NETWORK = True
+
+    _SHELLS = env.BACKEND.fetch_shells()
+    _VIEWER = oc.Viewer(offscreen=True)
+
+
+def render(job):
+    """Render a single thumbnail (runs in the worker processes).
+
+    Returns
+    -------
+    dict
+                The `wall` and `cpu` time it took to render the thumbnail.
+                If the worker monitors the network, also the `requests` it
+                made since the last thumbnail (see `network.NetworkMonitor`).
+
+    """
+    wall, cpu = time.perf_counter(), time.process_time()
+    if _VIEWER is None:
+        init_worker()
+
+    print(f"  Generating thumbnail {Path(job['outfile']).name}...", flush=True)
+
+    # Hide progress bars while loading meshes
+    # (there is currently no way to do that with navis.read_precomputed)
+    # N.B. with `n_workers=0` this runs in the main process, so we have to
+    # show them again afterwards
+    navis.config.pbar_hide = True
+    try:
+        # Get FlyWire and MCNS meshes (from the local cache if possible)
+        fw_meshes = navis.NeuronList(
+            [
+                navis.read_precomputed(data, datatype="mesh", info=False, id=id)
+                for id, data in fetch_flywire_meshes(job["root_ids"]).items()
+            ]
+        )
+        mcns_meshes = navis.NeuronList(
+            [
+                navis.read_precomputed(data, datatype="mesh", info=False, id=id)
+                for id, data in fetch_mcns_meshes(job["body_ids"]).items()
+            ]
+        )
+    finally:
+        # Show progress bars again
+        navis.config.pbar_hide = False
+
+    try:
+        # Add neurons to viewer
+        if len(fw_meshes):
+            _VIEWER.add_neurons(fw_meshes, color="#e511d0")
+        if len(mcns_meshes):
+            _VIEWER.add_neurons(mcns_meshes, color="#00e9e7")
+
+        for shell in VIEW_SHELLS[job["view"]]:
+            _VIEWER.add_mesh(_SHELLS[shell], color=(0.8, 0.8, 0.8), alpha=0.1)
+        _VIEWER.set_view(VIEWS[job["view"]])
+
+        _VIEWER.screenshot(job["outfile"], size=(600, 400))
+    finally:
+        _VIEWER.clear()
+
+    result = {
+        "wall": time.perf_counter() - wall,
+        "cpu": time.process_time() - cpu,
+    }
+    if _MONITOR_NETWORK:
+        result["requests"] = network.MONITOR.drain()
+    return result
@@ -0,0 +1,233 @@
+"""
+Rendering of thumbnail images across a pool of offscreen octarine viewers.
+
+Each worker process owns its own offscreen viewer with the brain and VNC
+shell meshes preloaded. Jobs for type, supertype and synonym thumbnails are
+all submitted to the same queue (see `generate_thumbnail`) and the results
+are collected at the end of the build (see `wait_for_thumbnails`).
+
+The rendering stack (octarine, navis, cloudvolume) lives in `rendering.py`
+and is only imported once the first thumbnail is actually rendered.
+"""
+
+import os
+import multiprocessing as mp
+
+import pandas as pd
+
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from . import network, profiling
+
+# The global thumbnail engine (see `start_thumbnail_engine`)
+ENGINE = None
+
+
+class ThumbnailEngine:
+    """Render thumbnails in parallel across a pool of worker processes.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+                Number of worker processes. Defaults to the number of CPUs.
+                If 0, thumbnails are rendered serially in the main process.
+
+    """
+
+    def __init__(self, n_workers=None):
+        self.n_workers = os.cpu_count() if n_workers is None else n_workers
+        self._executor = None
+        self._futures = {}
+        self._queued = set()
+
+    def __repr__(self):
+        return (
+            f"<ThumbnailEngine(n_workers={self.n_workers}, "
+            f"queued={len(self._futures)})>"
+        )
+
+    def submit(self, mcns_meta, fw_meta, outfile):
+        """Queue a thumbnail for rendering.
+
+        Parameters
+        ----------
+        mcns_meta : pd.DataFrame
+                    Meta data of male CNS neurons to include in the thumbnail.
+        fw_meta :   pd.DataFrame
+                    Meta data of FlyWire neurons to include in the thumbnail.
+        outfile :   Path
+                    Path to write the file to. If a job for the same file has
+                    already been queued, this one is skipped (i.e. the first
+                    job wins, just like when rendering serially).
+
+        """
+        # Types, supertypes and synonyms share a thumbnail directory. With
+        # workers, the first file might not exist yet when a second job for
+        # it is submitted
+        if self.n_workers != 0:
+            path = Path(outfile).resolve()
+            if path in self._queued:
+                print(
+                    f"  Thumbnail {path.name} already queued, skipping...",
+                    flush=True,
+                )
+                return
+            self._queued.add(path)
+
+        job = _make_job(mcns_meta, fw_meta, outfile)
+
+        # Import the rendering stack only when we actually render something
+        from . import rendering
+
+        if self.n_workers == 0:
+            timing = rendering.render(job)
+            profiling.record("render", file=Path(outfile).name, **timing)
+            return
+
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.n_workers,
+                mp_context=mp.get_context("spawn"),
+                initializer=rendering.init_worker,
+                initargs=(network.MONITOR is not None,),
+            )
+        future = self._executor.submit(rendering.render, job)
+        self._futures[future] = Path(outfile).name
+
+    def wait(self):
+        """Wait for all queued thumbnails to finish rendering.
+
+        Returns
+        -------
+        n_failed :  int
+                    Number of thumbnails that failed to render.
+
+        """
+        n_failed = 0
+        for future in as_completed(self._futures):
+            try:
+                timing = future.result()
+                network.add(timing.pop("requests", ()), stage="render")
+                profiling.record("render", file=self._futures[future], **timing)
+            except Exception as e:
+                print(
+                    f"  Failed to generate thumbnail {self._futures[future]}: {e}",
+                    flush=True,
+                )
+                n_failed += 1
+        # (finished thumbnails exist now, see `generate_thumbnail`)
+        self._futures = {}
+        self._queued = set()
+
+        return n_failed
+
+    def shutdown(self):
+        """Wait for all queued thumbnails and shut down the worker processes."""
+        n_failed = self.wait()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return n_failed
+
+
+def start_thumbnail_engine(n_workers=None):
+    """Start the global thumbnail engine.
+
+    Parameters
+    ----------
+    n_workers : int, optional
+                Number of worker processes. Defaults to the number of CPUs.
+                If 0, thumbnails are rendered serially in the main process.
+
+    Returns
+    -------
+    ThumbnailEngine
+
+    """
+    global ENGINE
+    if ENGINE is not None:
+        ENGINE.shutdown()
+    ENGINE = ThumbnailEngine(n_workers)
+    return ENGINE
+
+
+def wait_for_thumbnails():
+    """Wait for all queued thumbnails and shut down the global engine."""
+    global ENGINE
+    if ENGINE is None:
+        return
+
+    print("Waiting for thumbnails to finish rendering...", flush=True)
+    n_failed = ENGINE.shutdown()
+    ENGINE = None
+    print(f"Done ({n_failed:,} failed).", flush=True)
+
+
+def generate_thumbnail(
+    mcns_meta: pd.DataFrame,
+    fw_meta: pd.DataFrame,
+    outfile: Path,
+    skip_existing: bool = True,
+):
+    """Queue a thumbnail image for the given neurons.
+
+    The thumbnail is rendered asynchronously by the global thumbnail engine
+    (which is started if necessary). Use `wait_for_thumbnails` to wait for
+    all thumbnails to finish.
+
+    Parameters
+    ----------
+    mcns_meta : pd.DataFrame
+                Meta data of male CNS neurons to include in the thumbnail.
+    fw_meta :   iterable | None
+                Meta data of FlyWire neurons to include in the thumbnail.
+    outfile :   Path
+                Path to write the file to.
+    skip_existing : bool
+                If True, will skip thumbnails that already exist.
+
+    """
+    # Check if the output file already exists
+    if skip_existing and outfile.exists():
+        print(f"  Thumbnail {outfile.name} already exists, skipping...", flush=True)
+        return
+
+    if ENGINE is None:
+        start_thumbnail_engine()
+
+    ENGINE.submit(mcns_meta, fw_meta, outfile)
+
+
+def _make_job(mcns_meta, fw_meta, outfile):
+    """Compile the (picklable) data a worker needs to render a thumbnail."""
+    # What kind of neurons do we have?
+    if not mcns_meta.empty:
+        table = mcns_meta
+    else:
+        table = fw_meta
+    sc_col = "superclass" if "superclass" in table.columns else "super_class"
+    superclasses = set(table[sc_col].dropna().values)
+    has_ascending = bool(
+        superclasses & {"ascending_neuron", "ascending", "sensory_ascending"}
+    )
+    has_descending = bool(
+        superclasses & {"descending_neuron", "descending", "sensory_descending"}
+    )
+    has_central = bool(superclasses & {"cb_intrinsic", "central"})
+    has_vnc = "vnc_intrinsic" in superclasses
+
+    # Pick a view based on the neuron type
+    if has_ascending or has_descending or (has_central and has_vnc):
+        view = "cns"
+    elif has_vnc:
+        view = "vnc"
+    else:
+        view = "brain"
+
+    return {
+        "body_ids": mcns_meta["bodyId"].tolist() if not mcns_meta.empty else [],
+        "root_ids": fw_meta["root_id"].tolist() if not fw_meta.empty else [],
+        "view": view,
+        "outfile": str(Path(outfile).resolve()),
+    }
@@ -2,7 +2,7 @@
 Clear the build directory.
 """
 
-from build_tools import loading, building
+from build_tools import building
 
 
 if __name__ == "__main__":
@@ -0,0 +1,21 @@
+"""
+Record a fixture directory from the local cache (run a regular build first).
+
+Builds can then run without network access via:
+
+    MCNS_FIXTURES=path/to/fixtures uv run build_pages.py
+"""
+
+import argparse
+
+from build_tools import backends
+
+parser = argparse.ArgumentParser(
+    description="Record fixtures for offline builds from the local cache."
+)
+parser.add_argument("directory", help="Directory to write the fixtures to.")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    backends.record_fixtures(args.directory)